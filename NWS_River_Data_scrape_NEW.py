@@ -10,56 +10,55 @@ from loguru import logger
 LOGGING_LEVEL = "INFO"
 
 from os import sys, path
+import heapq
+import time
+from operator import itemgetter
 from datetime import datetime# , timezone
 #from dateutil import parser as dateparser
-from dateparser.search import search_dates
 from pprint import saferepr
-import cfsiv_utils.WebScraping as ws
-from lxml import etree as ET
+import re
+from urllib.parse import urlparse, parse_qs
+
+import metrics
+import resilient_fetch as rf
+import river_config as rc
+import runtime_profile as rp
+# dateparser, cfsiv_utils.WebScraping and lxml are imported where they are used.
+# They take seconds to load on the Pi and the bot imports this module only for its constants at startup.
 
 
 RUNTIME_NAME = path.basename(__file__)
 Data_datestamp = datetime.now()
 
-ACTION_LABELS = ["First-action", "Minor-flood", "Moderate-flood", "Major-flood"]
-
-MARKLAND_DAM_URL = "https://water.weather.gov/ahps2/hydrograph.php?wfo=iln&gage=mklk2"
-MARKLAND_DAM_NAME = "Markland"
-
-MCALPINE_DAM_URL = "https://water.weather.gov/ahps2/hydrograph.php?gage=mluk2&wfo=lmk"
-MCALPINE_DAM_NAME = "McAlpine"
-
-MCALPINE_DAM_DETAILS = {
-    "Friendly_Name": "McAlpine Dam Upper Guage",
-    "Dam_URL": MCALPINE_DAM_URL,
-    "milemarker": 606.8,
-    "guage_elevation": 407.18,
-    "ordinary_high_water": 420,
-    ACTION_LABELS[0]: 21,
-    ACTION_LABELS[1]: 23,
-    ACTION_LABELS[2]: 30,
-    ACTION_LABELS[3]: 38,
-}
-
-MARKLAND_DAM_DETAILS = {
-    "Friendly_Name": "Markland Dam Lower Guage",
-    "Dam_URL": MARKLAND_DAM_URL,
-    "milemarker": 531,
-    "guage_elevation": 408,
-    "ordinary_high_water": 442.3,
-    ACTION_LABELS[0]: 49,
-    ACTION_LABELS[1]: 51,
-    ACTION_LABELS[2]: 62,
-    ACTION_LABELS[3]: 74,
-}
-
-RIVER_MONITORING_POINTS = {
-    MCALPINE_DAM_NAME: MCALPINE_DAM_DETAILS,
-    MARKLAND_DAM_NAME: MARKLAND_DAM_DETAILS,
-}
-
-DAMS = list(RIVER_MONITORING_POINTS.keys())
+ACTION_LABELS = rc.ACTION_LABELS
+
+# every guage of every enabled river in rivers.json (see river_config.py)
+RIVER_MONITORING_POINTS = rc.monitoring_points()
+
+# the bot reports the level at the point of interest between these two guages
+POINT_OF_INTEREST = rc.point_of_interest()
+MARKLAND_DAM_NAME = POINT_OF_INTEREST["upstream"]
+MCALPINE_DAM_NAME = POINT_OF_INTEREST["downstream"]
+MARKLAND_DAM_DETAILS = RIVER_MONITORING_POINTS[MARKLAND_DAM_NAME]
+MCALPINE_DAM_DETAILS = RIVER_MONITORING_POINTS[MCALPINE_DAM_NAME]
+MARKLAND_DAM_URL = MARKLAND_DAM_DETAILS["Dam_URL"]
+MCALPINE_DAM_URL = MCALPINE_DAM_DETAILS["Dam_URL"]
+
+DAMS = [MCALPINE_DAM_NAME, MARKLAND_DAM_NAME]
 IMPORTANT_OBSERVATIONS = ['Latest  observed', 'Highest  Forecast:']
+DAMS_DEADLINE = 2 * 60  # seconds to fetch every dam before processRiverData gives up
+FETCH_WORKERS = rf.FETCH_WORKERS  # hydrograph pages fetched at once
+SNAPSHOT_MAX_AGE = 2 * 60 * 60  # seconds, older observations from the scraper daemon are scraped again
+LOCAL_TIMEZONE = "America/New_York"  # NWS hydrographs show local time
+SNAPSHOT_READER = None
+# hydrograph titles end like '... at 10:00 AM EST 10/19'
+AREA_DATE_PATTERN = re.compile(r"(\d{1,2}:\d{2})\s*([AP]M)\s+[A-Z]{3}\s+(\d{1,2})/(\d{1,2})")
+
+
+def guage_lid(monitoring_point):
+    """Return the NWS location id (ex: 'MKLK2') of a monitoring point taken from its 'gage=' URL parameter."""
+    query = parse_qs(urlparse(RIVER_MONITORING_POINTS[monitoring_point]["Dam_URL"]).query)
+    return query["gage"][0].upper()
 
 
 @logger.catch
@@ -77,15 +76,121 @@ def ISO_datestring(dt, cl):
     return isodatestr
 
 
+def map_areas(raw_html):
+    """Yield (alt, title) of each <area> in the first <map> of a hydrograph page.
+    The page is read as a stream and every element is discarded once it has been seen,
+    so no tree or soup of the whole page is ever held in memory.
+    """
+    from io import BytesIO
+    from lxml import etree as ET
+
+    if isinstance(raw_html, str):
+        raw_html = raw_html.encode("utf-8")
+    for _event, element in ET.iterparse(BytesIO(raw_html), events=("end",), html=True, recover=True):
+        parent = element.getparent()
+        if element.tag == "area" and parent is not None and parent.tag == "map":
+            yield (element.get("alt"), element.get("title"))
+        elif element.tag == "map":
+            return  # only the first map holds the hydrograph points
+        element.clear(keep_tail=True)
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+
+
+def area_date(title, year=None, now=None):
+    """Datetime of a hydrograph title in the fixed NWS format, or None if it does not match.
+    The title has no year: without 'year' it is the year that puts the date closest to 'now' (default
+    the current time), so a late December reading scraped in early January stays in December.
+    """
+    found = AREA_DATE_PATTERN.search(title)
+    if found is None:
+        return None
+    clock, meridiem, month, day = found.groups()
+    now = now or datetime.now()
+    dates = []
+    for candidate in [year] if year else [now.year - 1, now.year, now.year + 1]:
+        try:
+            dates.append(datetime.strptime(f"{candidate} {month}/{day} {clock} {meridiem}", "%Y %m/%d %I:%M %p"))
+        except ValueError:  # 02/29 of a year that is not a leap year, or not a date at all
+            continue
+    if not dates:
+        return None
+    return min(dates, key=lambda date: abs(date - now))
+
+
+def fetch_page(monitoring_point, fetch=None):
+    """Return the raw hydrograph page of a monitoring point, None on failure."""
+    this_river = RIVER_MONITORING_POINTS[monitoring_point]
+    logger.info("Scraping webite..." + saferepr(this_river["Friendly_Name"]))
+    return metrics.call("fetch", fetch or rf.fetch, this_river["Dam_URL"])
+
+
+@logger.catch
+def stream_river_conditions(monitoring_point, dct, fetch=None):
+    """Low memory version of current_river_conditions used by the 'pi' runtime profile."""
+    return stream_page_conditions(monitoring_point, fetch_page(monitoring_point, fetch), dct)
+
+
 @logger.catch
-def current_river_conditions(monitoring_point, dct):
+def stream_page_conditions(monitoring_point, raw_html, dct, cleaned=False):
+    """Only the IMPORTANT_OBSERVATIONS are kept as the map areas of the page stream past and their dates
+    are read with a fixed pattern, dateparser (tens of MB) is only loaded for a title that does not match.
+    Every area is cleaned once to filter it, cleaned=True keeps that clean_item entry instead of the raw one.
+    """
+    this_river = RIVER_MONITORING_POINTS[monitoring_point]
+    if raw_html is None:
+        logger.error(f'No "HTML" returned in web scrape of {this_river["Friendly_Name"]}')
+        return {}  # error condition
+    for alt, title in map_areas(raw_html):
+        if alt is None or title is None:
+            continue
+        child_list = alt.split()
+        child_list.extend([this_river["milemarker"], monitoring_point, this_river["guage_elevation"]])
+        sani = clean_item(list(child_list))
+        if not sani or sani[0] not in IMPORTANT_OBSERVATIONS:
+            continue
+        child_date = area_date(title)
+        if child_date is None:
+            from dateparser.search import search_dates
+
+            searchdate = search_dates(title, languages=["en"])
+            if type(searchdate) != list:
+                logger.debug(f"no date found in {saferepr(title)}")
+                continue
+            child_date = searchdate[0][1]
+        date_iso = ISO_datestring(child_date, child_list)
+        child_list.append(date_iso)
+        observation_key = date_iso + monitoring_point
+        if observation_key in dct:
+            logger.error(f"duplicate key! {observation_key}")
+            continue
+        # the date is appended last and clean_item leaves it untouched, so this equals clean_item(child_list)
+        dct[observation_key] = sani + [date_iso] if cleaned else child_list
+    return dct
+
+
+@logger.catch
+@metrics.timed("current_river_conditions")
+def current_river_conditions(monitoring_point, dct, fetch=None):
     """ scrape NOAA website for current river conditions.
     Write results to PupDB file and include current flooding action level
+    fetch: optional function returning the raw page of a url (recorded pages in tests and replays)
     """
+    return page_river_conditions(monitoring_point, fetch_page(monitoring_point, fetch), dct)
+
+
+@logger.catch
+def page_river_conditions(monitoring_point, raw_html, dct):
+    """Add the map entries of a hydrograph page already fetched to dct (see current_river_conditions)."""
+    if rp.setting("streaming_parse"):
+        return stream_page_conditions(monitoring_point, raw_html, dct)
+    from bs4 import BeautifulSoup
+    from dateparser.search import search_dates
+    from lxml import etree as ET
+
     # TODO this routine is too fragile and needs better error handling
     this_river = RIVER_MONITORING_POINTS[monitoring_point]
-    logger.info("Scraping webite..." + saferepr(this_river["Friendly_Name"]))
-    html = ws.retrieve_cleaned_html(this_river["Dam_URL"])
+    html = None if raw_html is None else BeautifulSoup(raw_html, "html.parser")
     if html != None:
         logger.info('...scanning list of "map" objects...')
         map_raw = html.select("map")[0]  # grab first item named 'map'
@@ -167,30 +272,113 @@ def clean_item(lst):
 
 
 @logger.catch
-def processRiverData():
+def dam_observations(monitoring_point, raw_html):
+    """The IMPORTANT_OBSERVATIONS of one hydrograph page as (key, cleaned entry) pairs sorted by key.
+    Every entry is cleaned exactly once.
+    """
+    entries = rp.BoundedDict(rp.setting("max_observations"))
+    if rp.setting("streaming_parse"):  # already filtered and cleaned as the page streamed past
+        streamed = stream_page_conditions(monitoring_point, raw_html, entries, cleaned=True)
+        return sorted(streamed.items()) if streamed else []
+    raw = page_river_conditions(monitoring_point, raw_html, entries)
+    if not raw:
+        return []
+    observations = []
+    for key, entry in raw.items():
+        sani = clean_item(list(entry))
+        if sani and sani[0] in IMPORTANT_OBSERVATIONS:
+            logger.debug(f"Important observation found. Raw item: {saferepr(entry)} Cleaned item: {sani}")
+            observations.append((key, sani))
+    observations.sort(key=itemgetter(0))
+    return observations
+
+
+def fetch_pages(points, fetch, workers=FETCH_WORKERS):
+    """Fetch the hydrograph page of every monitoring point at once, yield (point, raw_html) as each arrives."""
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(points)))) as executor:
+        futures = {executor.submit(fetch_page, name, fetch): name for name in points}
+        for future in as_completed(futures):
+            yield (futures.pop(future), future.result())
+
+
+@logger.catch
+@metrics.timed("processRiverData")
+def processRiverData(fetch=None, points=None, workers=FETCH_WORKERS):
     """get current data from NOAA website.
     Organize data as dictionary keyed by timestamps+damname.
+    fetch: optional function returning the raw page of a url (see current_river_conditions)
+    points: names in RIVER_MONITORING_POINTS, all of DAMS by default. Their pages are fetched
+    concurrently, each one is parsed and cleaned once as it arrives and the per dam lists
+    (sorted by timestamp) are combined with a k-way merge.
     """
     logger.info("Process River Data Start: " + RUNTIME_NAME)
-    results = {}
-    for name in DAMS:
+    points = DAMS if points is None else list(points)
+    if fetch is None:
+        # every dam must be fetched within DAMS_DEADLINE, a failing NWS host is skipped by its circuit breaker
+        sweep = rf.Sweep(DAMS_DEADLINE)
+        fetch = lambda url: rf.fetch(url, sweep, cache=rf.PAGE_CACHE)
+    per_dam = []
+    for name, raw_html in fetch_pages(points, fetch, workers):
         logger.info(f"Getting conditions for {name}")
-        results = current_river_conditions(name, results)
-        if results == {} or results == None:
+        observations = dam_observations(name, raw_html)
+        del raw_html  # only the cleaned observations are kept
+        if not observations:
             logger.error(f"Empty dict returned for dam: {name}")
             return []  # error condition
-        times = list(results.keys())
-        times = sorted(times)
-        output = {}
-        for item in times:
-            sani = clean_item(results[item])
-            if sani[0] in IMPORTANT_OBSERVATIONS:
-                logger.debug("Important observation found.")
-                logger.debug(f"Raw item: {saferepr(results[item])}")
-                # sani = clean_item(results[item])
-                logger.debug(f"Cleaned item: {sani}")
-                output[item] = sani
-    return output
+        per_dam.append(observations)
+    return dict(heapq.merge(*per_dam, key=itemgetter(0)))
+
+
+def _snapshot_entry(tag, stamp, level, monitoring_point):
+    """A processRiverData style entry built from a snapshot record."""
+    from zoneinfo import ZoneInfo
+
+    details = RIVER_MONITORING_POINTS[monitoring_point]
+    local = datetime.fromtimestamp(stamp, ZoneInfo(LOCAL_TIMEZONE))
+    date_iso = local.isoformat()[0:16]
+    entry = [tag, f"{level:.2f}", local.strftime("%I:%M%p").lstrip("0"), local.strftime("%p"),
+             local.strftime("%m/%d"), details["milemarker"], monitoring_point, details["guage_elevation"], date_iso]
+    return (date_iso + monitoring_point, entry)
+
+
+@logger.catch
+def river_data_from_snapshot(max_age=SNAPSHOT_MAX_AGE, now=None):
+    """Build the processRiverData result from the scraper daemon's latest snapshot.
+    Returns None unless every dam has an observation younger than max_age seconds.
+    """
+    import latest_snapshot as ls
+
+    global SNAPSHOT_READER
+    if SNAPSHOT_READER is None:
+        SNAPSHOT_READER = ls.SnapshotReader()
+    if not SNAPSHOT_READER.refresh():
+        return None
+    now = time.time() if now is None else now
+    output = {}
+    for name in DAMS:
+        record = SNAPSHOT_READER.lookup(guage_lid(name))
+        if record is None or record[1] == 0 or now - record[1] > max_age:
+            logger.info(f"No recent snapshot reading for {name}, scraping NWS.")
+            return None
+        _lid, obs_time, obs_level, _obs_flow, fcst_time, fcst_level = record
+        key, entry = _snapshot_entry(IMPORTANT_OBSERVATIONS[0], obs_time, obs_level, name)
+        output[key] = entry
+        if fcst_time:
+            key, entry = _snapshot_entry(IMPORTANT_OBSERVATIONS[1], fcst_time, fcst_level, name)
+            output[key] = entry
+    logger.info(f"River data taken from snapshot generation {SNAPSHOT_READER.generation()}.")
+    return dict(sorted(output.items()))
+
+
+@logger.catch
+def latest_river_data():
+    """The scraper daemon's snapshot when it is recent, otherwise a new scrape of every dam."""
+    data = river_data_from_snapshot()
+    if data:
+        return data
+    return processRiverData()
 
 
 @logger.catch
@@ -9,99 +9,70 @@ A seperate program runs to analyze data and tweet when there is info to share.
 If tweeting reports rising water then additional runs of scraping routine can be triggered.
 """
 # import standard library modules
+import importlib
 import os
-from time import sleep
+from functools import partial
 
 # import custom modules
 from pathlib import Path
-from bs4 import BeautifulSoup, Comment
 import datetime as dt
-from numpy import datetime64
 import pytz
-from tqdm import tqdm
-from dateparser.search import search_dates
 from loguru import logger
 
-# this section imports code from the pypi repository (CFSIV-utils-Conradical) of my own utilities.
-import cfsiv_utils.WebScraping as ws
-import cfsiv_utils.filehandling as fh
-import cfsiv_utils.time_strings as ts
-import cfsiv_utils.log_handling as lh
+# Heavy modules (bs4, pandas, dateparser via cfsiv_utils) are imported on first use through LazyModule
+# so that cron-launched runs and other modules importing this one start quickly.
+# The cfsiv_utils modules come from the pypi repository (CFSIV-utils-Conradical) of my own utilities.
+
+import html_backend as hb
+import latest_snapshot as ls
+import metrics
+import profiling_hooks as ph
+import resilient_fetch as rf
+import river_config as rc
+import scrape_pipeline as pl
+import storage_paths as sp
+
+
+class LazyModule:
+    """Stands in for a module and imports it the first time one of its attributes is used."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __getattr__(self, attribute):
+        return getattr(importlib.import_module(self.name), attribute)
+
+
+ts = LazyModule("cfsiv_utils.time_strings")
+ws = LazyModule("cfsiv_utils.WebScraping")
+fh = LazyModule("cfsiv_utils.filehandling")
+bs4 = LazyModule("bs4")
+np = LazyModule("numpy")
+pd = LazyModule("pandas")
+ga = LazyModule("guage_archive")
+rollups = LazyModule("rollups")
 
 RUNTIME_NAME = Path(__file__)
 
-# These are the USGS identification numbers for river monitoring guages on the OHIO River
-RIVER_GUAGE_IDS = [
-    141893,
-    143063,
-    144287,
-    142160,
-    145137,
-    143614,
-    141268,
-    144395,
-    143843,
-    142481,
-    143607,
-    145086,
-    142497,
-    151795,
-    152657,
-    141266,
-    145247,
-    143025,
-    142896,
-    144670,
-    145264,
-    144035,
-    143875,
-    143847,
-    142264,
-    152144,
-    143602,
-    144126,
-    146318,
-    141608,
-    144451,
-    144523,
-    144877,
-    151578,
-    142935,
-    142195,
-    146116,
-    143151,
-    142437,
-    142855,
-    142537,
-    142598,
-    152963,
-    143203,
-    143868,
-    144676,
-    143954,
-    143995,
-    143371,
-    153521,
-    153530,
-    143683,
-]
-
-USGS_WEBSITE_HEAD_URL = 'https://water.weather.gov//ahps2/river.php?wfo=lmk&wfoid=18699&riverid=204624&pt[]='
-USGS_WEBSITE_TAIL_URL = '&allpoints=150960&data[]=obs&data[]=xml'
+# The NWS river point ids of every enabled river (the Ohio by default) are listed in rivers.json.
+# Adding a river there adds its points to the sweep, see river_config.py.
+RIVER_GUAGE_IDS = [point for river in rc.rivers() for point in river["river_points"]]
 
 # build urls...
-USGS_URLS = []
-for site in RIVER_GUAGE_IDS:
-    USGS_URLS.append(f'{USGS_WEBSITE_HEAD_URL}{site}{USGS_WEBSITE_TAIL_URL}')
+USGS_URLS = rc.river_point_urls()
 
-# TODO need guage location and relative elevation data dictionary
+# DONE, guage location and relative elevation data are in rivers.json
 
 # TODO visualize data from guages to illustrate how a 'hump' of water moves down the river.
 # possibly by graphing the guages as a flat surface and the water elevation above that imagined flat river.
 
-# TODO predict the time of arrival of the 'hump' at various points. (machine learning?)
+# DONE, predict the time of arrival of the 'hump' at various points. see flood_wave.py
 
+# CSV_DATA/<yyyy>/<mm>/<dd>/<scrape time>_<guage>: the readings of one scrape that were new or revised since the
+# previous scrape of the guage (see change_ingest.py), not the whole scrape. Every whole scrape is
+# summarized in the scrape index of the guage archive (ARCHIVE/<guage>.scrapes, see guage_archive.py).
 OUTPUT_ROOT = "CSV_DATA/"
+SNAPSHOT_WRITER = None  # latest_snapshot.SnapshotWriter, created on the first scrape
 
 
 
@@ -128,7 +99,7 @@ def pull_details(soup):
     guage_id = soup.h1["id"]
     guage_name_string = soup.h1.string
     # find the comments.
-    comments = soup.findAll(text=lambda text: isinstance(text, Comment))
+    comments = soup.findAll(text=lambda text: isinstance(text, bs4.Comment))
     # convert the findAll.ResultSet into a plain list.
     c_list = [c for c in comments]
     # Search the comments for a date of this scrape.
@@ -148,7 +119,7 @@ def get_NWS_web_data(site, cache=False):
     along with the ID# and TEXT describing the guage data.
     If CACHE then place the cleaned HTML into local storage for later processing by other code.
     """
-    clean_soup = ws.retrieve_cleaned_html(site, cache)
+    clean_soup = metrics.call("retrieve_cleaned_html", ws.retrieve_cleaned_html, site, cache)
     if clean_soup == None:
         logger.debug(f'Error retreiving web data for: {site}')
         return None
@@ -182,6 +153,7 @@ def FixDate(s, scrape_date, time_zone="UTC"):
 
 
 @logger.catch
+@metrics.timed("sort_and_label_data")
 def sort_and_label_data(web_data, guage_id, guage_string, scrape_date):
     readings = []
     labels = ["datetime", "level", "flow"]
@@ -213,35 +185,153 @@ def sort_and_label_data(web_data, guage_id, guage_string, scrape_date):
 
 
 @logger.catch
-def Main():
-    # for point in POINTS_OF_INTEREST:
-    for point in USGS_URLS:
-        logger.debug(f'Scraping point: {point}')
-        time_now_string = ts.UTC_NOW_STRING()
-        webdata = get_NWS_web_data(point, cache=True)       
-        if webdata != None: 
-            raw_data, guage_id, friendly_name, scrape_date = webdata
-            # TODO verify webscraping success
-            # DONE, store raw_data for ability to work on dates problem over the newyear transition.
-            # It will be helpfull to have 12/28 to  January 4 scrapes for repeated test processing.
-            # NOTE: cache=True above is used to make a local copy in the CWD of the original HTML scrape.
-            data_list = sort_and_label_data(raw_data, guage_id, friendly_name, scrape_date)
-            # TODO verify successful conversion of data
-            for item in tqdm(data_list, desc=friendly_name):
-                logger.debug(item)
-                date, time = time_now_string.split("_")  # split date from time
-                yy, mm, dd = date.split("-")
-                OP = f"{yy}/{mm}/{dd}/"
-                OD = f"{OUTPUT_ROOT}{OP}"
-                FN = f"{time_now_string}"
-                fh.write_csv([item], filename=FN, directory=OD)
-            sleep(1)  # guarantee next point of interest gets a new timestamp.
-            # some scrapes process in under 1 second and result in data collision.
-            logger.info(time_now_string)
-        else:
-            logger.debug(f'Error while scraping point: {point}')
-            logger.debug(f'No data collected for: {point}')
-    return True
+@metrics.timed("label_sections")
+def label_sections(sections, guage_id, scrape_date):
+    """Same output as sort_and_label_data but from the (title, cells) sections of html_backend.extract_page."""
+    readings = []
+    labels = ["datetime", "level", "flow"]
+    for title, cells in sections:
+        sect_name = title.split()[0]  # locate the name of this section (observed / forecast)
+        row_dict = {"guage": guage_id, "type": sect_name}
+        for i, element in enumerate(cells):
+            pointer = i % 3  # each reading contains 3 unique data points
+            if pointer == 0:  # this is the element for date/time
+                element = ts.timefstring(FixDate(element, scrape_date))
+            row_dict[labels[pointer]] = element
+            if pointer == 2:  # end of this reading
+                readings.append(row_dict)
+                row_dict = {"guage": guage_id, "type": sect_name}
+    return readings
+
+
+@logger.catch
+def parse_guage_page(raw_html, backend=None):
+    """Parse a raw river.php page into (readings, guage_id, friendly_name, scrape_date).
+    backend is one of html_backend.BACKENDS, the fastest available one is used by default.
+    """
+    page = hb.extract_page(raw_html, backend)
+    if page is None:
+        return None
+    guage_id, friendly_name, comments, sections = page
+    # (the NWS webscrape contains exactly 1 date/timestamp of the scrape found inside of a comment).
+    scrape_date = extract_date(comments)
+    logger.info(f"Scrape date: {scrape_date}")
+    return (label_sections(sections, guage_id, scrape_date), guage_id, friendly_name, scrape_date)
+
+
+@logger.catch
+def get_guage_readings(site, cache=False, backend=None, sweep=None):
+    """Scrape a guage page and return (readings, guage_id, friendly_name, scrape_date).
+    If CACHE then place the raw HTML into local storage for later processing by other code.
+    sweep: resilient_fetch.Sweep whose deadline limits the request and its retries
+    """
+    raw_html = metrics.call("fetch", rf.fetch, site, sweep)
+    if raw_html == None:
+        logger.debug(f'Error retreiving web data for: {site}')
+        return None
+    if cache:
+        ws.save_html_text(raw_html)
+    return parse_guage_page(raw_html, backend)
+
+
+def scrape_stages(sweep=None, cache=True, backend=None, workers=1):
+    """The fetch -> parse -> normalize -> dedupe -> store stages of a sweep (see scrape_pipeline.py)."""
+    return [
+        partial(pl.fetch_stage, sweep=sweep, cache=cache, workers=workers),
+        partial(pl.parse_stage, parse=partial(parse_guage_page, backend=backend)),
+        pl.normalize_stage,
+        pl.dedupe_stage,
+        partial(pl.sink_stage, sinks=[store_scrape]),
+    ]
+
+
+def write_changes(changes, filename, directory):
+    """fh.write_csv logs its errors instead of raising them, tell from the file whether the rows were written."""
+    path = fh.check_and_validate_fname(filename, Path(Path.cwd(), directory))
+    size = path.stat().st_size if path.exists() else 0
+    fh.write_csv(changes, filename=filename, directory=directory)
+    return path.exists() and path.stat().st_size > size
+
+
+@logger.catch
+def store_scrape(item):
+    """Store the new or revised readings of one scrape and publish its latest readings.
+    Returns True once they are in CSV_DATA, the scrape pipeline then commits their last-seen state.
+    """
+    # TODO verify webscraping success
+    # DONE, store raw_data for ability to work on dates problem over the newyear transition.
+    # It will be helpfull to have 12/28 to  January 4 scrapes for repeated test processing.
+    # NOTE: cache=True in scrape_stages is used to make a local copy in the CWD of the original HTML scrape.
+    # only readings that are new or were revised by NWS since the last scrape are stored.
+    time_now_string, changes = item["scrape_time"], item["changes"]
+    stored = True
+    if changes:
+        date, time = time_now_string.split("_")  # split date from time
+        yy, mm, dd = date.split("-")
+        OP = f"{yy}/{mm}/{dd}/"
+        OD = f"{OUTPUT_ROOT}{OP}"
+        FN = f"{time_now_string}_{item['guage']}"  # guages scraped in the same second get their own file
+        stored = write_changes(changes, FN, OD)
+        if not stored:
+            logger.error(f"{item['guage']}: {len(changes)} readings of {time_now_string} not stored, the next scrape retries them.")
+    if stored:  # the retry of changes that were not stored archives them then, not twice
+        archive_readings(changes, item["readings"], time_now_string)
+    publish_latest(item["guage"], item["readings"])
+    logger.info(time_now_string)
+    return stored
+
+
+def _result(item):
+    return None if item["readings"] is None else (item["readings"], item["friendly_name"])
+
+
+@logger.catch
+def scrape_point(point, sweep=None):
+    """Scrape one guage, store its readings and return them along with the friendly name of the guage.
+    Returns None if nothing was collected.
+    """
+    for item in pl.pipeline([point], *scrape_stages(sweep), queue_size=0):
+        return _result(item)
+    return None
+
+
+@logger.catch
+def archive_readings(changes, data_list, time_now_string):
+    """Also append the stored readings to the binary per-guage archive, index the scrape and
+    update the rollups of the hours, days and months it touched (see guage_archive.py and rollups.py).
+    """
+    archive = ga.GuageArchive()
+    archive.record_scrape_readings(data_list, ga.epoch_minute(time_now_string))
+    written = archive.append_readings(changes)
+    rollups.RollupStore(archive).update_readings(changes)
+    return written
+
+
+@logger.catch
+def publish_latest(guage_id, data_list):
+    """Share the latest readings of this guage with local readers (see latest_snapshot.py)."""
+    global SNAPSHOT_WRITER
+    if SNAPSHOT_WRITER is None:
+        SNAPSHOT_WRITER = ls.SnapshotWriter()
+    return SNAPSHOT_WRITER.update(guage_id, data_list)
+
+
+@logger.catch
+def Main(points=USGS_URLS, deadline=rf.SWEEP_DEADLINE, queue_size=None, workers=rf.FETCH_WORKERS):
+    """Scrape every point once within 'deadline' seconds. Returns {point: scrape_point result} of the points reached.
+    The stages overlap, at most queue_size scrapes wait between two of them and 'workers' pages
+    are fetched at once (see scrape_pipeline.py).
+    """
+    if queue_size is None:
+        # a profiled sweep runs the stages in this thread so cProfile sees them
+        queue_size = 0 if ph.armed() else pl.QUEUE_SIZE
+    results = {}
+    with ph.profiled_cycle(RUNTIME_NAME.stem):
+        for item in pl.pipeline(points, *scrape_stages(rf.Sweep(deadline), workers=workers), queue_size=queue_size):
+            results[item["point"]] = _result(item)
+    collected = sum(1 for result in results.values() if result is not None)
+    logger.info(f"Sweep collected {collected} of {len(points)} guages.")
+    return results
 
 
 @logger.catch
@@ -266,9 +356,7 @@ def display_cached_data(number_of_scrapes):
         data_list = []
         with open(fl, "r") as txtfile:
             raw_html = txtfile.read()
-        soup = BeautifulSoup(raw_html, "html.parser")
-        raw_data, guage_id, friendly_name, scrape_date = pull_details(soup)
-        data_list = sort_and_label_data(raw_data, guage_id, friendly_name, scrape_date)
+        data_list, guage_id, friendly_name, scrape_date = parse_guage_page(raw_html)
         data_list = data_list[::-1]
         for i in range(9):
             data_sample.append(data_list[i])
@@ -285,7 +373,6 @@ def display_cached_data(number_of_scrapes):
     return
 
 
-import pandas as pd
 @logger.catch
 def display_cached_forecast_data(number_of_scrape_data_events):
     logger.debug(f'Reviewing {number_of_scrape_data_events} previous webscrapes.')
@@ -326,38 +413,30 @@ def display_cached_forecast_data(number_of_scrape_data_events):
 # from datetime import datetime
 @logger.catch
 def display_cached_forecast_data2(number_of_scrape_data_events):
+    """Show the highest forecast of the last scrapes of every guage.
+    The CSV_DATA files only hold what each scrape changed, the highest forecast of every whole
+    scrape is kept in the scrape index of the guage archive (see guage_archive.py).
+    """
     logger.debug(f'Reviewing {number_of_scrape_data_events} previous data gathered.')
-    files = fh.get_files(Path(OUTPUT_ROOT), pattern='*') # My files dont all have .csv extensions for some dumb reason
-    # remove the NOT files entries
-    files = [file for file in files if file.is_file()]
-    # sort the list oldest to newest
-    files.sort(key=lambda fn: fn.stat().st_mtime, reverse=True)
-    # recover the scrapes
-    logger.debug(f'Loaded {len(files)} scrapes.')
-    # logger.debug(files)
-    scrapes = files[:number_of_scrape_data_events]
-    logger.debug(f'filtered {len(scrapes)} scrapes.')    
-    data_sample = pd.DataFrame() # blank frame
-    for fl in scrapes:
-        if fl.is_file():
-            logger.info(f'Loading file: {fl}')
-            # df = pd.read_csv(fl, parse_dates=['datetime'], date_parser=custom_date_parser)
-            df = pd.read_csv(fl)
-            df["datetime"]= pd.to_datetime(df["datetime"], format="%Y-%m-%d_%H:%M:%SUTC", errors='coerce')
-            # extract only forecast data
-            forecasts = df[df.type == 'Forecast']
-            # sort to find highest
-            highest = forecasts.sort_values(by=['level'], ascending=False)
-            # logger.info(f'Highest..\n{highest[:1].to_markdown()}')
-            data_sample = pd.concat([data_sample, highest[:1]], axis=0)
-    # logger.debug(data_sample)
-    # logger.info(f'\n{data_sample.to_markdown()}')
-    # logger.info(data_sample.info())
+    if not Path(sp.ARCHIVE_ROOT).is_dir():
+        logger.warning(f"No guage archive at {sp.ARCHIVE_ROOT}, see guage_archive.py to convert CSV_DATA.")
+        return
+    archive = ga.GuageArchive()
+    frames = []
+    for guage in archive.guages():
+        scrapes = np.array(archive.scrapes(guage)[-number_of_scrape_data_events:])
+        scrapes = scrapes[~np.isnan(scrapes["forecast_level"])]
+        logger.info(f'{guage}: {len(scrapes)} scrapes with a forecast.')
+        frames.append(pd.DataFrame({
+            "guage": guage,
+            "scrape_time": ga.to_datetime64(scrapes["scrape_minute"]),
+            "datetime": ga.to_datetime64(scrapes["forecast_minute"]),
+            "level": scrapes["forecast_level"],
+        }))
+    data_sample = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
     if data_sample.empty == False:
-        # logger.debug(data_sample.dtypes)
         data_sample.sort_values(by='datetime', inplace=True)
         data_sample.reset_index(drop=True, inplace=True)
-        # logger.debug(forecasts_data)
         # display only highest level and date
         logger.debug(f'\n{data_sample.to_markdown()}')
         logger.debug(data_sample.info())
@@ -366,15 +445,16 @@ def display_cached_forecast_data2(number_of_scrape_data_events):
 
 
 if __name__ == "__main__":
+    import cfsiv_utils.log_handling as lh
+
     # Logging Setup
     lh.defineLoggers(
         RUNTIME_NAME.stem, # Path.stem returns only the name of the file without extension.
         CONSOLE='ERROR' # supress most output to console.
     )
-    while True:
-        Main()
-        print("Sleeping...")
-        total_sleep = 60 * 60 * 6
-        for s in range(total_sleep):
-            sleep(1)
-            print(f"\r {total_sleep - s}         ", end="", flush=True)
+    # each guage is polled on its own schedule, the guages due together are scraped as one sweep
+    # over the shared connection pool. see polling_scheduler.py
+    from polling_scheduler import PollingScheduler
+    metrics.serve(metrics.SCRAPER_METRICS_PORT)
+    ph.install()  # RIVERBOT_PROFILE_CYCLES or SIGUSR1 profile the next scrapes
+    PollingScheduler(USGS_URLS).run(Main, after_cycle=lambda: metrics.dump_json(RUNTIME_NAME.stem), batch=True)
@@ -5,7 +5,9 @@
 based on the NWS website data for the river level both upstream and downstream then calculating 
 the slope of the river to get the calculated level at our property. 
 """
+from functools import partial
 from pprint import saferepr
+import queue
 import sys
 import time
 import zoneinfo
@@ -13,32 +15,37 @@ import zoneinfo
 Zone_NYC = zoneinfo.ZoneInfo("America/New_York")
 from datetime import datetime
 from datetime import timedelta
-from dateutil import parser
 
-# from NWS_River_Data_scrape import calculated_Bushmans_river_level as get_level
-from NWS_River_Data_scrape_NEW import processRiverData as get_level_data
+# NOTE: twython, dateutil, pupdb, dotenv and the NWS scraping code are imported on first use.
+# Importing them here cost seconds on every cron-launched run of the Pi.
+# (see startup_benchmark.py and test_startup.py for the enforced import time budget)
 
 # from NWS_River_Data_scrape_NEW import RIVER_MONITORING_POINTS
 from NWS_River_Data_scrape_NEW import MCALPINE_DAM_NAME as DNRIVERDAM
 from NWS_River_Data_scrape_NEW import MARKLAND_DAM_NAME as UPRIVERDAM
-
-from pupdb.core import PupDB
-
-# detect various add-on Rpi hats
-try:
-    SenseHatLoaded = True
-    from sense_hat import SenseHat
-    from random_colors import Set_Random_Pixels, random_to_solid
-
-    SENSEHAT = SenseHat()
-except ImportError as e:
-    SenseHatLoaded = False
+from NWS_River_Data_scrape_NEW import POINT_OF_INTEREST
+import metrics
+import profiling_hooks as ph
+import runtime_profile as rp
+
+# detect various add-on Rpi hats (on first use, see DetectSenseHat)
+SenseHatLoaded = None
+SENSEHAT = None
+
+# outbound tweets (see tweet_queue.py and publishers.py), opened on first use
+TWEET_QUEUE = None
+TWEET_SENDER = None
+SENT_TWEETS = queue.Queue()  # tweets the sender thread got out, recorded in PupDB by the main loop
+PUBLISHER = None
+FLOOD_ALERTS = None  # flood_alerts.SnapshotWatcher started by Main
+TREND_ENGINE = None  # trend_engine.TrendEngine fed by assemble_text and the flood alert watcher
 
 PUPDB_FILENAME = "SVTB-DB.json_db"
 PUPDB_MRT_KEY = "MostRecentTweet"
 PUPDB_MRL_KEY = "MostRecentRiverLevel"
 PUPDB_MRF_KEY = "MostRecentForecastLevel"
 PUPDB_ACTION_KEY = "CurrentFloodingActionLevel"
+PUPDB_TWEET_PREFIX = "Tweet@"
 HIGHEST_OBSERVATION_TAG = "Highest  Observation:"
 LATEST_OBSERVATION_TAG = "Latest  observed"
 NOAA_FORECAST_TAG = "Highest  Forecast:"
@@ -52,6 +59,7 @@ ACTION_LABELS = [
     "Major-flood",
 ]
 MINIMUM_CONCERN_LEVEL = 30
+RISE_LOOKAHEAD_HOURS = 6  # QuantifyFlooding acts on the level a rising river reaches this soon
 TWEET_FREQUENCY = [
     18000,
     9000,
@@ -66,19 +74,10 @@ TWEET_FREQUENCY = [
 
 # ACTION_LEVELS = [21, 23, 30, 38]
 # ACTION_DICT = dict(zip(ACTION_LEVELS, ACTION_LABELS))
-LOCATION_OF_INTEREST = 584  # river mile marker @ Bushman's Lake
+LOCATION_OF_INTEREST = POINT_OF_INTEREST["milemarker"]  # river mile marker @ Bushman's Lake (see rivers.json)
 
 
-from twython import Twython, TwythonError
-from dotenv import dotenv_values
-
-TwitterCredentials = dotenv_values(".env")
-TWITTER_CREDENTIALS = (
-    TwitterCredentials["APP_KEY"],
-    TwitterCredentials["APP_SECRET"],
-    TwitterCredentials["OAUTH_TOKEN"],
-    TwitterCredentials["OAUTH_TOKEN_SECRET"],
-)
+CREDENTIALS_FILE = ".env"
 
 
 from os import sys, path
@@ -91,6 +90,54 @@ logger.remove()  # stop any default logger
 LOGGING_LEVEL = "INFO"
 
 
+@logger.catch
+def load_credentials(env_file=CREDENTIALS_FILE):
+    """Read the Twitter credentials from the .env file. Called at startup, not at import."""
+    from dotenv import dotenv_values
+
+    TwitterCredentials = dotenv_values(env_file)
+    return (
+        TwitterCredentials["APP_KEY"],
+        TwitterCredentials["APP_SECRET"],
+        TwitterCredentials["OAUTH_TOKEN"],
+        TwitterCredentials["OAUTH_TOKEN_SECRET"],
+    )
+
+
+LEVEL_DATA_CACHE = None
+# Tweets are 1 to 5 hours apart (TWEET_FREQUENCY), longer than the cache's TTL, so nearly every read
+# finds the data expired. Serving it stale would tweet the levels of the previous cycle: wait for new data.
+LEVEL_DATA_STALE_FOR = 0
+
+
+def level_data_cache(loader, **options):
+    """The RiverDataCache get_level_data uses, options (ex: clock) go to RiverDataCache."""
+    from river_data_cache import RiverDataCache
+
+    return RiverDataCache(loader, stale_for=LEVEL_DATA_STALE_FOR, **options)
+
+
+def get_level_data():
+    """get current data from NOAA website. (the scraping code is loaded on first call)
+    Every caller shares one cached copy, NOAA is scraped at most once per NWS update (see river_data_cache.py).
+    """
+    # from NWS_River_Data_scrape import calculated_Bushmans_river_level as get_level
+    global LEVEL_DATA_CACHE
+    if LEVEL_DATA_CACHE is None:
+        from NWS_River_Data_scrape_NEW import latest_river_data
+
+        # the scraper daemon's snapshot is used when it is recent (see latest_snapshot.py)
+        LEVEL_DATA_CACHE = level_data_cache(latest_river_data)
+    return LEVEL_DATA_CACHE.get()
+
+
+def level_data_age():
+    """Seconds since the river data used by the bot was scraped (None before the first scrape)."""
+    if LEVEL_DATA_CACHE is None:
+        return None
+    return LEVEL_DATA_CACHE.age()
+
+
 @logger.catch
 def test_tweet(db):
     logger.info(f"Database object: {type(db)}")
@@ -114,28 +161,106 @@ def test_tweet(db):
 
 
 @logger.catch
+@metrics.timed("send_tweet")
 def send_tweet(db, time, tweet, twttr):
     """Accept a database object, datetime object, a tweet string and a Twython object.
-    Place tweet and update filesystem storage to reflect activities.
+    Publish the tweet to every channel of publishers.json and return without waiting for any of them.
+    Without a running tweet sender (tests, memory_harness.py) the tweet queue is sent before returning.
     """
-    # place tweet time into longterm storage
+    # place tweet time into longterm storage, the tweet cadence runs from when it was queued
     db.set(PUPDB_MRT_KEY, str(time))
-    # place tweet into longterm storage. Keep ALL tweets keyed on timestamp
-    tweetKey = f"Tweet@{time}"
-    db.set(tweetKey, tweet)
-    try:
-        twttr.update_status(status=tweet)
-    except TwythonError as e:
-        logger.error(str(e))
-        logger.info("Tweet not sent.")
-    else:
-        logger.info("Tweet sent.")
-    finally:
-        logger.debug("Tweet string = " + str(tweet))
-        logger.info("Length of string = " + str(len(tweet)))
+    logger.debug("Tweet string = " + str(tweet))
+    logger.info("Length of string = " + str(len(tweet)))
+    publisher().publish(tweet, time)
+    if TWEET_SENDER is None:
+        tweet_queue().drain(twttr, partial(record_tweet, db))
     return True
 
 
+@logger.catch
+def record_tweet(db, entry):
+    """Keep a tweet the sender got out. Keep ALL tweets keyed on the time they were queued."""
+    tweetKey = f"{PUPDB_TWEET_PREFIX}{entry['time']}"
+    db.set(tweetKey, entry["status"])
+    prune_tweet_history(db, rp.setting("tweet_history"))
+
+
+def tweet_queue():
+    """The persistent outbound queue (STATE/tweet_queue.json), opened on first use."""
+    global TWEET_QUEUE
+    if TWEET_QUEUE is None:
+        import tweet_queue as tq
+
+        TWEET_QUEUE = tq.TweetQueue()
+    return TWEET_QUEUE
+
+
+def publisher():
+    """Fans tweets out to the channels of publishers.json (see publishers.py), built on first use."""
+    global PUBLISHER
+    if PUBLISHER is None:
+        import publishers
+
+        PUBLISHER = publishers.Publisher(publishers.channels_from_config(tweet_queue=tweet_queue()))
+    return PUBLISHER
+
+
+def start_tweet_sender(twitter):
+    """Post queued tweets from a background thread, including those left from before a restart.
+    PupDB is not thread safe, the sender hands the tweets it got out to SENT_TWEETS for record_sent_tweets.
+    """
+    global TWEET_SENDER
+    import tweet_queue as tq
+
+    TWEET_SENDER = tq.TweetSender(tweet_queue(), twitter, SENT_TWEETS.put).start()
+    return TWEET_SENDER
+
+
+def record_sent_tweets(db):
+    """Record the tweets the sender thread got out since the last call, on the calling (main) thread."""
+    recorded = 0
+    while True:
+        try:
+            entry = SENT_TWEETS.get_nowait()
+        except queue.Empty:
+            return recorded
+        record_tweet(db, entry)
+        recorded += 1
+
+
+def start_flood_alerts():
+    """Publish a flood stage crossing as soon as the scraper daemon's snapshot shows it (see flood_alerts.py).
+    Alerts go out between the scheduled tweets and do not change when the next one is due.
+    Every new reading of the snapshot also goes to the trend engine.
+    """
+    global FLOOD_ALERTS
+    import flood_alerts as fa
+
+    # built here, the watcher thread must not race the main loop to build a second one
+    channels = publisher()
+    trends = trend_engine()
+
+    def publish_alert(alert):
+        channels.publish(fa.alert_text(alert), datetime.now())
+
+    FLOOD_ALERTS = fa.SnapshotWatcher(fa.FloodAlertDetector(), publish_alert, on_reading=trends.add).start()
+    return FLOOD_ALERTS
+
+
+@logger.catch
+def prune_tweet_history(db, keep):
+    """Remove the oldest stored tweets so at most 'keep' remain (None keeps everything).
+    PupDB rereads the whole file on every get and set so an unbounded history slows every call.
+    """
+    if keep is None:
+        return 0
+    tweet_keys = sorted(key for key in db.keys() if key.startswith(PUPDB_TWEET_PREFIX))
+    stale = tweet_keys[:-keep] if keep > 0 else tweet_keys
+    for key in stale:
+        db.remove(key)
+    return len(stale)
+
+
 @logger.catch
 def sanitize(itm):
     """Accept argument as a list of NOAA details.
@@ -273,6 +398,35 @@ def calculate_level(upriver, dnriver):
     return projection
 
 
+def trend_engine():
+    """Rolling rate of rise of the guages and the point of interest (see trend_engine.py), created on first use."""
+    global TREND_ENGINE
+    if TREND_ENGINE is None:
+        import trend_engine as te
+
+        TREND_ENGINE = te.TrendEngine()
+    return TREND_ENGINE
+
+
+@logger.catch
+def update_trends(upriver, dnriver, projection, forecast_date, forecast):
+    """Add the latest readings to the trend engine. Returns the trend text of the point of interest."""
+    import trend_engine as te
+
+    engine = trend_engine()
+    for name, date, level, _milemrkr, _elevation in (upriver, dnriver):
+        engine.add(name, date, level)
+    engine.add(POINT_OF_INTEREST["name"], dnriver[1], projection)
+    engine.add(POINT_OF_INTEREST["name"], forecast_date, forecast, te.FORECAST)
+    return engine.describe(POINT_OF_INTEREST["name"])
+
+
+def point_rate():
+    """Rate of rise at the point of interest in ft/hr, None until it is known."""
+    trend = trend_engine().trend(POINT_OF_INTEREST["name"])
+    return None if trend is None else trend.rate
+
+
 @logger.catch
 def assemble_text(latest_readings_dict, forecast_data_dict, storage_db):
     """extract guage readings from dicts and calculate river slope.
@@ -300,11 +454,12 @@ def assemble_text(latest_readings_dict, forecast_data_dict, storage_db):
     dnriver_fcst = extract_guage_data(forecast_data_dict, DNRIVERDAM)
     upriver_fcst = extract_guage_data(forecast_data_dict, UPRIVERDAM)
     forecast = calculate_level(upriver_fcst, dnriver_fcst)
+    trend = update_trends(upriver, dnriver, projection, dnriver_fcst[1], forecast) or "Flat"
 
     # build text of tweet
     t1 = f"Latest Observation {upriver_level}ft. {upriver_name}{upriver_date} ** "
     t2 = f"{dnriver_level}ft. {dnriver_name}{dnriver_date} ** "
-    t3 = f"Calculated Level at Bushmans {projection:.2f}ft. ** Future level {forecast:.2f}ft. at {dnriver_fcst[1]} **"
+    t3 = f"Calculated Level at Bushmans {projection:.2f}ft. {trend} ** Future level {forecast:.2f}ft. at {dnriver_fcst[1]} **"
     tweet = f"{t1}{t2}{t3} ::: Data source: NOAA"
     logger.info(tweet)
     logger.info(f"Length of Tweet {len(tweet)} characters.")
@@ -315,6 +470,7 @@ def assemble_text(latest_readings_dict, forecast_data_dict, storage_db):
 
 
 @logger.catch
+@metrics.timed("build_tweet")
 def build_tweet(rivr_conditions_dict, db):
     """takes a dictionary of river condition observations from 2 dams and builds data into a tweet."""
     tweet = ""
@@ -358,14 +514,17 @@ def build_tweet(rivr_conditions_dict, db):
 
 
 @logger.catch
-def QuantifyFlooding(MOST_RECENT_LEVEL, MINIMUM_CONCERN_LEVEL):
+def QuantifyFlooding(MOST_RECENT_LEVEL, MINIMUM_CONCERN_LEVEL, rate=None):
+    """Priority of the next tweet (an index into TWEET_FREQUENCY).
+    rate = ft/hr the river is rising, a fast rise is treated as the level RISE_LOOKAHEAD_HOURS ahead
+    """
+    if rate is not None and rate > 0:
+        MOST_RECENT_LEVEL = MOST_RECENT_LEVEL + rate * RISE_LOOKAHEAD_HOURS
     flooding = int(MOST_RECENT_LEVEL - MINIMUM_CONCERN_LEVEL)
     if flooding < 0:
         flooding = 0
-    # value cannot exceede number of available levels
-    if flooding > len(TWEET_FREQUENCY):
-        flooding = len(TWEET_FREQUENCY) - 1
-    return flooding
+    # value cannot exceede the last available level
+    return min(flooding, len(TWEET_FREQUENCY) - 1)
 
 
 @logger.catch
@@ -375,6 +534,7 @@ def Tweet(twtr, time, db, min_time_between_tweets):
     logger.info("Getting level data...")
     data = get_level_data()
     logger.debug(f"get_level_data={data}")
+    logger.info(f"River data age: {level_data_age()} seconds")
     if data == []:
         logger.error(f"Did not tweet. No tweet generated. No data available.")
         logger.info(f"Recommend waiting 10 minutes to retry.")
@@ -382,7 +542,7 @@ def Tweet(twtr, time, db, min_time_between_tweets):
     logger.info(f"Ready to build tweet from data of type: {type(data)}")
     logger.debug(f"tweet data: {saferepr(data)}")
     status = build_tweet(data, db)
-    if len(status) > 0:
+    if status:  # build_tweet returns None when the data lacks a guage
         DisplayMessage("Tweeting...")
         send_tweet(db, time, status, twtr)
     else:
@@ -399,11 +559,13 @@ def UpdatePrediction(twtr, time, db):
     tm = datetime obj representing current time
     db = PupDB obj for persistant storage on local machine
     """
+    from dateutil import parser
+
     last_tweet_time = db.get(PUPDB_MRT_KEY)  # recover string repr of datetime obj
     prevTweet = parser.parse(last_tweet_time)  # convert back to datetime
     latest_level = db.get(PUPDB_MRL_KEY)  # recover recent level
     logger.info(f"Most recent level: {latest_level}")
-    priority = QuantifyFlooding(latest_level, MINIMUM_CONCERN_LEVEL)
+    priority = QuantifyFlooding(latest_level, MINIMUM_CONCERN_LEVEL, point_rate())
     logger.info(f"Priority: {priority}")
     min_time_between_tweets = TWEET_FREQUENCY[priority]
     logger.info(f"Time between Tweets: {min_time_between_tweets}")
@@ -424,10 +586,26 @@ def UpdatePrediction(twtr, time, db):
     return (waitTime, latest_level)
 
 
+@logger.catch
+def DetectSenseHat():
+    """Look for a SenseHat the first time a display is needed. Returns True if one is attached."""
+    global SenseHatLoaded, SENSEHAT, Set_Random_Pixels, random_to_solid
+    if SenseHatLoaded is None:
+        try:
+            SenseHatLoaded = True
+            from sense_hat import SenseHat
+            from random_colors import Set_Random_Pixels, random_to_solid
+
+            SENSEHAT = SenseHat()
+        except ImportError as e:
+            SenseHatLoaded = False
+    return SenseHatLoaded
+
+
 @logger.catch
 def DisplayMessage(message):
     global SENSEHAT
-    if SenseHatLoaded:
+    if DetectSenseHat():
         # TODO add additonal data like temp and humidity of server hat
         SENSEHAT.show_message(message)
         time.sleep(1)
@@ -439,10 +617,13 @@ def DisplayMessage(message):
 
 @logger.catch
 def DetermineTrend(now, soon):
-    """returns text describing if the trend of the river is rising or falling.
+    """returns text describing if the trend of the river is rising or falling, with its rate.
+    The rate comes from the rolling fit of the trend engine at the point of interest.
     now = float value of current level of river
-    soon = float value of future level of river
+    soon = float value of future level of river, compared with now until the engine knows a rate
     """
+    if point_rate() is not None:
+        return trend_engine().describe(POINT_OF_INTEREST["name"])
     if now > soon:
         return "Falling"
     if now < soon:
@@ -472,6 +653,8 @@ def AreWeThereYet(wait, new_level, trend):
 @logger.catch
 def ActivateDatabase(PupDB_FILENAME, TimeNow):
     # TODO place db functions into its own function
+    from pupdb.core import PupDB
+
     storage_db = PupDB(PupDB_FILENAME)
     last_tweet = storage_db.get(PUPDB_MRT_KEY)
     last_level = storage_db.get(PUPDB_MRL_KEY)
@@ -487,8 +670,12 @@ def ActivateDatabase(PupDB_FILENAME, TimeNow):
 
 @logger.catch
 def Main(credentials):
+    from twython import Twython
+
     defineLoggers()
-    logger.info(f"Sense Hat loaded: {SenseHatLoaded}")
+    metrics.serve(metrics.BOT_METRICS_PORT)
+    ph.install()  # RIVERBOT_PROFILE_CYCLES or SIGUSR1 profile the next cycles
+    logger.info(f"Sense Hat loaded: {DetectSenseHat()}")
     # unpack the credentials before submitting to Twython
     a, b, c, d = credentials
     # establish the twitter access object
@@ -496,48 +683,72 @@ def Main(credentials):
     # activate PupDB file for persistent storage
     TimeNow = datetime.now()
     storage_db = ActivateDatabase(PUPDB_FILENAME, TimeNow)
+    publisher()  # before the threads start, so every thread shares the one Publisher
+    start_tweet_sender(twitter)
+    start_flood_alerts()
     # initialization complete. Begin main loop.
-    while True:
-        TimeNow = datetime.now()
-        wait, new_level = UpdatePrediction(twitter, TimeNow, storage_db)
-        forecast_level = storage_db.get(PUPDB_MRF_KEY)
-        trend = DetermineTrend(new_level, forecast_level)
+    run_schedule(twitter, storage_db, after_cycle=lambda *cycle: metrics.dump_json(path.splitext(RUNTIME_NAME)[0]))
+    return
+
+
+SLEEP_STEP = 55  # seconds between checks of the clock while waiting for the next tweet
+
+
+def run_schedule(twitter, storage_db, clock=datetime.now, sleeper=time.sleep, until=None, after_cycle=None):
+    """The main loop: update the prediction, tweet when it is time, sleep until the next tweet.
+    clock and sleeper are injectable so schedule_simulator.py can replay weeks of it without sleeping.
+    Runs forever, or until clock() passes 'until'. after_cycle(TimeNow, wait, new_level, trend) follows every cycle.
+    """
+    while until is None or clock() < until:
+        record_sent_tweets(storage_db)
+        TimeNow = clock()
+        with ph.profiled_cycle(path.splitext(RUNTIME_NAME)[0]):  # the work of the cycle, not its sleep
+            wait, new_level = UpdatePrediction(twitter, TimeNow, storage_db)
+            forecast_level = storage_db.get(PUPDB_MRF_KEY)
+            trend = DetermineTrend(new_level, forecast_level)
         logger.info(f"New wait time: {wait}")
         logger.info(f"New Level: {new_level}")
         logger.info(f"Trend: {trend}")
         nextTweet = TimeNow + timedelta(0, wait)
         logger.info(f"Next tweet at {nextTweet}")
+        if after_cycle is not None:
+            after_cycle(TimeNow, wait, new_level, trend)
         while wait > 1:
-            wait = wait - 55
-            time.sleep(55)
-            if datetime.now() > nextTweet:
+            wait = wait - SLEEP_STEP
+            sleeper(SLEEP_STEP)
+            record_sent_tweets(storage_db)
+            if clock() > nextTweet:
                 logger.info(f"{wait} seconds left but tweet time has passed.")
                 wait = 0
-    return
+        metrics.LOOP_DRIFT.observe((clock() - nextTweet).total_seconds())
 
 
 @logger.catch
 def defineLoggers():
+    # file sinks write synchronously (no enqueue) so there is no log queue to grow
+    file_level = rp.setting("log_file_level")
     logger.add(
         sys.stderr,
         colorize=True,
         format="<green>{time}</green> {level} <blue>{message}</blue>",
         level=LOGGING_LEVEL,
     )
-    logger.add(  # create a new log file for each run of the program
-        "./LOGS/" + RUNTIME_NAME + "_{time}.log",
-        retention="10 days",
-        # compression="zip",
-        level="DEBUG",  # always send debug output to file
-    )
+    if rp.setting("log_per_run_files"):
+        logger.add(  # create a new log file for each run of the program
+            "./LOGS/" + RUNTIME_NAME + "_{time}.log",
+            retention="10 days",
+            # compression="zip",
+            level=file_level,
+        )
     logger.add(  # create a log file for each run of the program
         "./LOGS/" + RUNTIME_NAME + ".log",
-        retention="10 days",
+        rotation=rp.setting("log_rotation"),
+        retention=rp.setting("log_retention"),
         # compression="zip",
-        level="DEBUG",  # always send debug output to file
+        level=file_level,
     )
     return
 
 
 if __name__ == "__main__":
-    Main(TWITTER_CREDENTIALS)
+    Main(load_credentials())
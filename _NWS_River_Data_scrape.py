@@ -15,6 +15,7 @@ from datetime import datetime, timezone
 from pprint import saferepr
 import requests
 from bs4 import BeautifulSoup as BS
+import soupsieve as sv
 
 runtime_name = path.basename(__file__)
 Data_datestamp = datetime.now()
@@ -33,6 +34,13 @@ RIVER_GUAGE_NAMES = [
     "Ohio River At McAlpine Upper (MLUK2)",
 ]
 
+# css selectors are compiled once instead of on every select() call
+RIVER_SELECTOR = sv.compile("h1.data_name")
+STAGE_SELECTOR = sv.compile(".stage_stage_flow")
+FLOOD_SELECTOR = sv.compile(".flood_stage_flow")
+WARNS_SELECTOR = sv.compile(".current_warns_statmnts_ads > b")
+ALERTS_SELECTOR = sv.compile(".flood_his_lwr .box_square table tr > td:nth-of-type(2)")
+
 LOCATION_OF_INTEREST = 584  # river mile marker @ Bushman's Lake
 LOCATION_OF_MARKLAND = 531
 LOCATION_OF_MCALPINE = 604
@@ -62,45 +70,29 @@ def Process_Data():
     data = []
     # process the data returned from waterdata.usgs.gov
     # into a list of dictionaries
-    for river in soup.select("h1.data_name"):
+    for river in RIVER_SELECTOR.select(soup):
         logger.debug("RIVER: " + river.get_text())
         river_name = river.get_text(strip=True)
         logger.debug("RIVER NAME: " + river_name)
         river_data = river.find_next_sibling("div")
         logger.debug("RIVER DATA: " + river_data.get_text())
-        logger.debug(
-            "RIVER DATA: " + river_data.select_one(".stage_stage_flow").get_text()
-        )
-        logger.debug(
-            "RIVER DATA: " + river_data.select_one(".flood_stage_flow").get_text()
-        )
-        logger.debug(
-            "RIVER DATA: "
-            + river_data.select_one(
-                ".current_warns_statmnts_ads > b"
-            ).next_sibling.strip()
-        )
+        stage = STAGE_SELECTOR.select_one(river_data).get_text(strip=True)
+        flood = FLOOD_SELECTOR.select_one(river_data).get_text(strip=True)
+        warns = WARNS_SELECTOR.select_one(river_data).next_sibling.strip()
+        logger.debug("RIVER DATA: " + stage)
+        logger.debug("RIVER DATA: " + flood)
+        logger.debug("RIVER DATA: " + warns)
         # logger.debug('RIVER DATA: '+ river_data)
         data.append(
             {
                 "name": river_name,
-                "stage": river_data.select_one(".stage_stage_flow")
-                .get_text(strip=True)
-                .replace("Latest Stage: ", ""),
-                "flood_lvl": river_data.select_one(".flood_stage_flow")
-                .get_text(strip=True)
-                .replace("Flood Stage: ", "")
-                .replace(" Feet", ""),
-                "warns": river_data.select_one(
-                    ".current_warns_statmnts_ads > b"
-                ).next_sibling.strip(),
+                "stage": stage.replace("Latest Stage: ", ""),
+                "flood_lvl": flood.replace("Flood Stage: ", "").replace(" Feet", ""),
+                "warns": warns,
                 "alerts": {
                     alert_name: alert_value.get_text(strip=True)
                     for alert_name, alert_value in zip(
-                        ALERT_LEVELS,
-                        river_data.select(
-                            ".flood_his_lwr .box_square table tr > td:nth-of-type(2)"
-                        ),
+                        ALERT_LEVELS, ALERTS_SELECTOR.select(river_data)
                     )
                 },
             }
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Rebuild scrape history from the archived raw html in raw_web_scrapes/.
+After a fix to the parser the whole archive can be re-parsed here instead of one file at a
+time with display_cached_data. Archive files are spread across a process pool, the parsed
+readings are written in batches and every parsed file is recorded in a checkpoint so an
+interrupted backfill resumes where it stopped (files that failed to parse are tried again).
+The readings go where the live scraper puts them (see OHIO_RIVER_LEVEL_SCRAPING.archive_readings):
+the binary guage archive, its scrape index and its rollups, which river_query reads. A scrape that
+is already in the scrape index is not indexed twice. CSV_DATA only holds the changes of live scrapes
+and is not written.
+
+usage: python backfill.py [--source raw_web_scrapes] [--archive ARCHIVE/] [--workers N] [--restart]
+"""
+import argparse
+import os
+import sys
+import time
+from multiprocessing import Pool
+from pathlib import Path
+
+from loguru import logger
+
+import guage_archive as ga
+import rollups
+import storage_paths as sp
+
+RUNTIME_NAME = Path(__file__)
+
+RAW_SCRAPE_ROOT = "raw_web_scrapes"
+CHECKPOINT_FILE = "backfill_checkpoint.txt"
+BATCH_SIZE = 200  # files parsed between writes and checkpoints
+
+
+def parse_archive_file(path):
+    """Worker: re-parse one archived scrape. Returns (path, readings) with readings None on failure."""
+    # imported here so each worker process loads the scraper on its own
+    from OHIO_RIVER_LEVEL_SCRAPING import parse_guage_page
+
+    try:
+        with open(path, "r") as txtfile:
+            raw_html = txtfile.read()
+    except (OSError, UnicodeDecodeError) as e:
+        logger.error(f"Could not read archive file {path}: {e}")
+        return (path, None)
+    parsed = parse_guage_page(raw_html)
+    if parsed is None:
+        return (path, None)
+    return (path, parsed[0])
+
+
+def quiet_worker():
+    """Per-scrape debug logging would dominate the run time of a worker."""
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+
+def write_batch(results, archive):
+    """Add every parsed file of a batch to the archive, its scrape index and rollups. Returns the number of readings."""
+    rows = 0
+    written = []
+    for archive_file, readings in sorted(results, key=lambda result: Path(result[0]).name):  # oldest first
+        if not readings:
+            continue
+        scrape_minute = ga.scrape_minute_from_filename(archive_file)
+        if scrape_minute is not None and not archive.indexed(readings[0]["guage"], scrape_minute):
+            archive.record_scrape_readings(readings, scrape_minute)
+        archive.append_readings(readings)
+        written.extend(readings)
+        rows += len(readings)
+    rollups.RollupStore(archive).update_readings(written)
+    return rows
+
+
+def load_checkpoint(checkpoint_path):
+    if not checkpoint_path.exists():
+        return set()
+    with open(checkpoint_path, "r") as checkpoint:
+        return set(line.strip() for line in checkpoint if line.strip())
+
+
+def record_checkpoint(checkpoint_path, results):
+    """Record the files that parsed, a failed one is parsed again by the next run."""
+    with open(checkpoint_path, "a") as checkpoint:
+        checkpoint.writelines(f"{archive_file}\n" for archive_file, readings in results if readings is not None)
+        checkpoint.flush()
+        os.fsync(checkpoint.fileno())
+
+
+@logger.catch
+def backfill(source=RAW_SCRAPE_ROOT, archive_root=sp.ARCHIVE_ROOT, workers=None, batch_size=BATCH_SIZE,
+             restart=False, state_root=sp.STATE_ROOT):
+    """Re-parse every archive file not yet in the checkpoint. Returns a dict of totals."""
+    checkpoint_path = sp.state_file(CHECKPOINT_FILE, state_root)
+    archive = ga.GuageArchive(archive_root)
+    if restart and checkpoint_path.exists():
+        checkpoint_path.unlink()
+    done = load_checkpoint(checkpoint_path)
+    files = sorted(str(fl) for fl in Path(source).glob("*.rawhtml"))
+    todo = [fl for fl in files if fl not in done]
+    logger.info(f"{len(files)} archive files, {len(files) - len(todo)} already done, {len(todo)} to parse.")
+    totals = {"files": 0, "rows": 0, "failed": 0, "seconds": 0.0}
+    start = time.perf_counter()
+    batch = []
+    with Pool(processes=workers or os.cpu_count(), initializer=quiet_worker) as pool:
+        for result in pool.imap_unordered(parse_archive_file, todo, chunksize=8):
+            batch.append(result)
+            if len(batch) >= batch_size:
+                flush_batch(batch, archive, checkpoint_path, totals, start)
+                batch = []
+        flush_batch(batch, archive, checkpoint_path, totals, start)
+    for guage in archive.guages():
+        archive.compact(guage)  # the re-parsed readings older than the archive went to the overflow
+    totals["seconds"] = round(time.perf_counter() - start, 2)
+    logger.info(f"Backfill complete: {totals}")
+    return totals
+
+
+def flush_batch(batch, archive, checkpoint_path, totals, start):
+    """Write a batch, checkpoint it and report progress."""
+    if not batch:
+        return
+    totals["rows"] += write_batch(batch, archive)
+    totals["failed"] += sum(1 for _archive_file, readings in batch if readings is None)
+    totals["files"] += len(batch)
+    record_checkpoint(checkpoint_path, batch)
+    elapsed = time.perf_counter() - start
+    logger.info(f'{totals["files"]} files, {totals["rows"]} rows, {totals["files"] / elapsed:.1f} files/sec')
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(description="Re-parse the raw_web_scrapes archive into the guage archive.")
+    parser.add_argument("--source", default=RAW_SCRAPE_ROOT, help="directory of .rawhtml files")
+    parser.add_argument("--archive", default=sp.ARCHIVE_ROOT, help="root of the binary guage archive")
+    parser.add_argument("--workers", type=int, default=None, help="processes to use (default: all cores)")
+    parser.add_argument("--batch", type=int, default=BATCH_SIZE, help="files per write and checkpoint")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and parse everything")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_arguments(sys.argv[1:])
+    logger.remove()
+    logger.add(sys.stderr, format="{time} {level} {message}", level="INFO")
+    backfill(args.source, args.archive, args.workers, args.batch, args.restart)
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmark the html_backend parsers on recorded guage pages.
+Uses the archive in raw_web_scrapes/ when present, otherwise the sample pages in test_fixtures/.
+Reports pages/sec for page extraction alone and for the full parse including date handling,
+and verifies that every backend returns identical results.
+
+usage: python bench_html_backends.py [directory] [rounds]
+"""
+import sys
+import time
+from pathlib import Path
+
+from loguru import logger
+
+import html_backend as hb
+from OHIO_RIVER_LEVEL_SCRAPING import parse_guage_page
+
+DEFAULT_SOURCES = ["raw_web_scrapes", "test_fixtures"]
+ROUNDS = 20
+
+
+def recorded_pages(directory=None):
+    for source in [directory] if directory else DEFAULT_SOURCES:
+        files = sorted(Path(source).glob("*.rawhtml"))
+        if files:
+            return [fl.read_text() for fl in files]
+    return []
+
+
+def pages_per_second(function, pages, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for page in pages:
+            function(page)
+    return len(pages) * rounds / (time.perf_counter() - start)
+
+
+def run(directory=None, rounds=ROUNDS):
+    pages = recorded_pages(directory)
+    if not pages:
+        print("No recorded pages found.")
+        return {}
+    results = {}
+    reference = [parse_guage_page(page, "bs4") for page in pages]
+    for backend in hb.BACKENDS:
+        if backend == "lxml" and not hb.LXML_LOADED:
+            continue
+        parsed = [parse_guage_page(page, backend) for page in pages]
+        results[backend] = {
+            "identical": parsed == reference,
+            "extract_pages_per_sec": round(pages_per_second(lambda p: hb.extract_page(p, backend), pages, rounds), 1),
+            "full_pages_per_sec": round(pages_per_second(lambda p: parse_guage_page(p, backend), pages, max(rounds // 10, 1)), 1),
+        }
+        print(f"{backend:5} {results[backend]}")
+    return results
+
+
+if __name__ == "__main__":
+    logger.remove()  # per page logging would be measured too
+    run(sys.argv[1] if len(sys.argv) > 1 else None, int(sys.argv[2]) if len(sys.argv) > 2 else ROUNDS)
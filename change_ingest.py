@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""Change-only ingestion of scraped readings.
+Each scrape of a guage returns the whole observed and forecast window (about 900 rows),
+most of which were already stored by the previous scrape. This module remembers the last
+level seen for every (guage, type, datetime) and passes on only readings that are new or
+that NWS has revised since. Every row passed on carries a 'version' which starts at 1 and
+is incremented each time NWS revises that reading (most often a forecast being updated).
+The last-seen state is kept in one small pickle per guage so only the scraped guage is rewritten.
+ingest() does not save it: commit() does, once the changes are stored, so readings whose store
+failed are passed on again by the next scrape.
+"""
+import datetime as dt
+import pickle
+from collections import namedtuple
+from pathlib import Path
+
+from loguru import logger
+
+import storage_paths as sp
+
+LAST_SEEN_DIRECTORY = "last_seen"
+CSV_DATETIME_FORMAT = sp.CSV_DATETIME_FORMAT
+RETENTION_DAYS = 60  # NWS shows about 30 days of observations, older keys can be forgotten
+
+GuageState = namedtuple("GuageState", "guage last_seen state_root")
+
+
+def _state_path(guage, state_root):
+    folder = Path(state_root, LAST_SEEN_DIRECTORY)
+    folder.mkdir(parents=True, exist_ok=True)
+    return Path(folder, f"{guage}.pkl")
+
+
+@logger.catch
+def load_guage_state(guage, state_root=sp.STATE_ROOT):
+    """Return the last-seen dict {(type, datetime): (level, flow, version)} for one guage."""
+    path = _state_path(guage, state_root)
+    if not path.exists():
+        return {}
+    try:
+        with open(path, "rb") as state_file:
+            return pickle.load(state_file)
+    except (pickle.UnpicklingError, EOFError, AttributeError, ValueError) as e:
+        # every reading of the next scrape is passed on again, which is better than never storing the guage
+        logger.error(f"Unreadable last-seen state {path}, starting empty: {e}")
+        return {}
+
+
+@logger.catch
+def save_guage_state(guage, last_seen, state_root=sp.STATE_ROOT):
+    with open(_state_path(guage, state_root), "wb") as state_file:
+        pickle.dump(last_seen, state_file)
+    return True
+
+
+def prune(last_seen, retention_days=RETENTION_DAYS):
+    """Forget readings older than retention_days before the newest reading."""
+    if not last_seen:
+        return last_seen
+    newest = max(stamp for _kind, stamp in last_seen)
+    try:
+        cutoff = dt.datetime.strptime(newest, CSV_DATETIME_FORMAT) - dt.timedelta(days=retention_days)
+    except ValueError:
+        return last_seen
+    cutoff_string = cutoff.strftime(CSV_DATETIME_FORMAT)  # this format sorts as text
+    return {key: value for key, value in last_seen.items() if key[1] >= cutoff_string}
+
+
+def filter_changes(readings, last_seen):
+    """Return the readings that are new or revised compared with last_seen and update last_seen.
+
+    Args:
+        readings (list): dicts from OHIO_RIVER_LEVEL_SCRAPING.sort_and_label_data
+        last_seen (dict): {(type, datetime): (level, flow, version)} for the guage, updated in place
+
+    Returns:
+        list: copies of the changed readings with a 'version' added.
+    """
+    changes = []
+    for row in readings:
+        key = (row["type"], row["datetime"])
+        value = (row.get("level"), row.get("flow"))
+        previous = last_seen.get(key)
+        if previous is not None and previous[:2] == value:
+            continue
+        version = 1 if previous is None else previous[2] + 1
+        last_seen[key] = value + (version,)
+        changed = dict(row)
+        changed["version"] = version
+        changes.append(changed)
+    return changes
+
+
+@logger.catch
+def ingest(readings, state_root=sp.STATE_ROOT):
+    """Filter one scrape of one guage down to its new or revised readings.
+    Returns (changes, state), commit(state) once the changes are stored (state is None when nothing changed).
+    """
+    if not readings:
+        return ([], None)
+    guage = readings[0]["guage"]
+    last_seen = load_guage_state(guage, state_root) or {}  # None if it could not be read at all
+    changes = filter_changes(readings, last_seen)
+    revisions = sum(1 for row in changes if row["version"] > 1)
+    logger.info(f"{guage}: {len(changes)} of {len(readings)} readings changed ({revisions} revisions).")
+    if not changes:
+        return ([], None)
+    return (changes, GuageState(guage, prune(last_seen), state_root))
+
+
+def commit(state):
+    """Save the last-seen state returned by ingest(), after its changes were stored."""
+    if state is None:
+        return False
+    return save_guage_state(state.guage, state.last_seen, state.state_root)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Time whole tweet cycles offline: UpdatePrediction -> Tweet -> send_tweet -> Twitter.
+NWS pages come from the recorded week (test_fixtures/hydrograph_week, see memory_harness.py) and
+tweets go through Twython to fake_twitter.py on a local port, with its latency and error injection.
+Each cycle runs 6 hours of bot time after the last one so every cycle tweets. The tweet queue
+and the fake Twitter follow that clock too, a failed tweet is retried during the next cycle.
+Reports the cycle latency percentiles and the mean time per cycle of every timed stage
+(metrics.STAGE_SECONDS, stages nest: update_status is part of send_tweet).
+
+usage: python cycle_benchmark.py [--cycles 28] [--latency 0.05] [--error-rate 0.1] [--json]
+"""
+import argparse
+import json
+import math
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from functools import partial
+from pathlib import Path
+
+from loguru import logger
+
+import metrics
+from fake_twitter import FakeTwitter, FakeTwitterServer
+from memory_harness import RECORDED_WEEK, recorded_fetchers
+
+CYCLE_STEP = timedelta(hours=6)  # longer than the longest TWEET_FREQUENCY
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a non empty list."""
+    ordered = sorted(values)
+    rank = math.ceil(pct / 100 * len(ordered)) - 1
+    return ordered[min(max(rank, 0), len(ordered) - 1)]
+
+
+def stage_seconds():
+    """{stage: seconds spent so far} from the stage histogram."""
+    return {dict(key)["stage"]: state[-2] for key, state in list(metrics.STAGE_SECONDS.values.items())}
+
+
+def run_cycles(cycles=None, pages=RECORDED_WEEK, fake=None, folder=None):
+    """Run tweet cycles against a fake Twitter. Returns (cycle reports, the FakeTwitter)."""
+    import Sunset_Village_TwitterBot as bot
+    import tweet_queue as tq
+    from NWS_River_Data_scrape_NEW import processRiverData
+    from river_data_cache import RiverDataCache
+
+    folder = Path(folder or tempfile.mkdtemp())
+    fetchers = recorded_fetchers(pages)
+    cycles = cycles or len(fetchers)
+    clock = datetime(2022, 3, 1)
+
+    def bot_time():
+        return clock.timestamp()
+
+    fake = fake or FakeTwitter()
+    fake.clock = bot_time
+    server = FakeTwitterServer(fake).start()
+    twitter = server.client()
+    db = bot.ActivateDatabase(str(folder / bot.PUPDB_FILENAME), clock)
+    saved = (bot.TWEET_QUEUE, bot.TWEET_SENDER, bot.PUBLISHER, bot.LEVEL_DATA_CACHE, bot.TREND_ENGINE)
+    bot.TWEET_QUEUE = tq.TweetQueue(folder / tq.QUEUE_FILE, clock=bot_time)
+    bot.TWEET_SENDER = None  # tweets are sent inside send_tweet, so their time is part of the cycle
+    bot.PUBLISHER = None
+    bot.TREND_ENGINE = None  # rates from the replayed pages only
+    reports = []
+    try:
+        for number in range(cycles):
+            clock += CYCLE_STEP
+            bot.LEVEL_DATA_CACHE = RiverDataCache(partial(processRiverData, fetchers[number % len(fetchers)]))
+            stages_before = stage_seconds()
+            start = time.perf_counter()
+            wait, level = bot.UpdatePrediction(twitter, clock, db)
+            elapsed = time.perf_counter() - start
+            stages = {
+                stage: round(seconds - stages_before.get(stage, 0.0), 6)
+                for stage, seconds in stage_seconds().items()
+                if seconds != stages_before.get(stage, 0.0)
+            }
+            reports.append({"cycle": number + 1, "seconds": round(elapsed, 6), "level": level, "stages": stages})
+    finally:
+        server.stop()
+        bot.TWEET_QUEUE, bot.TWEET_SENDER, bot.PUBLISHER, bot.LEVEL_DATA_CACHE, bot.TREND_ENGINE = saved
+    return (reports, server.fake)
+
+
+def summary(reports, fake=None):
+    latencies = [report["seconds"] for report in reports]
+    result = {"cycles": len(reports)}
+    result.update({f"p{pct}_seconds": percentile(latencies, pct) for pct in PERCENTILES})
+    result["max_seconds"] = max(latencies)
+    stages = {}
+    for report in reports:
+        for stage, seconds in report["stages"].items():
+            stages[stage] = stages.get(stage, 0.0) + seconds
+    result["mean_stage_seconds"] = {stage: round(seconds / len(reports), 6) for stage, seconds in sorted(stages.items())}
+    if fake is not None:
+        result["tweets_posted"] = len(fake.statuses)
+        result["twitter_requests"] = fake.requests
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time tweet cycles against recorded NWS pages and a fake Twitter.")
+    parser.add_argument("--pages", default=str(RECORDED_WEEK), help="directory of recorded hydrograph pages")
+    parser.add_argument("--cycles", type=int, default=None, help="cycles to run (default: one per recorded scrape)")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds every Twitter request waits")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many extra seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of Twitter requests that fail")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="print the summary and reports as json")
+    args = parser.parse_args()
+    logger.remove()
+    logger.add(sys.stderr, level="ERROR")
+    fake = FakeTwitter(args.latency, args.jitter, args.error_rate, seed=args.seed)
+    reports, fake = run_cycles(args.cycles, args.pages, fake)
+    result = summary(reports, fake)
+    if args.json:
+        print(json.dumps({"summary": result, "reports": reports}))
+    else:
+        for report in reports:
+            print(f'cycle {report["cycle"]:3}  {report["seconds"] * 1000:8.1f} ms  level {report["level"]}')
+        for name, value in result.items():
+            print(f"{name}: {value}")
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""A local stand-in for the Twitter status update endpoint (POST /1.1/statuses/update.json).
+Twython talks to it like to Twitter, so the tweet queue and a whole tweet cycle can be run and
+timed without credentials or a network:
+
+- every request waits 'latency' seconds (plus up to 'jitter' more),
+- 'error_rate' of the requests fail with 'error_code' (503 by default), 'script' lists the
+  status codes of the first requests (ex: [503, 429]) for tests that need an exact sequence,
+- 'rate_limit' posts are allowed per 'window' seconds, then 429 with x-rate-limit-reset,
+  every answer carries the x-rate-limit-* headers like Twitter's.
+
+The OAuth signature is not checked. Posted statuses are kept in 'statuses'.
+
+usage: python fake_twitter.py [--port 8099] [--latency 0.2] [--error-rate 0.1] [--rate-limit 300]
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from loguru import logger
+
+HOST = "127.0.0.1"
+STATUS_PATH = "/1.1/statuses/update.json"
+RATE_LIMIT_WINDOW = 15 * 60  # seconds, Twitter's rate limit window
+ERROR_MESSAGES = {429: (88, "Rate limit exceeded"), 503: (130, "Over capacity"), 500: (131, "Internal error")}
+
+
+class FakeTwitter:
+    """The endpoint's behaviour and what it was sent, shared by the request handler threads."""
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, error_code=503, script=(), rate_limit=None,
+                 window=RATE_LIMIT_WINDOW, seed=None, clock=time.time, sleeper=time.sleep):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_code = error_code
+        self.script = list(script)
+        self.rate_limit = rate_limit
+        self.window = window
+        self.rng = random.Random(seed)
+        self.clock = clock
+        self.sleeper = sleeper
+        self._lock = threading.Lock()
+        self.statuses = []
+        self.requests = 0
+        self._window_start = None  # the first request opens the first window
+        self._window_posts = 0
+
+    def _rate_limit_headers(self, now):
+        if self.rate_limit is None:
+            return {}
+        reset = self._window_start + self.window
+        return {
+            "x-rate-limit-limit": str(self.rate_limit),
+            "x-rate-limit-remaining": str(max(self.rate_limit - self._window_posts, 0)),
+            "x-rate-limit-reset": str(int(reset)),
+        }
+
+    def post_status(self, status):
+        """Returns (HTTP status code, headers, json body) of one status update."""
+        self.sleeper(self.latency + self.rng.uniform(0, self.jitter))
+        with self._lock:
+            self.requests += 1
+            now = self.clock()
+            if self._window_start is None or now - self._window_start >= self.window:
+                self._window_start, self._window_posts = now, 0
+            if self.script:
+                code = self.script.pop(0)
+            elif self.rate_limit is not None and self._window_posts >= self.rate_limit:
+                code = 429
+            elif self.rng.random() < self.error_rate:
+                code = self.error_code
+            else:
+                code = 200
+            if code == 200:
+                self._window_posts += 1
+                self.statuses.append(status)
+                created = time.strftime("%a %b %d %H:%M:%S +0000 %Y", time.gmtime(now))
+                body = {"id": len(self.statuses), "text": status, "created_at": created}
+            else:
+                error, message = ERROR_MESSAGES.get(code, (0, "Error"))
+                body = {"errors": [{"code": error, "message": message}]}
+            return code, self._rate_limit_headers(now), body
+
+
+class FakeTwitterServer:
+    """Serves a FakeTwitter on a free local port from a daemon thread."""
+
+    def __init__(self, fake=None, host=HOST, port=0):
+        self.fake = fake or FakeTwitter()
+        fake = self.fake
+
+        class StatusHandler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.path.split("?")[0] != STATUS_PATH:
+                    self.send_error(404)
+                    return
+                length = int(self.headers.get("Content-Length", 0))
+                form = parse_qs(self.rfile.read(length).decode("utf-8"))
+                code, headers, body = fake.post_status(form.get("status", [""])[0])
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                logger.debug(f"fake twitter request {format % args}")
+
+        self.server = ThreadingHTTPServer((host, port), StatusHandler)
+        self.url = f"http://{host}:{self.server.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name="fake-twitter", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def client(self, timeout=10):
+        """A Twython object with dummy credentials that talks to this server."""
+        from twython import Twython
+
+        twitter = Twython("app-key", "app-secret", "oauth-token", "oauth-token-secret", client_args={"timeout": timeout})
+        twitter.api_url = self.url + "/%s"
+        return twitter
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for the Twitter status update endpoint.")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds every request waits")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many extra seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests that fail")
+    parser.add_argument("--error-code", type=int, default=503)
+    parser.add_argument("--rate-limit", type=int, default=None, help="posts allowed per window")
+    parser.add_argument("--window", type=float, default=RATE_LIMIT_WINDOW, help="seconds of a rate limit window")
+    args = parser.parse_args()
+    fake = FakeTwitter(args.latency, args.jitter, args.error_rate, args.error_code, rate_limit=args.rate_limit, window=args.window)
+    server = FakeTwitterServer(fake, port=args.port)
+    print(f"Fake Twitter at {server.url}{STATUS_PATH}")
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
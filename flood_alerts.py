@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""Alert as soon as a guage, or the level projected at the point of interest, crosses a flood stage.
+Scheduled tweets can be 5 hours apart (TWEET_FREQUENCY[0]), a rising river should not wait for them.
+
+- every new reading is compared with the action levels of its guage (ACTION_LABELS in rivers.json),
+- the level at the point of interest is projected from its upstream and downstream guages like the
+  tweet does, its action levels are those of the config or else projected from the guages' levels,
+- a stage is entered when the level reaches its action level and left only once the level is
+  HYSTERESIS ft below it, so a river hovering at a threshold does not alert on every reading,
+- the stages are kept in STATE/flood_alerts.json so a restart does not repeat an alert.
+
+The bot feeds the detector from the scraper daemon's latest snapshot (see latest_snapshot.py):
+a SnapshotWatcher thread checks for a new snapshot every POLL seconds and the alert is
+published at once (see publishers.py), seconds after the scrape. The same readings feed the bot's
+rate of rise (see trend_engine.py), so it follows every scrape, not only those a tweet was built from.
+"""
+import json
+import math
+import os
+import threading
+import time
+from collections import namedtuple
+
+from loguru import logger
+
+import metrics
+import river_config as rc
+import storage_paths as sp
+
+ALERTS_FILE = "flood_alerts.json"
+STAGES = ["No Flooding"] + rc.ACTION_LABELS
+HYSTERESIS = 0.5  # ft below an action level before its stage is left
+POLL = 5  # seconds between checks for a new snapshot
+
+ALERTS = metrics.counter("flood_alerts_total", "Flood stage crossings by place and direction.")
+ALERT_LATENCY = metrics.histogram("flood_alert_latency_seconds", "From a snapshot being published to its alert.")
+
+Alert = namedtuple("Alert", "place level time previous stage")
+
+
+def alert_text(alert):
+    reading = f"{alert.place}: {alert.level:.1f}ft at {alert.time}"
+    if STAGES.index(alert.stage) > STAGES.index(alert.previous):
+        return f"FLOOD ALERT {reading}, {alert.stage} stage reached (was {alert.previous})."
+    return f"Flood update {reading}, down to {alert.stage} (was {alert.previous})."
+
+
+def project_level(up_level, dn_level, upstream, downstream, milemarker):
+    """Level at river mile 'milemarker' between two guages, from the slope of the pool between them.
+    upstream, downstream: guage details with 'milemarker' and 'guage_elevation' (RIVER_MONITORING_POINTS).
+    """
+    slope = (up_level - dn_level) - (upstream["guage_elevation"] - downstream["guage_elevation"])
+    per_mile_slope = slope / (downstream["milemarker"] - upstream["milemarker"])
+    return (downstream["milemarker"] - milemarker) * per_mile_slope + dn_level
+
+
+def stage_of(level, action_levels, current=STAGES[0], hysteresis=HYSTERESIS):
+    """The stage of 'level' for a place now in stage 'current'."""
+    reached = STAGES[0]
+    for label in rc.ACTION_LABELS:
+        if level >= action_levels[label]:
+            reached = label
+    for held in STAGES[STAGES.index(current):STAGES.index(reached):-1]:
+        if level >= action_levels[held] - hysteresis:
+            return held  # not yet far enough below the action level of this stage
+    return reached
+
+
+class FloodAlertDetector:
+    """Flood stage of every guage and of the point of interest, updated one reading at a time."""
+
+    def __init__(self, monitoring_points=None, point=None, hysteresis=HYSTERESIS, path=None):
+        self.points = monitoring_points or rc.monitoring_points()
+        self.point = point or rc.point_of_interest()
+        self.hysteresis = hysteresis
+        self.path = path or sp.state_file(ALERTS_FILE)
+        self.point_levels = self.point.get("action_levels") or {
+            label: project_level(
+                self.points[self.point["upstream"]][label],
+                self.points[self.point["downstream"]][label],
+                self.points[self.point["upstream"]],
+                self.points[self.point["downstream"]],
+                self.point["milemarker"],
+            )
+            for label in rc.ACTION_LABELS
+        }
+        self.levels = {}  # guage name: latest level
+        self.stages = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as alerts_file:
+                return json.load(alerts_file)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.error(f"Unreadable flood alert state {self.path}: {e}")
+            return {}
+
+    def _save(self):
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w") as alerts_file:
+            json.dump(self.stages, alerts_file)
+        os.replace(temporary, self.path)
+
+    def _update(self, place, level, action_levels, when):
+        previous = self.stages.get(place, STAGES[0])
+        stage = stage_of(level, action_levels, previous, self.hysteresis)
+        if stage == previous:
+            return None
+        self.stages[place] = stage
+        direction = "rising" if STAGES.index(stage) > STAGES.index(previous) else "falling"
+        ALERTS.inc(place=place, direction=direction)
+        return Alert(place, level, when, previous, stage)
+
+    def projection(self):
+        """Level projected at the point of interest from the latest guage levels, None until both are known."""
+        upstream, downstream = self.point["upstream"], self.point["downstream"]
+        if upstream not in self.levels or downstream not in self.levels:
+            return None
+        return project_level(
+            self.levels[upstream],
+            self.levels[downstream],
+            self.points[upstream],
+            self.points[downstream],
+            self.point["milemarker"],
+        )
+
+    def observe(self, name, level, when):
+        """A new reading of guage 'name'. Returns the alerts it raises (the guage's, the point of interest's)."""
+        if name not in self.points:
+            return []
+        self.levels[name] = level
+        alerts = [self._update(name, level, self.points[name], when)]
+        projected = self.projection() if name in (self.point["upstream"], self.point["downstream"]) else None
+        if projected is not None:
+            alerts.append(self._update(self.point["name"], projected, self.point_levels, when))
+        alerts = [alert for alert in alerts if alert is not None]
+        if alerts:
+            self._save()
+        return alerts
+
+
+class SnapshotWatcher:
+    """Feeds the detector every new observation of the scraper's latest snapshot, from a daemon thread.
+    on_reading(place, epoch seconds, level) also gets each of them, and the level then projected at the
+    point of interest (the bot keeps its trends with it, see trend_engine.py).
+    """
+
+    def __init__(self, detector, on_alert, reader=None, poll=POLL, on_reading=None):
+        import latest_snapshot as ls
+        from NWS_River_Data_scrape_NEW import guage_lid
+
+        self.detector = detector
+        self.on_alert = on_alert
+        self.on_reading = on_reading
+        self.reader = reader or ls.SnapshotReader()
+        self.poll = poll
+        self.lids = {guage_lid(name): name for name in detector.points}
+        self.seen = {}  # lid: observed time of the last reading given to the detector
+        self._stop = threading.Event()
+        self._thread = None
+
+    def check(self):
+        """Look at the snapshot once. Returns the alerts raised."""
+        if not self.reader.refresh():
+            return []
+        alerts = []
+        projected_at = None  # observed time of the newest upstream or downstream reading of this snapshot
+        for lid, name in self.lids.items():
+            record = self.reader.lookup(lid)
+            if record is None or record[1] == 0 or record[1] == self.seen.get(lid) or math.isnan(record[2]):
+                continue  # no observation, one already seen, or NaN
+            self.seen[lid] = record[1]
+            when = time.strftime("%Y-%m-%d %H:%MUTC", time.gmtime(record[1]))
+            alerts.extend(self.detector.observe(name, record[2], when))
+            if self.on_reading is not None:
+                self.on_reading(name, record[1], record[2])
+                if name in (self.detector.point["upstream"], self.detector.point["downstream"]):
+                    projected_at = max(projected_at or 0, record[1])
+        # projected once both guages of the snapshot are read, so it does not mix old and new levels
+        projected = None if projected_at is None else self.detector.projection()
+        if projected is not None:
+            self.on_reading(self.detector.point["name"], projected_at, projected)
+        for alert in alerts:
+            ALERT_LATENCY.observe(time.time() - os.stat(self.reader.path).st_mtime)
+            logger.warning(alert_text(alert))
+            self.on_alert(alert)
+        return alerts
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="flood-alerts", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.check()
+            except Exception as e:  # a bad snapshot must not end the alerts
+                logger.error(f"Flood alert check failed: {e}")
+            self._stop.wait(self.poll)
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Track how a 'hump' of water moves down the river and predict when it arrives.
+Observed levels for every guage are loaded from the scrape history, resampled to an
+hourly grid and the changes in level of each pair of consecutive guages are cross-correlated
+with FFTs. The lag with the strongest correlation is the travel time of a wave between
+the two guages. Travel times between the guages bracketing the location of interest
+are then used to predict when the crest seen upstream will arrive at our location.
+"""
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+import river_history as rh
+from NWS_River_Data_scrape_NEW import RIVER_MONITORING_POINTS, MARKLAND_DAM_NAME, MCALPINE_DAM_NAME, POINT_OF_INTEREST, guage_lid
+
+RUNTIME_NAME = Path(__file__)
+
+TRAVEL_TIME_CACHE = "flood_wave_travel_times.json"
+LOCATION_OF_INTEREST = POINT_OF_INTEREST["milemarker"]  # river mile marker @ Bushman's Lake (see rivers.json)
+UPSTREAM_POINT = MARKLAND_DAM_NAME
+DOWNSTREAM_POINT = MCALPINE_DAM_NAME
+RESAMPLE_FREQUENCY = "1h"
+MAX_GAP_HOURS = 12  # longer gaps in the observations are not interpolated
+MAX_LAG_HOURS = 96  # a wave takes no more than 4 days between consecutive guages
+CREST_LOOKBACK_HOURS = 72
+
+
+@logger.catch
+def hourly_matrix(observations, guages):
+    """Pivot observations into an hourly frame with one column per guage (missing guages are all NaN)."""
+    wide = observations.pivot_table(index="datetime", columns="guage", values="level", aggfunc="last")
+    wide = wide.reindex(columns=guages)
+    if wide.empty:
+        return wide
+    wide = wide.resample(RESAMPLE_FREQUENCY).mean()
+    return wide.interpolate(method="time", limit=MAX_GAP_HOURS, limit_area="inside")
+
+
+def lagged_cross_correlation(upstream, downstream, max_lag):
+    """Normalized cross-correlation of each row of upstream against the same row of downstream.
+
+    Both arguments are 2-D arrays (pairs x samples) of level changes with NaN treated as no change.
+    Returns an array (pairs x max_lag + 1) where column k is the correlation of upstream
+    with downstream delayed by k samples. All pairs are computed in a single FFT pass.
+    """
+    up = np.nan_to_num(np.atleast_2d(upstream))
+    dn = np.nan_to_num(np.atleast_2d(downstream))
+    up = up - up.mean(axis=1, keepdims=True)
+    dn = dn - dn.mean(axis=1, keepdims=True)
+    samples = up.shape[1]
+    size = 1 << int(np.ceil(np.log2(max(2 * samples - 1, 2))))  # zero pad to avoid circular wrap
+    spectrum = np.fft.rfft(dn, size, axis=1) * np.conj(np.fft.rfft(up, size, axis=1))
+    corr = np.fft.irfft(spectrum, size, axis=1)[:, : max_lag + 1]
+    norm = np.sqrt((up ** 2).sum(axis=1) * (dn ** 2).sum(axis=1))[:, None]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(norm > 0, corr / norm, 0.0)
+
+
+@logger.catch
+def estimate_travel_times(observations, guage_order, pairs=None, max_lag_hours=MAX_LAG_HOURS):
+    """Estimate the travel time in hours between consecutive guages.
+
+    Args:
+        observations (pandas.DataFrame): guage, datetime, level rows (see river_history.load_observations)
+        guage_order (list): guages from upstream to downstream
+        pairs (list, optional): only compute these (upstream, downstream) pairs. Defaults to all consecutive pairs.
+        max_lag_hours (int, optional): longest travel time considered.
+
+    Returns:
+        dict: keyed by 'upstream>downstream' with lag_hours, correlation and the last observation used.
+    """
+    if pairs is None:
+        pairs = list(zip(guage_order[:-1], guage_order[1:]))
+    if not pairs:
+        return {}
+    matrix = hourly_matrix(observations, guage_order)
+    if matrix.empty:
+        return {}
+    changes = matrix.diff()
+    ups = changes[[up for up, _dn in pairs]].to_numpy().T
+    dns = changes[[dn for _up, dn in pairs]].to_numpy().T
+    corr = lagged_cross_correlation(ups, dns, max_lag_hours)
+    best = corr.argmax(axis=1)
+    last_seen = observations.groupby("guage")["datetime"].max().astype(str).to_dict()
+    results = {}
+    for i, (up, dn) in enumerate(pairs):
+        results[f"{up}>{dn}"] = {
+            "upstream": up,
+            "downstream": dn,
+            "lag_hours": int(best[i]),
+            "correlation": round(float(corr[i, best[i]]), 4),
+            "last_observation": max(last_seen.get(up, ""), last_seen.get(dn, "")),
+        }
+    return results
+
+
+@logger.catch
+def update_travel_times(root=rh.HISTORY_ROOT, state_root=rh.STATE_ROOT):
+    """Bring the cached travel times up to date with any new scrapes and return them.
+    Only guage pairs that received new observations since the last run are recomputed.
+    """
+    observations, guage_order = rh.load_observations(root, state_root=state_root)
+    cache_path = rh.state_file(TRAVEL_TIME_CACHE, state_root)
+    cached = {}
+    if cache_path.exists():
+        with open(cache_path, "r") as cache_file:
+            cached = json.load(cache_file)
+    last_seen = observations.groupby("guage")["datetime"].max().astype(str).to_dict()
+    stale = []
+    for up, dn in zip(guage_order[:-1], guage_order[1:]):
+        entry = cached.get(f"{up}>{dn}")
+        newest = max(last_seen.get(up, ""), last_seen.get(dn, ""))
+        if entry is None or entry["last_observation"] < newest:
+            stale.append((up, dn))
+    logger.info(f"Recomputing travel times for {len(stale)} of {max(len(guage_order) - 1, 0)} guage pairs.")
+    if stale:
+        cached.update(estimate_travel_times(observations, guage_order, pairs=stale))
+        with open(cache_path, "w") as cache_file:
+            json.dump(cached, cache_file, indent=1)
+    return (cached, observations, guage_order)
+
+
+def match_guage(guage_order, lid):
+    """Return the guage id from the scrape history that refers to NWS location id 'lid'."""
+    for guage in guage_order:
+        if lid.lower() in str(guage).lower():
+            return guage
+    return None
+
+
+def travel_hours(travel_times, guage_order, upstream, downstream):
+    """Sum the travel times of every consecutive pair between two guages."""
+    start = guage_order.index(upstream)
+    end = guage_order.index(downstream)
+    hops = zip(guage_order[start:end], guage_order[start + 1 : end + 1])
+    return sum(travel_times[f"{up}>{dn}"]["lag_hours"] for up, dn in hops)
+
+
+@logger.catch
+def predict_crest_arrival(observations, travel_times, guage_order,
+                          upstream_point=UPSTREAM_POINT, downstream_point=DOWNSTREAM_POINT,
+                          location=LOCATION_OF_INTEREST):
+    """Predict when the most recent upstream crest reaches the river mile 'location'.
+    The travel time between the bracketing guages is scaled by how far down the pool the location is.
+    Returns None if the bracketing guages are not in the history.
+    """
+    upstream = match_guage(guage_order, guage_lid(upstream_point))
+    downstream = match_guage(guage_order, guage_lid(downstream_point))
+    if upstream is None or downstream is None:
+        logger.error(f"Guages for {upstream_point} and {downstream_point} not found in scrape history.")
+        return None
+    up_mile = RIVER_MONITORING_POINTS[upstream_point]["milemarker"]
+    dn_mile = RIVER_MONITORING_POINTS[downstream_point]["milemarker"]
+    fraction = (location - up_mile) / (dn_mile - up_mile)
+    lag = travel_hours(travel_times, guage_order, upstream, downstream) * fraction
+    series = observations.loc[observations["guage"] == upstream].set_index("datetime")["level"]
+    recent = series[series.index >= series.index.max() - pd.Timedelta(hours=CREST_LOOKBACK_HOURS)]
+    crest_time = recent.idxmax()
+    return {
+        "guage": upstream,
+        "crest_level": float(recent.max()),
+        "crest_time": crest_time,
+        "still_rising": crest_time == recent.index.max(),
+        "travel_hours": round(lag, 1),
+        "arrival_time": crest_time + pd.Timedelta(hours=lag),
+    }
+
+
+@logger.catch
+def Main():
+    travel_times, observations, guage_order = update_travel_times()
+    for pair in travel_times.values():
+        logger.info(f'{pair["upstream"]} -> {pair["downstream"]}: {pair["lag_hours"]} hours (r={pair["correlation"]})')
+    prediction = predict_crest_arrival(observations, travel_times, guage_order)
+    logger.info(f"Crest prediction for mile {LOCATION_OF_INTEREST}: {prediction}")
+    return prediction
+
+
+if __name__ == "__main__":
+    logger.remove()
+    logger.add(sys.stderr, format="{time} {level} {message}", level="INFO")
+    Main()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Measure how good past NWS forecasts were by comparing them with what was observed later.
+Every scrape carries the forecast that was current at scrape time. Each forecast is joined with
+the observation of the same guage at the same valid time and the errors are summarized by
+guage and lead time (valid time minus scrape time).
+This tells us how far ahead the 'Future level' in our tweets can be trusted.
+A scrape file only holds the readings that were new or revised (see change_ingest.py), so the
+forecast every scrape carried is rebuilt from the change log: at each scrape of a guage, every
+forecast issued or revised by then, at its latest level, that is still ahead of it. The scrapes that
+changed nothing left no file, their times come from the scrape index of the guage archive
+(ARCHIVE/<guage>.scrapes, see guage_archive.py) when there is one.
+Only scrapes that have not been processed before are read on each run. Forecasts that are
+still in the future are kept as pending and verified on a later run.
+"""
+import pickle
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+import river_history as rh
+import storage_paths as sp
+
+RUNTIME_NAME = Path(__file__)
+
+SKILL_STATE = "forecast_skill_state.pkl"
+SKILL_REPORT = "forecast_skill.csv"
+LEAD_BUCKET_HOURS = 6
+MATCH_TOLERANCE = pd.Timedelta(minutes=30)  # observation must be this close to the forecast valid time
+
+
+def _empty_state():
+    return {
+        "files": set(),
+        "current": {},  # guage: {valid time: level} of the forecasts carried by its last scrape
+        "last_scrape": {},  # guage: time of the last scrape whose forecasts were rebuilt
+        "pending": pd.DataFrame({
+            "guage": pd.Series(dtype=str),
+            "datetime": pd.Series(dtype="datetime64[ns, UTC]"),
+            "level": pd.Series(dtype=float),
+            "scrape_time": pd.Series(dtype="datetime64[ns, UTC]"),
+        }),
+        "verified": pd.DataFrame({
+            "guage": pd.Series(dtype=str),
+            "lead_hours": pd.Series(dtype=float),
+            "error": pd.Series(dtype=float),
+        }),
+    }
+
+
+def archive_scrape_times(guages, archive_root=sp.ARCHIVE_ROOT):
+    """{guage: scrape times} from the scrape index of the guage archive, {} without an archive."""
+    if archive_root is None or not Path(archive_root).is_dir():
+        return {}
+    import guage_archive as ga
+
+    archive = ga.GuageArchive(archive_root)
+    return {guage: pd.to_datetime(np.array(archive.scrapes(guage)["scrape_minute"]), unit="m", utc=True) for guage in guages}
+
+
+def carried_forecasts(changes, scrape_times, current=None, last_scrape=None):
+    """Rebuild the forecasts every scrape carried from the forecasts it changed.
+
+    Args:
+        changes (pandas.DataFrame): forecast rows (guage, datetime, level, scrape_time) of the change log
+        scrape_times (dict): {guage: scrape times}, every scrape to rebuild including those that changed nothing
+        current (dict, optional): {guage: {valid time: level}} carried by the last scrape rebuilt before, updated in place
+        last_scrape (dict, optional): {guage: time of that scrape}, scrapes up to it are not rebuilt again, updated in place
+
+    Returns:
+        pandas.DataFrame: guage, datetime, level, scrape_time with one row per forecast per scrape.
+    """
+    current = {} if current is None else current
+    last_scrape = {} if last_scrape is None else last_scrape
+    changes = changes.assign(scrape_time=pd.to_datetime(changes["scrape_time"], utc=True).dt.floor("min")).sort_values("scrape_time", kind="stable")
+    rows = []
+    for guage, times in scrape_times.items():
+        revisions = changes.loc[changes["guage"] == guage]
+        carried = current.setdefault(guage, {})
+        done = last_scrape.get(guage)
+        position = 0
+        for scrape_time in sorted(set(pd.DatetimeIndex(times).floor("min"))):
+            while position < len(revisions) and revisions["scrape_time"].iat[position] <= scrape_time:
+                carried[revisions["datetime"].iat[position]] = revisions["level"].iat[position]
+                position += 1
+            for valid_time in [valid_time for valid_time in carried if valid_time <= scrape_time]:
+                del carried[valid_time]  # forecasts no longer ahead of the scrape are not carried
+            if done is not None and scrape_time <= done:
+                continue
+            rows.extend((guage, valid_time, level, scrape_time) for valid_time, level in carried.items())
+            last_scrape[guage] = scrape_time
+        for index in range(position, len(revisions)):  # revisions after the last scrape time known
+            carried[revisions["datetime"].iat[index]] = revisions["level"].iat[index]
+    rebuilt = pd.DataFrame(rows, columns=["guage", "datetime", "level", "scrape_time"])
+    if rebuilt.empty:
+        return _empty_state()["pending"]
+    return rebuilt.astype({"level": float})
+
+
+def match_forecasts(forecasts, observations):
+    """Join each forecast with the nearest observation of the same guage at its valid time.
+
+    Returns (verified, pending) where verified holds guage, lead_hours and error (forecast minus observed)
+    and pending holds the forecasts that have no matching observation yet.
+    """
+    if forecasts.empty:
+        return (_empty_state()["verified"], forecasts)
+    forecasts = forecasts.astype({"level": float}).sort_values("datetime", ignore_index=True)
+    observed = observations.rename(columns={"level": "observed"}).sort_values("datetime", ignore_index=True)
+    joined = pd.merge_asof(
+        forecasts, observed, on="datetime", by="guage", direction="nearest", tolerance=MATCH_TOLERANCE
+    )
+    matched = joined["observed"].notna()
+    latest = observations.groupby("guage")["datetime"].max()
+    # forecasts valid before the latest observation that still found no match never will
+    expired = joined["datetime"] < joined["guage"].map(latest)
+    verified = pd.DataFrame({
+        "guage": joined.loc[matched, "guage"],
+        "lead_hours": (joined.loc[matched, "datetime"] - joined.loc[matched, "scrape_time"]) / pd.Timedelta(hours=1),
+        "error": joined.loc[matched, "level"] - joined.loc[matched, "observed"],
+    })
+    pending = forecasts.loc[~(matched | expired).to_numpy()]
+    return (verified, pending)
+
+
+def skill_by_lead_time(verified, bucket_hours=LEAD_BUCKET_HOURS):
+    """Summarize forecast errors by guage and lead time bucket (bias, mean absolute error, rms error)."""
+    errors = verified.astype({"lead_hours": float, "error": float})
+    errors = errors.assign(
+        lead_bucket=(np.floor(errors["lead_hours"] / bucket_hours) * bucket_hours).astype(int),
+        abs_error=errors["error"].abs(),
+        sq_error=errors["error"] ** 2,
+    )
+    grouped = errors.groupby(["guage", "lead_bucket"])
+    report = grouped.agg(
+        count=("error", "size"),
+        bias=("error", "mean"),
+        mae=("abs_error", "mean"),
+        rmse=("sq_error", "mean"),
+    )
+    report["rmse"] = np.sqrt(report["rmse"])
+    return report.round(3).reset_index()
+
+
+@logger.catch
+def update_forecast_skill(root=rh.HISTORY_ROOT, state_root=rh.STATE_ROOT, archive_root=sp.ARCHIVE_ROOT):
+    """Verify forecasts from any new scrapes, store the running state and write the skill report.
+    Returns the report as a DataFrame.
+    """
+    state_path = rh.state_file(SKILL_STATE, state_root)
+    state = _empty_state()
+    if state_path.exists():
+        with open(state_path, "rb") as state_file:
+            state = pickle.load(state_file)
+    observations, _guage_order = rh.load_observations(root, state_root=state_root)
+    new_files = [fl for fl in rh.list_scrape_files(root) if str(fl) not in state["files"]]
+    logger.info(f"{len(new_files)} new scrape files to verify.")
+    scrapes = rh.read_scrapes(new_files)
+    changes = scrapes.loc[scrapes["type"] == sp.FORECAST, ["guage", "datetime", "level", "scrape_time"]]
+    scrape_times = {guage: times for guage, times in scrapes.groupby("guage")["scrape_time"]}
+    for guage, times in archive_scrape_times(list(scrape_times), archive_root).items():
+        scrape_times[guage] = pd.concat([scrape_times[guage], pd.Series(times)], ignore_index=True)
+    forecasts = carried_forecasts(
+        changes.dropna(subset=["level"]),
+        scrape_times,
+        state.setdefault("current", {}),
+        state.setdefault("last_scrape", {}),
+    )
+    candidates = pd.concat([state["pending"], forecasts], ignore_index=True)
+    verified, pending = match_forecasts(candidates, observations)
+    logger.info(f"Verified {len(verified)} forecasts, {len(pending)} still pending.")
+    state["verified"] = pd.concat([state["verified"], verified], ignore_index=True)
+    state["pending"] = pending
+    state["files"].update(str(fl) for fl in new_files)
+    with open(state_path, "wb") as state_file:
+        pickle.dump(state, state_file)
+    report = skill_by_lead_time(state["verified"])
+    report.to_csv(rh.state_file(SKILL_REPORT, state_root), index=False)
+    return report
+
+
+if __name__ == "__main__":
+    logger.remove()
+    logger.add(sys.stderr, format="{time} {level} {message}", level="INFO")
+    skill = update_forecast_skill()
+    if skill is not None:
+        logger.info(f"\n{skill.to_markdown()}")
@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Binary archive of guage readings, files of fixed-width records per guage.
+The CSV history stores every reading as text that must be parsed again on each read (and
+'level' does not always parse). Here each reading is a 17 byte record:
+
+    minute  int64    UTC minutes since 1970-01-01
+    level   float32  ft (NaN when missing)
+    flow    float32  kcfs (NaN when missing, NWS publishes -999)
+    type    uint8    0 observed, 1 forecast
+
+ARCHIVE/<guage>.rec holds the observed records sorted by minute, ARCHIVE/<guage>.forecast the
+forecast ones. Kept apart because every scrape forecasts days ahead of its latest observation: in
+one file each new observation would be older than the last forecast. A range read memory-maps the
+file, finds both ends with a binary search and returns a view of the mapped records, nothing is
+parsed or copied. Appending a reading newer than the last record of its type is O(1). Older readings
+(mostly forecasts revised by a later scrape) go to a small unsorted <file>.overflow that range reads
+merge in. compact() folds the overflow into the sorted file, keeping the last written value of each
+(minute, type).
+ARCHIVE/<guage>.scrapes indexes the scrapes themselves: the scrape minute, the number of readings
+and the highest forecast of each scrape, sorted by scrape minute.
+
+Hourly, daily and monthly rollups are kept next to these files, see rollups.py.
+
+usage: python guage_archive.py [--source CSV_DATA/] [--archive ARCHIVE/]     (convert the CSV tree)
+"""
+import argparse
+import calendar
+import csv
+import os
+import re
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from loguru import logger
+
+import storage_paths as sp
+
+RECORD = np.dtype([("minute", "<i8"), ("level", "<f4"), ("flow", "<f4"), ("type", "u1")])
+SCRAPE_RECORD = np.dtype([("scrape_minute", "<i8"), ("readings", "<u4"), ("forecast_minute", "<i8"), ("forecast_level", "<f4")])
+TYPE_CODES = {sp.OBSERVED: 0, sp.FORECAST: 1}
+TYPE_NAMES = {code: name for name, code in TYPE_CODES.items()}
+FILE_SUFFIXES = {sp.OBSERVED: "rec", sp.FORECAST: "forecast"}  # ARCHIVE/<guage>.<suffix>, one sorted file per type
+MISSING_VALUE = -999.0
+OVERFLOW_LIMIT = 4096  # overflow records before an append compacts them into the sorted file
+NUMBER_PATTERN = re.compile(r"-?\d+(?:\.\d+)?")
+
+
+def _number(text):
+    found = NUMBER_PATTERN.search(str(text))
+    if found is None or float(found.group()) == MISSING_VALUE:
+        return np.nan
+    return float(found.group())
+
+
+def epoch_minute(csv_datetime):
+    """Minutes since the epoch of a '%Y-%m-%d_%H:%M:%SUTC' datetime string."""
+    return calendar.timegm(time.strptime(csv_datetime, sp.CSV_DATETIME_FORMAT)) // 60
+
+
+def to_datetime64(minutes):
+    """Convert the minute field of records to numpy datetime64 values."""
+    return np.asarray(minutes).astype("datetime64[m]")
+
+
+def from_readings(readings):
+    """Convert sort_and_label_data rows (any number of guages) into {guage: record array}."""
+    by_guage = {}
+    for row in readings:
+        kind = TYPE_CODES.get(row.get("type"))
+        try:
+            minute = epoch_minute(row["datetime"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        if kind is None:
+            continue
+        by_guage.setdefault(str(row["guage"]).lower(), []).append(
+            (minute, _number(row.get("level")), _number(row.get("flow")), kind)
+        )
+    return {guage: np.array(rows, dtype=RECORD) for guage, rows in by_guage.items()}
+
+
+def _latest_per_key(records):
+    """Keep the last written record of each (minute, type), sorted by minute then type."""
+    if len(records) == 0:
+        return records
+    keys = records["minute"] * 4 + records["type"]
+    reversed_keys = keys[::-1]
+    _unique, first_of_reversed = np.unique(reversed_keys, return_index=True)  # unique keys come back sorted
+    return records[len(records) - 1 - first_of_reversed]
+
+
+class GuageArchive:
+    """The archive files below one root directory."""
+
+    def __init__(self, root=sp.ARCHIVE_ROOT, overflow_limit=OVERFLOW_LIMIT):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.overflow_limit = overflow_limit
+
+    def path(self, guage, kind=sp.OBSERVED):
+        return Path(self.root, f"{guage.lower()}.{FILE_SUFFIXES[kind]}")
+
+    def overflow_path(self, guage, kind=sp.OBSERVED):
+        return Path(self.root, f"{guage.lower()}.{FILE_SUFFIXES[kind]}.overflow")
+
+    def scrapes_path(self, guage):
+        return Path(self.root, f"{guage.lower()}.scrapes")
+
+    def guages(self):
+        return sorted({fl.stem for suffix in FILE_SUFFIXES.values() for fl in self.root.glob(f"*.{suffix}")})
+
+    def _count(self, path, dtype=RECORD):
+        try:
+            return os.path.getsize(path) // dtype.itemsize
+        except OSError:
+            return 0
+
+    def records(self, guage, kind=sp.OBSERVED):
+        """Memory-map the sorted records of one type of a guage (read only, empty array if there are none)."""
+        path = self.path(guage, kind)
+        if self._count(path) == 0:
+            return np.empty(0, dtype=RECORD)
+        return np.memmap(path, dtype=RECORD, mode="r", shape=(self._count(path),))
+
+    def overflow(self, guage, kind=sp.OBSERVED):
+        path = self.overflow_path(guage, kind)
+        if self._count(path) == 0:
+            return np.empty(0, dtype=RECORD)
+        return np.fromfile(path, dtype=RECORD, count=self._count(path))
+
+    def last_minute(self, guage, kind=sp.OBSERVED):
+        path = self.path(guage, kind)
+        count = self._count(path)
+        if count == 0:
+            return None
+        with open(path, "rb") as archive:
+            archive.seek((count - 1) * RECORD.itemsize)
+            return int(np.frombuffer(archive.read(RECORD.itemsize), dtype=RECORD)["minute"][0])
+
+    def append(self, guage, records):
+        """Append records of one guage, each to the file of its type. Returns (appended in order, sent to overflow)."""
+        records = np.sort(np.asarray(records, dtype=RECORD), order=["minute", "type"], kind="stable")
+        appended = late_total = 0
+        for kind, code in TYPE_CODES.items():
+            of_kind = records[records["type"] == code]
+            if len(of_kind) == 0:
+                continue
+            last = self.last_minute(guage, kind)
+            split = 0 if last is None else int(np.searchsorted(of_kind["minute"], last, side="right"))
+            late, in_order = of_kind[:split], of_kind[split:]
+            if len(in_order):
+                with open(self.path(guage, kind), "ab") as archive:
+                    archive.write(in_order.tobytes())
+            if len(late):
+                with open(self.overflow_path(guage, kind), "ab") as overflow:
+                    overflow.write(late.tobytes())
+                if self._count(self.overflow_path(guage, kind)) > self.overflow_limit:
+                    self._compact(guage, kind)
+            appended += len(in_order)
+            late_total += len(late)
+        return (appended, late_total)
+
+    @logger.catch
+    def append_readings(self, readings):
+        """Append sort_and_label_data output. Returns the number of records written."""
+        written = 0
+        for guage, records in from_readings(readings).items():
+            written += sum(self.append(guage, records))
+        return written
+
+    def _compact(self, guage, kind):
+        overflow = self.overflow(guage, kind)
+        if len(overflow) == 0:
+            return 0
+        merged = _latest_per_key(np.concatenate([np.array(self.records(guage, kind)), overflow]))
+        temporary = Path(f"{self.path(guage, kind)}.tmp")
+        merged.tofile(temporary)
+        os.replace(temporary, self.path(guage, kind))
+        self.overflow_path(guage, kind).unlink()
+        return len(overflow)
+
+    def compact(self, guage):
+        """Merge the overflows into the sorted files of a guage. Returns the number of records merged."""
+        return sum(self._compact(guage, kind) for kind in TYPE_CODES)
+
+    def record_scrape(self, guage, scrape_minute, records):
+        """Add one scrape of a guage (all of its readings, not just the changes) to the scrape index."""
+        forecasts = records[(records["type"] == TYPE_CODES[sp.FORECAST]) & ~np.isnan(records["level"])]
+        summary = np.zeros(1, dtype=SCRAPE_RECORD)
+        summary["scrape_minute"] = scrape_minute
+        summary["readings"] = len(records)
+        summary["forecast_level"] = np.nan
+        if len(forecasts):
+            highest = forecasts[np.argmax(forecasts["level"])]
+            summary["forecast_minute"] = highest["minute"]
+            summary["forecast_level"] = highest["level"]
+        path = self.scrapes_path(guage)
+        existing = self.scrapes(guage)
+        if len(existing) and existing["scrape_minute"][-1] > scrape_minute:
+            # a scrape older than the last one indexed (ex: a backfill), keep the file sorted
+            merged = np.sort(np.concatenate([np.array(existing), summary]), order="scrape_minute", kind="stable")
+            temporary = path.with_suffix(".tmp")
+            merged.tofile(temporary)
+            os.replace(temporary, path)
+        else:
+            with open(path, "ab") as scrapes:
+                scrapes.write(summary.tobytes())
+        return summary[0]
+
+    @logger.catch
+    def record_scrape_readings(self, readings, scrape_minute):
+        """record_scrape for sort_and_label_data output."""
+        for guage, records in from_readings(readings).items():
+            self.record_scrape(guage, scrape_minute, records)
+        return True
+
+    def indexed(self, guage, scrape_minute):
+        """True if the scrape of a guage at scrape_minute is already in the scrape index."""
+        return len(self.scrapes(guage, scrape_minute, scrape_minute + 1)) > 0
+
+    def scrapes(self, guage, start=None, end=None):
+        """Scrape index entries of a guage with start <= scrape minute < end (a view of the mapped file)."""
+        path = self.scrapes_path(guage)
+        count = self._count(path, SCRAPE_RECORD)
+        if count == 0:
+            return np.empty(0, dtype=SCRAPE_RECORD)
+        scrapes = np.memmap(path, dtype=SCRAPE_RECORD, mode="r", shape=(count,))
+        minutes = scrapes["scrape_minute"]
+        low = 0 if start is None else int(np.searchsorted(minutes, start, side="left"))
+        high = count if end is None else int(np.searchsorted(minutes, end, side="left"))
+        return scrapes[low:high]
+
+    def latest(self, guage, kind=sp.OBSERVED, before=None):
+        """The last record of a type at or before 'before' (epoch minutes), None if there is none."""
+        records = self.read_range(guage, None, None if before is None else before + 1, kind)
+        if len(records) == 0:
+            return None
+        return records[-1]
+
+    def read_range(self, guage, start=None, end=None, kind=None):
+        """Records of a guage with start <= minute < end (epoch minutes, None for open ended), sorted by
+        minute then type. Of one kind without overflow records the result is a view of the memory-mapped file.
+        """
+        if kind is None:
+            both = [self.read_range(guage, start, end, kind) for kind in TYPE_CODES]
+            merged = np.concatenate([np.array(records) for records in both])
+            return np.sort(merged, order=["minute", "type"], kind="stable")
+        records = self.records(guage, kind)
+        minutes = records["minute"]
+        low = 0 if start is None else int(np.searchsorted(minutes, start, side="left"))
+        high = len(records) if end is None else int(np.searchsorted(minutes, end, side="left"))
+        selected = records[low:high]
+        overflow = self.overflow(guage, kind)
+        if len(overflow):
+            in_range = np.ones(len(overflow), dtype=bool)
+            if start is not None:
+                in_range &= overflow["minute"] >= start
+            if end is not None:
+                in_range &= overflow["minute"] < end
+            if in_range.any():
+                selected = _latest_per_key(np.concatenate([np.array(selected), overflow[in_range]]))
+        return selected
+
+
+def scrape_minute_from_filename(path):
+    """Epoch minute of the scrape time in a CSV_DATA filename, None if the name does not follow the pattern."""
+    try:
+        return calendar.timegm(time.strptime(Path(path).name[:18], sp.SCRAPE_FILENAME_FORMAT)) // 60
+    except ValueError:
+        return None
+
+
+def csv_files(root=sp.HISTORY_ROOT):
+    """Every scrape file below root, oldest first (the filename is the scrape time)."""
+    return sorted((fl for fl in Path(root).rglob("*") if fl.is_file()), key=lambda fl: fl.name)
+
+
+@logger.catch
+def convert_csv_tree(source=sp.HISTORY_ROOT, archive_root=sp.ARCHIVE_ROOT):
+    """Append every CSV scrape file to the archive and compact it. Returns the number of records written.
+    Each file is also added to the scrape index unless its scrape of that guage is indexed already (a second
+    run indexes nothing twice). Files written since the change-only ingest (see change_ingest.py) hold only
+    the readings that changed, so their index entries count and summarize those readings, not the whole scrape.
+    """
+    archive = GuageArchive(archive_root)
+    written = 0
+    files = csv_files(source)
+    for fl in files:
+        try:
+            with open(fl, "r", newline="") as csvfile:
+                readings = list(csv.DictReader(csvfile))
+            written += archive.append_readings(readings)
+            scrape_minute = scrape_minute_from_filename(fl)
+            if scrape_minute is not None:
+                indexed = {guage for guage in {row["guage"] for row in readings} if archive.indexed(guage, scrape_minute)}
+                archive.record_scrape_readings([row for row in readings if row["guage"] not in indexed], scrape_minute)
+        except (OSError, UnicodeDecodeError, csv.Error) as e:
+            logger.warning(f"Skipping unreadable scrape file {fl}: {e}")
+    import rollups
+
+    store = rollups.RollupStore(archive)
+    for guage in archive.guages():
+        archive.compact(guage)
+        store.rebuild(guage)
+    logger.info(f"Converted {len(files)} scrape files, {written} records, {len(archive.guages())} guages.")
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert the CSV scrape history into the binary guage archive.")
+    parser.add_argument("--source", default=sp.HISTORY_ROOT, help="root of the CSV scrape history")
+    parser.add_argument("--archive", default=sp.ARCHIVE_ROOT, help="root of the binary archive")
+    args = parser.parse_args()
+    logger.remove()
+    logger.add(sys.stderr, format="{time} {level} {message}", level="INFO")
+    convert_csv_tree(args.source, args.archive)
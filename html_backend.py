@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""Pluggable html parsing for NWS river.php guage pages.
+The 'lxml' backend parses with libxml2 and finds everything with precompiled XPath expressions
+that only visit the elements they need. The 'bs4' backend uses BeautifulSoup with the
+pure-python html.parser exactly like the original scraper and is kept as a fallback for
+machines without lxml. Both backends return the same plain python structure:
+
+    (guage_id, guage_name, comments, sections)
+
+where comments is a list of the html comment strings and sections is a list of
+(section title, [cell strings]) taken from the 'obs_fores' block of the page.
+"""
+from functools import lru_cache
+from importlib.util import find_spec
+
+from loguru import logger
+
+# lxml is only imported when the first page is parsed, this keeps importing the scraper fast.
+LXML_LOADED = find_spec("lxml") is not None
+
+BACKENDS = ["lxml", "bs4"]
+DEFAULT_BACKEND = "lxml" if LXML_LOADED else "bs4"
+
+
+def _has_class(name):
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+@lru_cache(maxsize=None)
+def compiled_xpaths():
+    """XPath expressions are compiled once and reused for every page."""
+    from lxml import etree
+
+    return {
+        "first_h1": etree.XPath("(//h1)[1]"),
+        "comments": etree.XPath("//comment()"),
+        "obs_fores": etree.XPath(f"(//*[{_has_class('obs_fores')}])[1]"),
+        "data_name": etree.XPath(f"(.//*[{_has_class('data_name')}])[1]"),
+        "names_infos": etree.XPath(f".//*[{_has_class('names_infos')}]"),
+    }
+
+
+def _first_text(element):
+    """Equivalent of bs4 element.contents[0] for elements that start with text."""
+    if element.text is not None:
+        return element.text
+    from lxml import etree
+
+    return etree.tostring(element[0], encoding="unicode", with_tail=False)
+
+
+def extract_page_lxml(raw_html):
+    from lxml import html as lxml_html
+
+    xpaths = compiled_xpaths()
+    root = lxml_html.fromstring(raw_html)
+    h1 = xpaths["first_h1"](root)[0]
+    comments = [comment.text for comment in xpaths["comments"](root)]
+    block = xpaths["obs_fores"](root)[0]
+    # bs4 .contents includes leading text as its first item, the scraper always skips item zero.
+    items = list(block) if block.text is not None else list(block)[1:]
+    sections = []
+    for item in items:
+        title = _first_text(xpaths["data_name"](item)[0])
+        sections.append((title, [_first_text(cell) for cell in xpaths["names_infos"](item)]))
+    guage_name = h1.text if len(h1) == 0 else None  # bs4 .string is None for mixed content
+    return (h1.get("id"), guage_name, comments, sections)
+
+
+def extract_page_bs4(raw_html):
+    from bs4 import BeautifulSoup, Comment
+
+    soup = BeautifulSoup(raw_html, "html.parser")
+    comments = [str(c) for c in soup.find_all(string=lambda text: isinstance(text, Comment))]
+    block = soup.find(class_="obs_fores")
+    sections = []
+    for item in block.contents[1:]:  # zeroth item is an empty list. skip it.
+        title = str(item.find(class_="data_name").contents[0])
+        sections.append((title, [str(cell.contents[0]) for cell in item.find_all(class_="names_infos")]))
+    name = soup.h1.string
+    return (soup.h1["id"], None if name is None else str(name), comments, sections)
+
+
+EXTRACTORS = {"lxml": extract_page_lxml, "bs4": extract_page_bs4}
+
+
+@logger.catch
+def extract_page(raw_html, backend=None):
+    """Return (guage_id, guage_name, comments, sections) of a river.php page using the chosen backend."""
+    if backend is None:
+        backend = DEFAULT_BACKEND
+    if backend == "lxml" and not LXML_LOADED:
+        logger.warning("lxml not available, falling back to BeautifulSoup.")
+        backend = "bs4"
+    return EXTRACTORS[backend](raw_html)
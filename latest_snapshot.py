@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""The latest reading of every guage in one small fixed-layout binary file.
+The scraper daemon republishes the file after each guage it scrapes. Local readers (the bot,
+displays) memory-map it and read records in place, nothing is parsed and nothing is fetched.
+
+File layout (little-endian):
+
+    header  24 bytes   magic b"RVSN", version u16, record size u16, generation u64, count u32, reserved u32
+    record  40 bytes   lid 8s, observed time i64, observed level f32, observed flow f32,
+                       highest forecast time i64, highest forecast level f32, reserved u32
+
+Times are UTC epoch seconds (0 when unknown), levels in ft and flows in kcfs (NaN when unknown).
+Records are sorted by lid so one can be found by binary search.
+The file is written to a temporary name and moved into place with os.replace, so a reader sees
+either the old or the new snapshot, never a partial one. The generation goes up by one on
+every publish, readers notice a new snapshot with one os.stat and one 8 byte read.
+"""
+import calendar
+import math
+import mmap
+import os
+import re
+import struct
+import time
+from pathlib import Path
+
+from loguru import logger
+
+import storage_paths as sp
+
+SNAPSHOT_FILE = "latest_snapshot.bin"
+MAGIC = b"RVSN"
+VERSION = 1
+HEADER = struct.Struct("<4sHHQII")
+RECORD = struct.Struct("<8sqffqfI")
+GENERATION_OFFSET = 8  # position of the generation counter in the header
+LEVEL_PATTERN = re.compile(r"-?\d+(?:\.\d+)?")
+MISSING_VALUE = -999.0  # NWS shows '-999kcfs' when no flow is published
+
+
+def snapshot_path(state_root=sp.STATE_ROOT):
+    return sp.state_file(SNAPSHOT_FILE, state_root)
+
+
+def _number(text):
+    found = LEVEL_PATTERN.search(str(text))
+    if found is None or float(found.group()) == MISSING_VALUE:
+        return math.nan
+    return float(found.group())
+
+
+def _epoch(csv_datetime):
+    return calendar.timegm(time.strptime(csv_datetime, sp.CSV_DATETIME_FORMAT))
+
+
+def latest_record(readings):
+    """Reduce one scrape of a guage (sort_and_label_data rows) to
+    (observed time, observed level, observed flow, highest forecast time, highest forecast level).
+    """
+    observed = [row for row in readings if row.get("type") == sp.OBSERVED]
+    forecast = [row for row in readings if row.get("type") == sp.FORECAST and not math.isnan(_number(row.get("level")))]
+    obs_time, obs_level, obs_flow = 0, math.nan, math.nan
+    if observed:
+        latest = max(observed, key=lambda row: row["datetime"])  # the csv format sorts as text
+        obs_time, obs_level, obs_flow = _epoch(latest["datetime"]), _number(latest["level"]), _number(latest["flow"])
+    fcst_time, fcst_level = 0, math.nan
+    if forecast:
+        highest = max(forecast, key=lambda row: _number(row["level"]))
+        fcst_time, fcst_level = _epoch(highest["datetime"]), _number(highest["level"])
+    return (obs_time, obs_level, obs_flow, fcst_time, fcst_level)
+
+
+def encode(records, generation):
+    """Bytes of a snapshot of {lid: latest_record tuple}."""
+    lids = sorted(records, key=str.upper)
+    buffer = bytearray(HEADER.size + RECORD.size * len(lids))
+    HEADER.pack_into(buffer, 0, MAGIC, VERSION, RECORD.size, generation, len(lids), 0)
+    for i, lid in enumerate(lids):
+        RECORD.pack_into(buffer, HEADER.size + i * RECORD.size, lid.upper().encode("ascii")[:8], *records[lid], 0)
+    return bytes(buffer)
+
+
+class SnapshotWriter:
+    """Keeps the latest record of every guage and republishes the snapshot file when one changes."""
+
+    def __init__(self, path=None):
+        self.path = Path(path or snapshot_path())
+        self.records = {}
+        self.generation = 0
+        reader = SnapshotReader(self.path)
+        if reader.refresh():  # continue from the last published snapshot
+            self.generation = reader.generation()
+            self.records = {record[0]: record[1:] for record in reader.records()}
+        reader.close()
+
+    @logger.catch
+    def update(self, lid, readings):
+        """Record the latest readings of one guage and publish. Returns the new generation."""
+        self.records[lid.upper()] = latest_record(readings)
+        return self.publish()
+
+    def publish(self):
+        self.generation += 1
+        temporary = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        with open(temporary, "wb") as snapshot:
+            snapshot.write(encode(self.records, self.generation))
+            snapshot.flush()
+            os.fsync(snapshot.fileno())
+        os.replace(temporary, self.path)
+        return self.generation
+
+
+class SnapshotReader:
+    """Memory-maps the snapshot file. Call refresh() to pick up a newer snapshot, it is cheap when there is none."""
+
+    def __init__(self, path=None):
+        self.path = Path(path or snapshot_path())
+        self._map = None
+        self._identity = None
+        self.count = 0
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def refresh(self):
+        """Map the file again if it was replaced since the last call. Returns True if a snapshot is mapped."""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            self.close()
+            return False
+        identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if identity != self._identity:
+            self.close()
+            if stat.st_size < HEADER.size:
+                return False
+            with open(self.path, "rb") as snapshot:
+                self._map = mmap.mmap(snapshot.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, record_size, _generation, count, _reserved = HEADER.unpack_from(self._map, 0)
+            if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+                logger.error(f"{self.path} is not a version {VERSION} river snapshot.")
+                self.close()
+                return False
+            self.count = count
+            self._identity = identity
+        return self._map is not None
+
+    def generation(self):
+        """Generation of the mapped snapshot (0 if none)."""
+        if self._map is None:
+            return 0
+        return struct.unpack_from("<Q", self._map, GENERATION_OFFSET)[0]
+
+    def record(self, index):
+        fields = RECORD.unpack_from(self._map, HEADER.size + index * RECORD.size)
+        return (fields[0].rstrip(b"\0").decode("ascii"),) + fields[1:6]
+
+    def records(self):
+        """(lid, observed time, observed level, observed flow, forecast time, forecast level) of every guage."""
+        if self._map is None:
+            return []
+        return [self.record(i) for i in range(self.count)]
+
+    def lookup(self, lid):
+        """Binary search for one guage. Returns its record or None."""
+        if self._map is None:
+            return None
+        key = lid.upper()
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            found = self.record(middle)
+            if found[0] == key:
+                return found
+            if found[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        return None
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Measure the memory used by tweet cycles of the bot.
+Each cycle is run between two tracemalloc snapshots and reports the process resident set size,
+the python memory still allocated after the cycle, the peak during the cycle and the source
+lines that grew the most. A week of recorded hydrograph pages (one pair every 6 hours) can be
+replayed offline so the numbers can be compared with the ceiling of the active runtime profile.
+
+usage: RIVERBOT_RUNTIME=pi python memory_harness.py [--pages test_fixtures/hydrograph_week] [--json]
+"""
+import argparse
+import json
+import resource
+import sys
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+from loguru import logger
+
+import runtime_profile as rp
+
+RECORDED_WEEK = Path(__file__).parent / "test_fixtures" / "hydrograph_week"
+TOP_ALLOCATIONS = 5
+MB = 1024 * 1024
+
+
+def rss_bytes():
+    """Current resident set size of this process (peak RSS where /proc is not available)."""
+    try:
+        with open("/proc/self/status", "r") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def measure_cycles(cycles, top=TOP_ALLOCATIONS, warmup=0):
+    """Run each callable in 'cycles' and return one report dict per cycle.
+    The first 'warmup' cycles run before tracing starts (module imports, caches) and are not reported.
+    """
+    cycles = iter(cycles)
+    for _number, cycle in zip(range(warmup), cycles):
+        cycle()
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    reports = []
+    try:
+        for number, cycle in enumerate(cycles, start=1):
+            before = tracemalloc.take_snapshot()
+            tracemalloc.reset_peak()
+            cycle()
+            current, peak = tracemalloc.get_traced_memory()
+            after = tracemalloc.take_snapshot()
+            growth = after.compare_to(before, "lineno")[:top]
+            reports.append({
+                "cycle": number,
+                "rss_mb": round(rss_bytes() / MB, 2),
+                "traced_mb": round(current / MB, 3),
+                "peak_mb": round(peak / MB, 3),
+                "top_allocations": [str(stat) for stat in growth],
+            })
+    finally:
+        if started:
+            tracemalloc.stop()
+    return reports
+
+
+class OfflineTwitter:
+    """Accepts status updates without sending them anywhere. Keeps only a count."""
+
+    def __init__(self):
+        self.sent = 0
+
+    def update_status(self, status):
+        self.sent += 1
+        return {"text": status}
+
+
+def recorded_fetchers(pages=RECORDED_WEEK):
+    """Return one fetch function per recorded scrape time, each serving the pages recorded then."""
+    return [fetch for _stamp, fetch in recorded_scrapes(pages)]
+
+
+def recorded_scrapes(pages=RECORDED_WEEK):
+    """Return (scrape time stamp, fetch function) pairs in time order, stamps like '20220301_0600'."""
+    by_time = {}
+    for page in sorted(Path(pages).glob("*.html")):
+        lid, stamp = page.stem.split("_", 1)
+        by_time.setdefault(stamp, {})[lid] = page
+
+    def fetcher(recorded):
+        def fetch(url):
+            for lid, page in recorded.items():
+                if f"gage={lid}" in url.lower():
+                    return page.read_bytes()
+            return None
+
+        return fetch
+
+    return [(stamp, fetcher(by_time[stamp])) for stamp in sorted(by_time)]
+
+
+def replay_week(pages=RECORDED_WEEK, db_folder=None):
+    """Replay recorded scrapes through the tweet cycle. Returns (reports, tweets sent)."""
+    from datetime import datetime, timedelta
+    from pupdb.core import PupDB
+
+    import Sunset_Village_TwitterBot as bot
+    import tweet_queue as tq
+    from NWS_River_Data_scrape_NEW import processRiverData
+
+    folder = Path(db_folder or tempfile.mkdtemp())
+    db = PupDB(str(folder / bot.PUPDB_FILENAME))
+    bot.TWEET_QUEUE = tq.TweetQueue(folder / tq.QUEUE_FILE)
+    bot.PUBLISHER = None  # rebuilt around the queue above
+    twitter = OfflineTwitter()
+    clock = [datetime(2022, 3, 1)]
+
+    def tweet_cycle(fetch):
+        def cycle():
+            data = processRiverData(fetch)
+            status = bot.build_tweet(data, db)
+            clock[0] += timedelta(hours=6)
+            bot.send_tweet(db, clock[0], status, twitter)
+
+        return cycle
+
+    fetchers = recorded_fetchers(pages)
+    # the first recorded scrape is replayed once untraced so imports are not counted as cycle allocations
+    reports = measure_cycles((tweet_cycle(fetch) for fetch in fetchers[:1] + fetchers), warmup=1)
+    return (reports, twitter.sent - 1)
+
+
+def summary(reports):
+    return {
+        "profile": rp.active_profile(),
+        "cycles": len(reports),
+        "max_rss_mb": max(r["rss_mb"] for r in reports),
+        "max_peak_mb": max(r["peak_mb"] for r in reports),
+        "traced_growth_mb": round(reports[-1]["traced_mb"] - reports[0]["traced_mb"], 3),
+        "pandas_loaded": "pandas" in sys.modules,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded scrapes and report memory per tweet cycle.")
+    parser.add_argument("--pages", default=str(RECORDED_WEEK), help="directory of recorded hydrograph pages")
+    parser.add_argument("--json", action="store_true", help="print the summary and reports as json")
+    args = parser.parse_args()
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+    reports, sent = replay_week(args.pages)
+    result = summary(reports)
+    result["tweets"] = sent
+    if args.json:
+        print(json.dumps({"summary": result, "reports": reports}))
+    else:
+        for report in reports:
+            print(f'cycle {report["cycle"]:3}  rss {report["rss_mb"]:7.2f} MB  '
+                  f'traced {report["traced_mb"]:6.3f} MB  peak {report["peak_mb"]:6.3f} MB')
+            for line in report["top_allocations"]:
+                print(f"      {line}")
+        print(result)
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""Counters and histograms for the scraper and the bot.
+The main stages (fetching, parsing, labelling, building and sending tweets) are timed with the
+'timed' decorator or 'call'. The numbers are served in the Prometheus text format on a local port
+and appended as one JSON line per cycle to LOGS/ so they can be read without a Prometheus server,
+that file is rotated like the logs (metrics_rotation_bytes and metrics_retention of runtime_profile.py).
+Timing a stage costs a few microseconds, so the instrumentation is always on.
+
+    curl http://127.0.0.1:9105/metrics        (bot, the scraper uses 9106)
+"""
+import json
+import os
+import threading
+import time
+from functools import wraps
+from pathlib import Path
+
+from loguru import logger
+
+import runtime_profile as rp
+
+METRICS_PORT_ENV_VAR = "RIVERBOT_METRICS_PORT"  # set to 0 to disable the endpoint
+BOT_METRICS_PORT = 9105
+SCRAPER_METRICS_PORT = 9106
+METRICS_HOST = "127.0.0.1"  # local only
+METRICS_FOLDER = "LOGS/"
+PREFIX = "riverbot_"
+# seconds, from a cached page to a scrape that waits on a failing NWS server
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_LOCK = threading.Lock()
+REGISTRY = {}
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _label_text(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    """A value that only goes up, one per set of labels."""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with _LOCK:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self.values.get(_label_key(labels), 0)
+
+    def samples(self):
+        return [(self.name, key, value) for key, value in self.values.items()]
+
+    def as_dict(self):
+        return {_label_text(key) or "total": value for key, value in self.values.items()}
+
+
+class Histogram:
+    """Counts observations into cumulative buckets and keeps their sum, one per set of labels."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.values = {}  # label key -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with _LOCK:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def count(self, **labels):
+        state = self.values.get(_label_key(labels))
+        return 0 if state is None else state[-1]
+
+    def samples(self):
+        samples = []
+        for key, state in self.values.items():
+            running = 0
+            for bound, hits in zip(self.buckets, state):
+                running += hits
+                samples.append((f"{self.name}_bucket", key + (("le", bound),), running))
+            samples.append((f"{self.name}_bucket", key + (("le", "+Inf"),), state[-1]))
+            samples.append((f"{self.name}_sum", key, round(state[-2], 6)))
+            samples.append((f"{self.name}_count", key, state[-1]))
+        return samples
+
+    def as_dict(self):
+        return {
+            _label_text(key) or "total": {"count": state[-1], "sum": round(state[-2], 6)}
+            for key, state in self.values.items()
+        }
+
+
+def _register(cls, name, help_text, *args):
+    full_name = f"{PREFIX}{name}"
+    with _LOCK:
+        if full_name not in REGISTRY:
+            REGISTRY[full_name] = cls(full_name, help_text, *args)
+        return REGISTRY[full_name]
+
+
+def counter(name, help_text=""):
+    return _register(Counter, name, help_text)
+
+
+def histogram(name, help_text="", buckets=LATENCY_BUCKETS):
+    return _register(Histogram, name, help_text, buckets)
+
+
+STAGE_SECONDS = histogram("stage_seconds", "Time spent in each stage of a scrape or tweet cycle.")
+STAGE_CALLS = counter("stage_calls_total", "Calls of each stage by outcome (ok, empty, error).")
+ROWS = counter("rows_total", "Readings parsed per guage.")
+LOOP_DRIFT = histogram("loop_drift_seconds", "How late the bot main loop woke up for its next tweet.")
+
+
+def _outcome(result):
+    return "empty" if result is None or result == [] or result == {} else "ok"
+
+
+def call(stage, function, *args, **kwargs):
+    """Call function(*args, **kwargs) timing it as 'stage'."""
+    start = time.perf_counter()
+    try:
+        result = function(*args, **kwargs)
+    except BaseException:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+        STAGE_CALLS.inc(stage=stage, outcome="error")
+        raise
+    STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+    STAGE_CALLS.inc(stage=stage, outcome=_outcome(result))
+    return result
+
+
+def timed(stage):
+    """Decorator timing every call of a function as 'stage'. Place it under @logger.catch so errors are counted."""
+
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            return call(stage, function, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def render_prometheus():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    with _LOCK:
+        for metric in REGISTRY.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, key, value in metric.samples():
+                lines.append(f"{name}{_label_text(key)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def snapshot():
+    """All metrics as a dict that can be written as JSON."""
+    with _LOCK:
+        return {name: metric.as_dict() for name, metric in REGISTRY.items() if metric.values}
+
+
+def rotate(path, max_bytes, keep):
+    """Rename path to path.1 (path.1 to path.2 ...) once it holds max_bytes, keeping 'keep' rotated files."""
+    path = Path(path)
+    if max_bytes is None or not path.exists() or path.stat().st_size < max_bytes:
+        return False
+    for number in range(keep, 0, -1):
+        older = path.with_name(f"{path.name}.{number}")
+        if number == keep:
+            older.unlink(missing_ok=True)
+        elif older.exists():
+            os.replace(older, path.with_name(f"{path.name}.{number + 1}"))
+    if keep > 0:
+        os.replace(path, path.with_name(f"{path.name}.1"))
+    else:
+        path.unlink()
+    return True
+
+
+@logger.catch
+def dump_json(program, folder=METRICS_FOLDER, max_bytes=None, keep=None):
+    """Append the current metrics as one JSON line to LOGS/<program>_metrics.jsonl. Call once per cycle.
+    The file is rotated at max_bytes keeping 'keep' older files (default: the runtime profile's settings).
+    """
+    Path(folder).mkdir(parents=True, exist_ok=True)
+    path = Path(folder, f"{program}_metrics.jsonl")
+    rotate(
+        path,
+        rp.setting("metrics_rotation_bytes") if max_bytes is None else max_bytes,
+        rp.setting("metrics_retention") if keep is None else keep,
+    )
+    line = json.dumps({"time": time.time(), "metrics": snapshot()})
+    with open(path, "a") as jsonl:
+        jsonl.write(line + "\n")
+    return True
+
+
+def serve(port=None, host=METRICS_HOST):
+    """Serve /metrics (Prometheus) and /metrics.json from a daemon thread. Returns the server or None."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    port = int(os.environ.get(METRICS_PORT_ENV_VAR, port if port is not None else BOT_METRICS_PORT))
+    if os.environ.get(METRICS_PORT_ENV_VAR) == "0":
+        return None
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                body, content_type = render_prometheus(), "text/plain; version=0.0.4"
+            elif self.path == "/metrics.json":
+                body, content_type = json.dumps(snapshot()), "application/json"
+            else:
+                self.send_error(404)
+                return
+            payload = body.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            logger.debug(f"metrics request {format % args}")
+
+    try:
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+    except OSError as e:
+        logger.warning(f"Metrics endpoint not started on port {port}: {e}")
+        return None
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info(f"Metrics served at http://{host}:{server.server_address[1]}/metrics")
+    return server
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""Adaptive polling schedule for the guage scraper.
+Every guage gets its own next-due time. Quiet guages are polled rarely and guages that are
+rising quickly or approaching a flood action level are polled often. No guage is polled faster
+than NWS actually publishes new observations for it.
+Between polls the scheduler sleeps once until the next guage is due instead of waking every second.
+Only the hydrograph guages of rivers.json have flood action levels (GUAGE_THRESHOLDS). Every other
+guage is polled by its rate of rise alone, within the same MIN/MAX_POLL_INTERVAL bounds.
+"""
+import datetime as dt
+import heapq
+import re
+import time
+from statistics import median
+
+from loguru import logger
+
+from NWS_River_Data_scrape_NEW import ACTION_LABELS, RIVER_MONITORING_POINTS, guage_lid
+from storage_paths import CSV_DATETIME_FORMAT
+
+MIN_POLL_INTERVAL = 15 * 60  # seconds
+MAX_POLL_INTERVAL = 12 * 60 * 60  # quiet guages
+RETRY_INTERVAL = 30 * 60  # after a failed scrape
+QUIET_RATE = 0.05  # ft/hr, slower changes than this are considered quiet
+THRESHOLD_MARGIN = 2.0  # ft, poll at the NWS cadence when this close to an action level
+RATE_WINDOW_HOURS = 6
+
+# flood action levels keyed by NWS location id (ex: 'MKLK2'), the hydrograph guages only
+GUAGE_THRESHOLDS = {
+    guage_lid(name): sorted(details[label] for label in ACTION_LABELS)
+    for name, details in RIVER_MONITORING_POINTS.items()
+}
+
+
+def lid_from_name(friendly_name):
+    """Extract the NWS location id from a guage name like 'Ohio River At Cincinnati (CCNO1)'."""
+    found = re.search(r"\(([A-Za-z0-9]+)\)", str(friendly_name))
+    if found:
+        return found.group(1).upper()
+    return None
+
+
+def observed_series(readings):
+    """Return a time sorted list of (datetime, level) for the observed readings of one scrape."""
+    series = []
+    for row in readings:
+        if row.get("type") != "Observed":
+            continue
+        level = re.search(r"-?\d+(?:\.\d+)?", str(row.get("level")))
+        try:
+            stamp = dt.datetime.strptime(row["datetime"], CSV_DATETIME_FORMAT)
+        except (KeyError, TypeError, ValueError):
+            continue
+        if level:
+            series.append((stamp, float(level.group())))
+    return sorted(series)
+
+
+def update_cadence(series):
+    """Median number of seconds between NWS observations (MIN_POLL_INTERVAL if unknown)."""
+    gaps = [(b[0] - a[0]).total_seconds() for a, b in zip(series[:-1], series[1:])]
+    gaps = [gap for gap in gaps if gap > 0]
+    if not gaps:
+        return MIN_POLL_INTERVAL
+    return max(median(gaps), MIN_POLL_INTERVAL)
+
+
+def rate_of_change(series, window_hours=RATE_WINDOW_HOURS):
+    """Rate of change in ft/hr over the last 'window_hours' of observations."""
+    if len(series) < 2:
+        return 0.0
+    latest_time, latest_level = series[-1]
+    start = latest_time - dt.timedelta(hours=window_hours)
+    earlier = [point for point in series if point[0] >= start][0]
+    hours = (latest_time - earlier[0]).total_seconds() / 3600
+    if hours == 0:
+        return 0.0
+    return (latest_level - earlier[1]) / hours
+
+
+def next_poll_interval(readings, friendly_name):
+    """Return the number of seconds until this guage should be scraped again."""
+    series = observed_series(readings)
+    if not series:
+        return RETRY_INTERVAL
+    cadence = update_cadence(series)
+    rate = rate_of_change(series)
+    level = series[-1][1]
+    interval = MAX_POLL_INTERVAL
+    if abs(rate) > QUIET_RATE:
+        interval = MAX_POLL_INTERVAL * QUIET_RATE / abs(rate)
+    above = [t for t in GUAGE_THRESHOLDS.get(lid_from_name(friendly_name), []) if t > level]
+    if above:
+        distance = above[0] - level
+        if distance <= THRESHOLD_MARGIN:
+            interval = cadence
+        elif rate > 0:
+            # poll at least 4 times before the next action level could be reached
+            interval = min(interval, distance / rate * 3600 / 4)
+    return int(min(max(interval, cadence), MAX_POLL_INTERVAL))
+
+
+class PollingScheduler:
+    """Keeps a next-due time per guage url and calls the scrape function as guages come due."""
+
+    def __init__(self, urls, clock=time.time, sleeper=time.sleep):
+        self.clock = clock
+        self.sleeper = sleeper
+        now = self.clock()
+        # all guages are due immediately, in their original (upstream to downstream) order
+        self.queue = [(now, order, url) for order, url in enumerate(urls)]
+        heapq.heapify(self.queue)
+
+    def due(self):
+        """Pop and return the urls that are due now."""
+        now = self.clock()
+        ready = []
+        while self.queue and self.queue[0][0] <= now:
+            ready.append(heapq.heappop(self.queue))
+        return ready
+
+    def reschedule(self, order, url, interval):
+        heapq.heappush(self.queue, (self.clock() + interval, order, url))
+
+    def seconds_until_next(self):
+        if not self.queue:
+            return None
+        return max(self.queue[0][0] - self.clock(), 0)
+
+    def run_once(self, scrape, batch=False):
+        """Scrape every guage that is due and schedule its next poll. Returns the number scraped.
+        batch: scrape takes the list of due urls and returns {url: result} (ex: OHIO_RIVER_LEVEL_SCRAPING.Main),
+        so hundreds of guages that come due together are fetched concurrently.
+        """
+        ready = self.due()
+        if batch:
+            results = (scrape([url for _due, _order, url in ready]) or {}) if ready else {}
+        for _due, order, url in ready:
+            result = results.get(url) if batch else scrape(url)
+            if result is None:
+                interval = RETRY_INTERVAL
+            else:
+                readings, friendly_name = result
+                interval = next_poll_interval(readings, friendly_name)
+            logger.info(f"Next poll of {url} in {interval / 3600:.2f} hours.")
+            self.reschedule(order, url, interval)
+        return len(ready)
+
+    def run(self, scrape, cycles=None, after_cycle=None, batch=False):
+        """Poll guages forever (or for 'cycles' wakeups), sleeping until the next one is due.
+        after_cycle is called with no arguments after each wakeup (ex: to dump metrics).
+        """
+        while cycles is None or cycles > 0:
+            self.run_once(scrape, batch)
+            if after_cycle is not None:
+                after_cycle()
+            wait = self.seconds_until_next()
+            if wait is None:
+                return
+            logger.info(f"Sleeping {wait:.0f} seconds until the next guage is due.")
+            self.sleeper(wait)
+            if cycles is not None:
+                cycles -= 1
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Compare two cProfile files (ex: a slow cycle with a normal one from PROFILES/).
+Functions are listed by how much their time changed, largest change first.
+
+usage: python profile_diff.py BEFORE.prof AFTER.prof [--sort cumtime|tottime|calls] [--top 25]
+"""
+import argparse
+import pstats
+import sys
+
+COLUMNS = {"calls": 1, "tottime": 2, "cumtime": 3}
+
+
+def function_name(func):
+    filename, line, name = func
+    return f"{filename}:{line}({name})"
+
+
+def load(path):
+    """Return {function: (primitive calls, total calls, tottime, cumtime)} of a .prof file."""
+    return {function_name(func): stat[:4] for func, stat in pstats.Stats(str(path)).stats.items()}
+
+
+def diff(before, after, sort="cumtime", top=25):
+    """Rows of (function, before, after, change) for the 'top' largest changes of the 'sort' column."""
+    column = COLUMNS[sort]
+    rows = []
+    for func in set(before) | set(after):
+        old = before.get(func, (0, 0, 0.0, 0.0))[column]
+        new = after.get(func, (0, 0, 0.0, 0.0))[column]
+        if old != new:
+            rows.append((func, old, new, new - old))
+    rows.sort(key=lambda row: abs(row[3]), reverse=True)
+    return rows[:top]
+
+
+def format_rows(rows, sort):
+    lines = [f"{'before':>12} {'after':>12} {'change':>12}  function   ({sort})"]
+    for func, old, new, change in rows:
+        lines.append(f"{old:12.4f} {new:12.4f} {change:+12.4f}  {func}")
+    return "\n".join(lines)
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(description="Show the functions whose time changed most between two profiles.")
+    parser.add_argument("before", help=".prof file of the reference cycle")
+    parser.add_argument("after", help=".prof file of the cycle to explain")
+    parser.add_argument("--sort", choices=list(COLUMNS), default="cumtime", help="column to compare")
+    parser.add_argument("--top", type=int, default=25, help="number of functions to show")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_arguments(sys.argv[1:])
+    print(format_rows(diff(load(args.before), load(args.after), args.sort, args.top), args.sort))
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""On-demand profiling of live tweet cycles and scrapes.
+Nothing is profiled until profiling is armed, either at startup with the environment variable
+
+    RIVERBOT_PROFILE_CYCLES=3 python Sunset_Village_TwitterBot.py
+
+or on a running process with a signal (not available on Windows):
+
+    kill -USR1 <pid>        (arms PROFILE_CYCLES_ON_SIGNAL cycles)
+
+Each armed cycle runs under cProfile and tracemalloc and writes two files to PROFILES/ (next to LOGS/):
+<program>_<UTC time>.prof for pstats/snakeviz/profile_diff.py and <program>_<UTC time>_allocations.txt.
+While unarmed a cycle costs one integer comparison.
+"""
+import cProfile
+import os
+import signal
+import time
+import tracemalloc
+from contextlib import contextmanager
+from functools import wraps
+from pathlib import Path
+
+from loguru import logger
+
+PROFILE_ENV_VAR = "RIVERBOT_PROFILE_CYCLES"
+PROFILE_SIGNAL = getattr(signal, "SIGUSR1", None)
+PROFILE_CYCLES_ON_SIGNAL = 1
+PROFILE_FOLDER = "PROFILES/"
+TOP_ALLOCATIONS = 25
+
+_armed = 0
+
+
+def arm(cycles):
+    """Profile the next 'cycles' cycles (in addition to any already armed)."""
+    global _armed
+    _armed += max(int(cycles), 0)
+    return _armed
+
+
+def disarm():
+    global _armed
+    _armed = 0
+
+
+def armed():
+    return _armed
+
+
+def _on_signal(_signum, _frame):
+    arm(PROFILE_CYCLES_ON_SIGNAL)
+
+
+def install():
+    """Arm from the environment and listen for the profiling signal. Call once from the main thread."""
+    try:
+        arm(os.environ.get(PROFILE_ENV_VAR, 0))
+    except ValueError:
+        logger.warning(f"{PROFILE_ENV_VAR} must be a number of cycles.")
+    if PROFILE_SIGNAL is not None:
+        signal.signal(PROFILE_SIGNAL, _on_signal)
+    return _armed
+
+
+def write_reports(program, profiler, snapshot, folder=PROFILE_FOLDER):
+    """Write the .prof file and the top allocations of one cycle. Returns the path of the .prof file."""
+    Path(folder).mkdir(parents=True, exist_ok=True)
+    stamp = time.strftime("%Y%m%d_%H%M%SUTC", time.gmtime())
+    # a few cycles can finish within the same second
+    stem = Path(folder, f"{program}_{stamp}")
+    count = 1
+    while stem.with_suffix(".prof").exists():
+        count += 1
+        stem = Path(folder, f"{program}_{stamp}_{count}")
+    profile_path = stem.with_suffix(".prof")
+    profiler.dump_stats(profile_path)
+    with open(f"{stem}_allocations.txt", "w") as report:
+        for stat in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]:
+            report.write(f"{stat}\n")
+    logger.info(f"Profile of {program} cycle written to {profile_path}")
+    return profile_path
+
+
+@contextmanager
+def profiled_cycle(program, folder=PROFILE_FOLDER):
+    """Profile the enclosed code if a cycle is armed, otherwise do nothing."""
+    global _armed
+    if _armed <= 0:
+        yield
+        return
+    _armed -= 1
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        if started:
+            tracemalloc.stop()
+        write_reports(program, profiler, snapshot, folder)
+
+
+def profiled(program, folder=PROFILE_FOLDER):
+    """Decorator form of profiled_cycle, each call is one cycle."""
+
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with profiled_cycle(program, folder):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
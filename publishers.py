@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+"""Post the same river status to every channel the residents follow, read from publishers.json:
+
+    twitter       the tweet queue (see tweet_queue.py), its sender thread deals with Twitter
+    mastodon      POST {url}/api/v1/statuses with the access token named by token_env
+    webhook       POST {"text": ..., "time": ...} as JSON to url
+    email_digest  statuses are collected in STATE/ and mailed together once every 'every' seconds
+    file_feed     the last 'keep' statuses as JSON lines in a local file
+
+The text is built once by the bot and handed to every channel at the same time. Each channel has
+its own worker thread, request timeout, number of attempts and time budget for its retries, so a
+slow or failing channel delays neither the others nor the bot's main loop (publish returns at once).
+The twitter and file_feed channels are local and run on the caller's thread with a single attempt,
+the tweet sender does the retrying for Twitter.
+Set "enabled": false to keep a channel in the file without posting to it.
+RIVERBOT_PUBLISHERS=/path/to/other.json selects another config file. Secrets (tokens, passwords)
+are never in the config, token_env/password_env name a variable of the environment or of .env.
+"""
+import abc
+import hashlib
+import json
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from loguru import logger
+
+import metrics
+import resilient_fetch as rf
+import storage_paths as sp
+
+CONFIG_ENV_VAR = "RIVERBOT_PUBLISHERS"
+DEFAULT_CONFIG = Path(__file__).with_name("publishers.json")
+SECRETS_FILE = ".env"
+TIMEOUT = 10  # seconds, one request of a channel
+ATTEMPTS = 3
+BUDGET = 5 * 60  # seconds, no retry of a status is started later than this after it was published
+MASTODON_STATUS_PATH = "/api/v1/statuses"
+DIGEST_EVERY = 24 * 60 * 60  # seconds between two email digests
+FEED_ENTRIES = 200
+
+PUBLISHES = metrics.counter("publishes_total", "Statuses published by channel and outcome (sent, retry, failed).")
+
+
+class PublishError(Exception):
+    """A channel could not deliver a status (the attempt may be retried)."""
+
+
+def config_path():
+    return Path(os.environ.get(CONFIG_ENV_VAR) or DEFAULT_CONFIG)
+
+
+def load(path=None):
+    with open(path or config_path(), "r") as config_file:
+        return json.load(config_file)
+
+
+def secret(name, env_file=SECRETS_FILE):
+    """A secret from the environment, or from the .env file the Twitter credentials live in."""
+    if name in os.environ:
+        return os.environ[name]
+    from dotenv import dotenv_values
+
+    value = dotenv_values(env_file).get(name)
+    if value is None:
+        raise KeyError(f"Secret {name} is neither in the environment nor in {env_file}")
+    return value
+
+
+class Channel(abc.ABC):
+    """One place statuses are published to. Subclasses implement send(text, time)."""
+
+    inline = False  # True: cheap and local, sent once on the caller's thread (a retry would sleep there)
+
+    def __init__(self, name, timeout=TIMEOUT, attempts=ATTEMPTS, budget=BUDGET, enabled=True):
+        self.name = name
+        self.timeout = timeout
+        self.attempts = 1 if self.inline else attempts
+        self.budget = budget
+        self.enabled = enabled
+
+    @abc.abstractmethod
+    def send(self, text, time):
+        """Deliver one status, raise to have it retried."""
+
+
+class TwitterChannel(Channel):
+    """Queues the status for the tweet sender, which has its own rate limits and retries."""
+
+    inline = True
+
+    def __init__(self, name, tweet_queue, **settings):
+        super().__init__(name, **settings)
+        self.queue = tweet_queue
+
+    def send(self, text, time):
+        self.queue.enqueue(text, time)
+
+
+def _post(url, timeout, **kwargs):
+    response = rf.shared_session().post(url, timeout=timeout, **kwargs)
+    if response.status_code >= 400:
+        raise PublishError(f"{url} answered HTTP {response.status_code}")
+    return response
+
+
+class MastodonChannel(Channel):
+    def __init__(self, name, url, token_env, **settings):
+        super().__init__(name, **settings)
+        self.url = url.rstrip("/") + MASTODON_STATUS_PATH
+        self.token_env = token_env
+
+    def send(self, text, time):
+        headers = {
+            "Authorization": f"Bearer {secret(self.token_env)}",
+            # a retried post is not published twice, hash() of a str changes with every process
+            "Idempotency-Key": hashlib.sha256(f"{time}\n{text}".encode()).hexdigest(),
+        }
+        _post(self.url, self.timeout, data={"status": text}, headers=headers)
+
+
+class WebhookChannel(Channel):
+    def __init__(self, name, url, **settings):
+        super().__init__(name, **settings)
+        self.url = url
+
+    def send(self, text, time):
+        _post(self.url, self.timeout, json={"text": text, "time": str(time)})
+
+
+class EmailDigestChannel(Channel):
+    """Collects statuses in a state file and mails them as one message once the digest is 'every' seconds old."""
+
+    def __init__(self, name, host, sender, to, port=25, every=DIGEST_EVERY, username=None, password_env=None,
+                 starttls=False, state_root=sp.STATE_ROOT, clock=time.time, **settings):
+        super().__init__(name, **settings)
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.to = [to] if isinstance(to, str) else list(to)
+        self.every = every
+        self.username = username
+        self.password_env = password_env
+        self.starttls = starttls
+        self.path = sp.state_file(f"digest_{name}.json", state_root)
+        self.clock = clock
+
+    def _read(self):
+        try:
+            with open(self.path, "r") as digest_file:
+                return json.load(digest_file)
+        except FileNotFoundError:
+            return {"started": self.clock(), "statuses": []}
+
+    def _write(self, digest):
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w") as digest_file:
+            json.dump(digest, digest_file)
+        os.replace(temporary, self.path)
+
+    def send(self, text, time):
+        digest = self._read()
+        if not digest["statuses"] or digest["statuses"][-1]["text"] != text:  # a retry appends nothing
+            digest["statuses"].append({"time": str(time), "text": text})
+            self._write(digest)
+        if self.clock() - digest["started"] < self.every:
+            return
+        self.mail(digest["statuses"])
+        self._write({"started": self.clock(), "statuses": []})
+
+    def mail(self, statuses):
+        import smtplib
+        from email.message import EmailMessage
+
+        message = EmailMessage()
+        message["Subject"] = f"River levels, {len(statuses)} updates"
+        message["From"] = self.sender
+        message["To"] = ", ".join(self.to)
+        message.set_content("\n\n".join(f"{status['time']}\n{status['text']}" for status in statuses))
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+            if self.starttls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, secret(self.password_env))
+            smtp.send_message(message)
+
+
+class FileFeedChannel(Channel):
+    """The last 'keep' statuses as JSON lines, newest last, rewritten with os.replace."""
+
+    inline = True
+
+    def __init__(self, name, path, keep=FEED_ENTRIES, **settings):
+        super().__init__(name, **settings)
+        self.path = Path(path)
+        self.keep = keep
+
+    def send(self, text, time):
+        try:
+            lines = self.path.read_text().splitlines()
+        except FileNotFoundError:
+            lines = []
+        lines.append(json.dumps({"time": str(time), "text": text}))
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = self.path.with_name(self.path.name + ".tmp")
+        temporary.write_text("\n".join(lines[-self.keep:]) + "\n")
+        os.replace(temporary, self.path)
+
+
+CHANNEL_TYPES = {
+    "twitter": TwitterChannel,
+    "mastodon": MastodonChannel,
+    "webhook": WebhookChannel,
+    "email_digest": EmailDigestChannel,
+    "file_feed": FileFeedChannel,
+}
+
+
+def channels_from_config(config=None, tweet_queue=None):
+    """The enabled channels of the config. The twitter channel needs the bot's tweet queue."""
+    config = config or load()
+    channels = []
+    for entry in config["channels"]:
+        settings = {key: value for key, value in entry.items() if key not in ("type", "enabled")}
+        if not entry.get("enabled", True):
+            continue
+        if entry["type"] not in CHANNEL_TYPES:
+            raise ValueError(f"Channel {entry.get('name', '?')!r} has unknown type {entry['type']!r}")
+        if entry["type"] == "twitter":
+            settings["tweet_queue"] = tweet_queue
+        channels.append(CHANNEL_TYPES[entry["type"]](**settings))
+    return channels
+
+
+class Publisher:
+    """Fans one status out to every channel. Every channel that is not inline has its own worker thread."""
+
+    def __init__(self, channels, clock=time.monotonic, sleeper=time.sleep, rng=random):
+        self.channels = list(channels)
+        self.clock = clock
+        self.sleeper = sleeper
+        self.rng = rng
+        self._workers = {
+            channel.name: ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"publish-{channel.name}")
+            for channel in self.channels
+            if not channel.inline
+        }
+
+    def deliver(self, channel, text, time, published=None):
+        """Send to one channel within its attempts and time budget. Returns True when it was delivered."""
+        published = self.clock() if published is None else published
+        for attempt in range(channel.attempts):
+            try:
+                channel.send(text, time)
+            except Exception as e:  # any failure of one channel is that channel's business
+                if attempt + 1 == channel.attempts:
+                    break
+                delay = rf.backoff_delay(attempt, rng=self.rng)
+                if self.clock() + delay - published > channel.budget:
+                    logger.error(f"{channel.name}: out of retry budget: {e}")
+                    break
+                PUBLISHES.inc(channel=channel.name, outcome="retry")
+                logger.warning(f"{channel.name}: {e}, retrying in {delay:.1f} seconds")
+                self.sleeper(delay)
+            else:
+                PUBLISHES.inc(channel=channel.name, outcome="sent")
+                return True
+        PUBLISHES.inc(channel=channel.name, outcome="failed")
+        logger.error(f"{channel.name}: status not published.")
+        return False
+
+    def publish(self, text, time):
+        """Hand the status to every channel and return at once. Returns {channel name: Future or bool}."""
+        published = self.clock()
+        results = {}
+        for channel in self.channels:
+            if channel.inline:
+                results[channel.name] = self.deliver(channel, text, time, published)
+            else:
+                results[channel.name] = self._workers[channel.name].submit(self.deliver, channel, text, time, published)
+        return results
+
+    def close(self, wait=True):
+        for worker in self._workers.values():
+            worker.shutdown(wait=wait)
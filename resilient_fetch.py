@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""Fetching NWS pages without letting one failing server stall a whole sweep.
+'runtime error.txt' shows water.weather.gov failing the TLS handshake for every guage in turn,
+each one waiting out its own retries before the next guage was tried. Here:
+
+- every request has a connect and read timeout,
+- failed requests are retried with exponential backoff and full jitter,
+- a circuit breaker per host opens after FAILURE_THRESHOLD consecutive failures and the remaining
+  requests to that host are skipped at once until RESET_AFTER seconds have passed (then one trial request),
+- a Sweep carries a deadline, no request or retry is started after it and timeouts are cut to fit,
+- every fetch of the process shares one keep-alive connection pool (shared_session), and a PageCache
+  can serve a url fetched moments ago (the same guage listed by two rivers, the bot and the scraper).
+
+Fetch functions return the page bytes or None, like cfsiv_utils.WebScraping.simple_get.
+"""
+import random
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+from loguru import logger
+
+CONNECT_TIMEOUT = 5  # seconds
+READ_TIMEOUT = 20
+MAX_ATTEMPTS = 3
+BACKOFF_BASE = 1.0  # seconds, doubled on each retry
+BACKOFF_CAP = 30.0
+FAILURE_THRESHOLD = 3  # consecutive failed attempts before a host is skipped
+RESET_AFTER = 5 * 60  # seconds before an open breaker lets a trial request through
+SWEEP_DEADLINE = 10 * 60  # seconds for a sweep of all guages
+FETCH_WORKERS = 8  # pages fetched at once by a sweep
+POOL_SIZE = 16  # keep-alive connections per host in the shared session
+PAGE_CACHE_TTL = 5 * 60  # seconds, NWS pages change about once an hour
+PAGE_CACHE_ENTRIES = 512
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def shared_session(pool_size=POOL_SIZE):
+    """The requests.Session whose connection pool every fetch of the process reuses."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+    return _session
+
+
+class PageCache:
+    """Pages by url for 'ttl' seconds, at most 'entries' of them (least recently used dropped first)."""
+
+    def __init__(self, ttl=PAGE_CACHE_TTL, entries=PAGE_CACHE_ENTRIES, clock=time.monotonic):
+        self.ttl = ttl
+        self.entries = entries
+        self.clock = clock
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        with self._lock:
+            cached = self._pages.get(url)
+            if cached is None:
+                return None
+            if self.clock() - cached[0] >= self.ttl:
+                del self._pages[url]
+                return None
+            self._pages.move_to_end(url)
+            return cached[1]
+
+    def put(self, url, page):
+        with self._lock:
+            self._pages[url] = (self.clock(), page)
+            self._pages.move_to_end(url)
+            while len(self._pages) > self.entries:
+                self._pages.popitem(last=False)
+
+
+PAGE_CACHE = PageCache()
+
+
+class CircuitBreaker:
+    """Tracks the health of one host. 'closed' passes requests, 'open' skips them, 'half-open' allows one trial.
+    Shared by the fetch threads of a sweep, every state change holds the breaker's lock.
+    """
+
+    def __init__(self, threshold=FAILURE_THRESHOLD, reset_after=RESET_AFTER, clock=time.monotonic):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.trial_at = None  # start of the trial request while half-open
+        self._lock = threading.Lock()
+
+    def _state(self):
+        if self.opened_at is None:
+            return "closed"
+        if self.clock() - self.opened_at >= self.reset_after:
+            return "half-open"
+        return "open"
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def allow(self):
+        """True when a request may go: always while closed, for the one trial request while half-open."""
+        with self._lock:
+            state = self._state()
+            if state != "half-open":
+                return state == "closed"
+            # a trial that never reported back (ex: its thread died) is replaced after reset_after
+            if self.trial_at is not None and self.clock() - self.trial_at < self.reset_after:
+                return False
+            self.trial_at = self.clock()
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._state() == "half-open" or self.failures >= self.threshold:
+                self.opened_at = self.clock()
+            self.trial_at = None
+
+
+BREAKERS = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker_for(url, clock=time.monotonic):
+    """The circuit breaker shared by every url of the same host."""
+    host = urlparse(url).netloc.lower()
+    with _breakers_lock:
+        if host not in BREAKERS:
+            BREAKERS[host] = CircuitBreaker(clock=clock)
+        return BREAKERS[host]
+
+
+class Sweep:
+    """A deadline shared by the requests of one sweep of guages."""
+
+    def __init__(self, seconds=SWEEP_DEADLINE, clock=time.monotonic):
+        self.clock = clock
+        self.deadline = clock() + seconds
+
+    def remaining(self):
+        return max(self.deadline - self.clock(), 0.0)
+
+    def expired(self):
+        return self.remaining() <= 0
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_CAP, rng=random):
+    """Full jitter: a random delay between zero and the exponential backoff of this attempt."""
+    return rng.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def _is_html(response):
+    return "html" in response.headers.get("Content-Type", "").lower()
+
+
+def fetch(url, sweep=None, attempts=MAX_ATTEMPTS, session=None, breaker=None, sleeper=time.sleep, rng=random, cache=None):
+    """GET url and return the html bytes, or None on failure, open breaker or expired sweep.
+    cache: a PageCache to answer from and to fill (PAGE_CACHE is the one shared by the process)
+    """
+    import requests
+
+    if cache is not None:
+        page = cache.get(url)
+        if page is not None:
+            return page
+    session = session or shared_session()
+    breaker = breaker or breaker_for(url)
+    for attempt in range(attempts):
+        if sweep is not None and sweep.expired():
+            logger.warning(f"Sweep deadline passed, not fetching {url}")
+            return None
+        if not breaker.allow():
+            logger.warning(f"Circuit open for {urlparse(url).netloc}, skipping {url}")
+            return None
+        read_timeout = READ_TIMEOUT if sweep is None else min(READ_TIMEOUT, max(sweep.remaining(), 0.1))
+        try:
+            response = session.get(url, timeout=(min(CONNECT_TIMEOUT, read_timeout), read_timeout))
+        except requests.RequestException as e:
+            logger.error(f"Attempt {attempt + 1} of {attempts} to get {url} failed: {e}")
+            breaker.record_failure()
+        else:
+            if response.status_code < 500:
+                breaker.record_success()  # the host answered, a 4xx will not improve with retries
+                if response.status_code == 200 and _is_html(response):
+                    if cache is not None:
+                        cache.put(url, response.content)
+                    return response.content
+                logger.error(f"Bad response from: {url} ({response.status_code})")
+                return None
+            logger.error(f"Attempt {attempt + 1} of {attempts} to get {url}: server error {response.status_code}")
+            breaker.record_failure()
+        if attempt + 1 < attempts:
+            delay = backoff_delay(attempt, rng=rng)
+            if sweep is not None:
+                delay = min(delay, sweep.remaining())
+            sleeper(delay)
+    return None
+
+
+def run_sweep(urls, handle, seconds=SWEEP_DEADLINE, clock=time.monotonic):
+    """Call handle(url, sweep) for each url until the deadline passes.
+    Returns the partial results {url: result} of the urls handled in time.
+    """
+    sweep = Sweep(seconds, clock)
+    results = {}
+    for url in urls:
+        if sweep.expired():
+            logger.warning(f"Sweep deadline passed, {len(urls) - len(results)} urls not handled.")
+            break
+        results[url] = handle(url, sweep)
+    return results
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""Rivers, guages and points of interest, read from rivers.json.
+Adding a river or a guage is an edit of the config file, no code changes:
+
+    river_points        NWS river.php point ids scraped by OHIO_RIVER_LEVEL_SCRAPING (one url each)
+    guages              hydrograph guages read by NWS_River_Data_scrape_NEW, with their mile marker,
+                        elevation and flood action levels
+    points_of_interest  river miles between two guages whose level the bot calculates
+
+Set "enabled": false to keep a river in the file without scraping it.
+RIVERBOT_RIVERS=/path/to/other.json selects another config file.
+"""
+import json
+import os
+from pathlib import Path
+
+from loguru import logger
+
+CONFIG_ENV_VAR = "RIVERBOT_RIVERS"
+DEFAULT_CONFIG = Path(__file__).with_name("rivers.json")
+ACTION_LABELS = ["First-action", "Minor-flood", "Moderate-flood", "Major-flood"]
+RIVER_KEYS = ["name", "wfo", "wfoid", "riverid", "river_points"]
+GUAGE_KEYS = ["name", "lid", "wfo", "friendly_name", "milemarker", "guage_elevation", "action_levels"]
+POINT_KEYS = ["name", "milemarker", "upstream", "downstream"]
+
+_loaded = {}  # config path: parsed config
+
+
+def config_path():
+    return Path(os.environ.get(CONFIG_ENV_VAR) or DEFAULT_CONFIG)
+
+
+def _require(entry, keys, what):
+    missing = [key for key in keys if key not in entry]
+    if missing:
+        raise ValueError(f"{what} {entry.get('name', '?')!r} is missing {', '.join(missing)}")
+
+
+def validate(config):
+    """Raise ValueError when a river, guage or point of interest lacks a required setting."""
+    names = set()
+    for river in config["rivers"]:
+        _require(river, RIVER_KEYS, "River")
+        for guage in river.get("guages", []):
+            _require(guage, GUAGE_KEYS, "Guage")
+            _require(guage["action_levels"], ACTION_LABELS, "Action levels of guage")
+            if guage["name"] in names:
+                raise ValueError(f"Guage name {guage['name']!r} is used twice")
+            names.add(guage["name"])
+        river_guages = {guage["name"] for guage in river.get("guages", [])}
+        for point in river.get("points_of_interest", []):
+            _require(point, POINT_KEYS, "Point of interest")
+            unknown = {point["upstream"], point["downstream"]} - river_guages
+            if unknown:
+                raise ValueError(f"Point of interest {point['name']!r} uses unknown guages {sorted(unknown)}")
+    return config
+
+
+def load(path=None):
+    """The parsed and validated config, read once per file."""
+    path = Path(path or config_path())
+    if path not in _loaded:
+        with open(path, "r") as config_file:
+            _loaded[path] = validate(json.load(config_file))
+        logger.debug(f"Loaded {len(_loaded[path]['rivers'])} rivers from {path}")
+    return _loaded[path]
+
+
+def rivers(config=None, enabled_only=True):
+    config = config or load()
+    return [river for river in config["rivers"] if river.get("enabled", True) or not enabled_only]
+
+
+def river_point_urls(config=None):
+    """The river.php url of every river point of every enabled river."""
+    config = config or load()
+    return [
+        config["river_point_url"].format(**{"allpoints": point, **river, "point": point})
+        for river in rivers(config)
+        for point in river["river_points"]
+    ]
+
+
+def monitoring_points(config=None):
+    """{guage name: details} of the guages of every enabled river, in the RIVER_MONITORING_POINTS format."""
+    config = config or load()
+    points = {}
+    for river in rivers(config):
+        for guage in river.get("guages", []):
+            details = {
+                "Friendly_Name": guage["friendly_name"],
+                "Dam_URL": config["hydrograph_url"].format(**guage),
+                "milemarker": guage["milemarker"],
+                "guage_elevation": guage["guage_elevation"],
+                "ordinary_high_water": guage.get("ordinary_high_water"),
+                "river": river["name"],
+            }
+            details.update((label, guage["action_levels"][label]) for label in ACTION_LABELS)
+            points[guage["name"]] = details
+    return points
+
+
+def point_of_interest(name=None, config=None):
+    """A point of interest by name, the first one of the enabled rivers by default."""
+    for river in rivers(config):
+        for point in river.get("points_of_interest", []):
+            if name is None or point["name"] == name:
+                return point
+    raise KeyError(f"No point of interest {name!r} in {config_path()}")
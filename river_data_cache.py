@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""One shared, time limited copy of the processRiverData results for every part of the bot.
+NWS updates the hydrographs about once an hour so there is nothing new to gain by scraping
+both dams again when another code path scraped them minutes ago.
+
+- fresh data (younger than the TTL) is returned without scraping,
+- callers arriving while a scrape is in flight wait for that scrape instead of starting their own,
+- stale data (older than the TTL but younger than TTL + STALE_FOR) is returned at once while a
+  background scrape refreshes it (on a daemon thread, or whatever 'refresher' runs it on),
+- a failed scrape never replaces good data, but data older than TTL + STALE_FOR is never
+  returned: get() then returns [] as it does before the first scrape.
+"""
+import threading
+import time
+from functools import partial
+
+from loguru import logger
+
+import metrics
+
+NWS_UPDATE_INTERVAL = 60 * 60  # seconds between NWS hydrograph updates
+STALE_FOR = 5 * 60 * 60  # how long past the TTL old data may still be served during a refresh
+
+CACHE_REQUESTS = metrics.counter("cache_requests_total", "River data cache requests by result (hit, stale, miss).")
+
+
+def in_background(task):
+    """The default refresher: run task() on a daemon thread."""
+    threading.Thread(target=task, name="river-data-refresh", daemon=True).start()
+
+
+def _failed(data):
+    return data is None or data == [] or data == {}
+
+
+class RiverDataCache:
+    """Caches the result of 'loader' (processRiverData by default) for 'ttl' seconds.
+    refresher(task) runs the refresh of stale data, schedule_simulator.py passes one that calls task() at once.
+    """
+
+    def __init__(self, loader=None, ttl=NWS_UPDATE_INTERVAL, stale_for=STALE_FOR, clock=time.monotonic,
+                 refresher=in_background):
+        self.loader = loader
+        self.ttl = ttl
+        self.stale_for = stale_for
+        self.clock = clock
+        self.refresher = refresher
+        self._lock = threading.Lock()
+        self._data = None
+        self._loaded_at = None
+        self._inflight = None  # threading.Event of the scrape in progress
+
+    def age(self):
+        """Seconds since the cached data was scraped, None if nothing has been scraped yet."""
+        if self._loaded_at is None:
+            return None
+        return self.clock() - self._loaded_at
+
+    def _load(self):
+        if self.loader is None:
+            from NWS_River_Data_scrape_NEW import processRiverData
+
+            self.loader = processRiverData
+        return self.loader()
+
+    def _refresh(self, flight):
+        try:
+            data = self._load()
+        except Exception as e:  # the cache must release its waiters whatever the loader does
+            logger.error(f"River data refresh failed: {e}")
+            data = None
+        with self._lock:
+            if _failed(data):
+                logger.warning("River data refresh returned nothing, keeping the cached data.")
+            else:
+                self._data = data
+                self._loaded_at = self.clock()
+            self._inflight = None
+        flight.set()
+
+    def get(self):
+        """Return the river data, scraping only if the cached copy is too old. [] if no data is available."""
+        with self._lock:
+            age = self.age()
+            if self._data is not None and age < self.ttl:
+                CACHE_REQUESTS.inc(result="hit")
+                return self._data
+            flight = self._inflight
+            owner = flight is None
+            if owner:
+                flight = self._inflight = threading.Event()
+            stale = self._data if self._data is not None and age < self.ttl + self.stale_for else None
+            CACHE_REQUESTS.inc(result="miss" if stale is None else "stale")
+        if stale is not None:
+            if owner:  # outside the lock, the refresher may run the refresh before returning
+                self.refresher(partial(self._refresh, flight))
+            return stale
+        if owner:
+            self._refresh(flight)
+        else:
+            flight.wait()
+        with self._lock:
+            if self._data is None or self.age() >= self.ttl + self.stale_for:
+                return []  # the refresh failed and what is cached is too old to pass for current data
+            return self._data
+
+    def wait_for_refresh(self, timeout=None):
+        """Wait for the scrape in flight, if any. Returns False if it is still running after 'timeout' seconds."""
+        with self._lock:
+            flight = self._inflight
+        return True if flight is None else flight.wait(timeout)
+
+    def invalidate(self):
+        """Forget the cached data so the next get() scrapes."""
+        with self._lock:
+            self._data = None
+            self._loaded_at = None
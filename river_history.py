@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""Load the scrape history written by OHIO_RIVER_LEVEL_SCRAPING into pandas frames.
+Every file below OUTPUT_ROOT is one scrape of one guage (guage,type,datetime,level,flow)
+and the filename is the UTC time of the scrape.
+Reading years of scrapes is slow so the observed levels are kept in a local cache
+and only scrape files that have not been seen before are read on each call.
+"""
+import datetime as dt
+import pickle
+from pathlib import Path
+
+import pandas as pd
+from loguru import logger
+
+from storage_paths import (
+    CSV_DATETIME_FORMAT,
+    HISTORY_ROOT,
+    OBSERVED,
+    SCRAPE_FILENAME_FORMAT,
+    STATE_ROOT,
+    state_file,
+)
+
+OBSERVATION_CACHE = "observation_history.pkl"
+HISTORY_COLUMNS = ["guage", "type", "datetime", "level", "flow", "scrape_time"]
+
+
+def scrape_time_from_filename(path):
+    """Recover the UTC scrape time from a CSV_DATA filename.
+    Files that do not follow the naming pattern fall back to their modification time.
+    """
+    path = Path(path)
+    try:
+        stamp = dt.datetime.strptime(path.name[:18], SCRAPE_FILENAME_FORMAT)
+    except ValueError:
+        return pd.Timestamp(path.stat().st_mtime, unit="s", tz="UTC")
+    return pd.Timestamp(stamp, tz="UTC")
+
+
+def parse_levels(values):
+    """Vectorized conversion of NWS level strings like '23.4ft' to floats (NaN if unreadable)."""
+    text = pd.Series(values, dtype="object").astype(str)
+    return pd.to_numeric(text.str.extract(r"(-?\d+(?:\.\d+)?)", expand=False), errors="coerce")
+
+
+@logger.catch
+def list_scrape_files(root=HISTORY_ROOT):
+    """Return every scrape file below root sorted oldest to newest by filename."""
+    root = Path(root)
+    if not root.is_dir():
+        logger.warning(f"No scrape history found at: {root}")
+        return []
+    # My files dont all have .csv extensions so every file is a candidate.
+    return sorted((fl for fl in root.rglob("*") if fl.is_file()), key=lambda fl: fl.name)
+
+
+def read_scrape_file(path):
+    """Read one scrape file into a normalized frame with typed datetime and level columns."""
+    df = pd.read_csv(path, dtype=str)
+    df = df.reindex(columns=HISTORY_COLUMNS[:-1])
+    df["datetime"] = pd.to_datetime(df["datetime"], format=CSV_DATETIME_FORMAT, errors="coerce", utc=True)
+    df["level"] = parse_levels(df["level"])
+    df["scrape_time"] = scrape_time_from_filename(path)
+    return df.dropna(subset=["datetime"])
+
+
+@logger.catch
+def read_scrapes(paths):
+    """Read many scrape files into a single frame. Unreadable files are logged and skipped."""
+    frames = []
+    for fl in paths:
+        try:
+            frames.append(read_scrape_file(fl))
+        except (ValueError, OSError, pd.errors.ParserError) as e:
+            logger.warning(f"Skipping unreadable scrape file {fl}: {e}")
+    if not frames:
+        return pd.DataFrame(columns=HISTORY_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+
+def _empty_observation_cache():
+    return {
+        "files": set(),
+        "guage_order": [],
+        "observations": pd.DataFrame(
+            {"guage": pd.Series(dtype=str), "datetime": pd.Series(dtype="datetime64[ns, UTC]"), "level": pd.Series(dtype=float)}
+        ),
+    }
+
+
+@logger.catch
+def load_observations(root=HISTORY_ROOT, cache_name=OBSERVATION_CACHE, state_root=STATE_ROOT):
+    """Return (observations, guage_order) for every scrape below root.
+
+    observations is a frame of guage, datetime, level with one row per guage and
+    observation time (the most recent scrape wins when NWS revises a reading).
+    guage_order lists the guages in the order they were first scraped, which follows
+    the upstream to downstream order of RIVER_GUAGE_IDS.
+    Only scrape files not already in the cache are read.
+    """
+    cache_path = state_file(cache_name, state_root)
+    cache = _empty_observation_cache()
+    if cache_path.exists():
+        with open(cache_path, "rb") as cache_file:
+            cache = pickle.load(cache_file)
+    new_files = [fl for fl in list_scrape_files(root) if str(fl) not in cache["files"]]
+    logger.info(f"{len(new_files)} new scrape files to add to observation history.")
+    if new_files:
+        scrapes = read_scrapes(new_files)
+        for guage in scrapes["guage"].drop_duplicates():
+            if guage not in cache["guage_order"]:
+                cache["guage_order"].append(guage)
+        observed = scrapes.loc[scrapes["type"] == OBSERVED, ["guage", "datetime", "level"]]
+        combined = pd.concat([cache["observations"], observed], ignore_index=True).astype({"level": float})
+        combined = combined.dropna(subset=["level"])
+        combined = combined.drop_duplicates(subset=["guage", "datetime"], keep="last")
+        cache["observations"] = combined.sort_values(["guage", "datetime"], ignore_index=True)
+        cache["files"].update(str(fl) for fl in new_files)
+        with open(cache_path, "wb") as cache_file:
+            pickle.dump(cache, cache_file)
+    return (cache["observations"], list(cache["guage_order"]))
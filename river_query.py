@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Query the scrape history from the command line.
+Queries run against the binary guage archive (see guage_archive.py), each guage is its own file
+and every time range is found by binary search, so a query never scans the whole history.
+Aggregates come from the coarsest rollup tier that fits the query (see rollups.py).
+Build or refresh the archive from CSV_DATA/ with: python guage_archive.py
+
+usage: python river_query.py QUERY [--guage ID ...] [--type Observed|Forecast] [--start TIME] [--end TIME]
+                             [--every hour|day|month|MINUTES] [--format csv|json] [--archive ARCHIVE/]
+
+    rows               every reading in the range
+    daily-max          highest level per guage, type and UTC day
+    rollup             count, min, max, mean and last level per guage, type and --every bucket
+    latest             latest reading per guage (before --end if given)
+    highest-forecast   highest forecast of each scrape
+
+TIME is an ISO date or datetime in UTC, ex: 2022-03-01 or 2022-03-01T12:00. The range includes start and excludes end.
+"""
+import argparse
+import calendar
+import csv
+import json
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+import guage_archive as ga
+import rollups
+import storage_paths as sp
+
+QUERIES = ["rows", "daily-max", "rollup", "latest", "highest-forecast"]
+FORMATS = ["csv", "json"]
+
+
+def parse_time(text):
+    """Epoch minute of an ISO date or datetime taken as UTC."""
+    if text is None:
+        return None
+    return calendar.timegm(datetime.fromisoformat(text).timetuple()) // 60
+
+
+def format_minute(minute):
+    """Epoch minute in the CSV history datetime format."""
+    return time.strftime(sp.CSV_DATETIME_FORMAT, time.gmtime(int(minute) * 60))
+
+
+def _level(value):
+    value = float(value)
+    return None if np.isnan(value) else round(value, 2)
+
+
+def rows(archive, guages, kind, start, end, every=None):
+    for guage in guages:
+        for record in archive.read_range(guage, start, end, kind):
+            yield {
+                "guage": guage,
+                "type": ga.TYPE_NAMES[int(record["type"])],
+                "datetime": format_minute(record["minute"]),
+                "level": _level(record["level"]),
+                "flow": _level(record["flow"]),
+            }
+
+
+def daily_max(archive, guages, kind, start, end, every=None):
+    store = rollups.RollupStore(archive)
+    for guage in guages:
+        for rollup in store.series(guage, start, end, kind, "day"):
+            yield {
+                "guage": guage,
+                "type": ga.TYPE_NAMES[int(rollup["type"])],
+                "date": time.strftime("%Y-%m-%d", time.gmtime(int(rollup["bucket"]) * 60)),
+                "max_level": _level(rollup["max"]),
+            }
+
+
+def rollup(archive, guages, kind, start, end, every="day"):
+    store = rollups.RollupStore(archive)
+    for guage in guages:
+        series = store.series(guage, start, end, kind, every)
+        for record, average in zip(series, rollups.mean(series)):
+            yield {
+                "guage": guage,
+                "type": ga.TYPE_NAMES[int(record["type"])],
+                "bucket": format_minute(record["bucket"]),
+                "count": int(record["count"]),
+                "min_level": _level(record["min"]),
+                "max_level": _level(record["max"]),
+                "mean_level": _level(average),
+                "last_level": _level(record["last"]),
+            }
+
+
+def latest(archive, guages, kind, start, end, every=None):
+    for guage in guages:
+        record = archive.latest(guage, kind or sp.OBSERVED, None if end is None else end - 1)
+        if record is None or (start is not None and record["minute"] < start):
+            continue
+        yield {
+            "guage": guage,
+            "type": ga.TYPE_NAMES[int(record["type"])],
+            "datetime": format_minute(record["minute"]),
+            "level": _level(record["level"]),
+            "flow": _level(record["flow"]),
+        }
+
+
+def highest_forecast(archive, guages, kind, start, end, every=None):
+    for guage in guages:
+        for scrape in archive.scrapes(guage, start, end):
+            if np.isnan(scrape["forecast_level"]):
+                continue
+            yield {
+                "guage": guage,
+                "scrape_time": format_minute(scrape["scrape_minute"]),
+                "forecast_datetime": format_minute(scrape["forecast_minute"]),
+                "max_forecast_level": _level(scrape["forecast_level"]),
+            }
+
+
+QUERY_FUNCTIONS = {
+    "rows": rows,
+    "daily-max": daily_max,
+    "rollup": rollup,
+    "latest": latest,
+    "highest-forecast": highest_forecast,
+}
+
+
+def parse_every(text):
+    """hour, day, month or a number of minutes."""
+    return text if text in rollups.EVERY_NAMES else int(text)
+
+
+def run_query(query, guages=None, kind=None, start=None, end=None, archive_root=sp.ARCHIVE_ROOT, every="day"):
+    """Return the result rows (dicts) of a query. start and end are epoch minutes or None."""
+    archive = ga.GuageArchive(archive_root)
+    selected = [guage.lower() for guage in guages] if guages else archive.guages()
+    return list(QUERY_FUNCTIONS[query](archive, selected, kind, start, end, every))
+
+
+def write_output(results, output_format, stream=sys.stdout):
+    if output_format == "json":
+        json.dump(results, stream, indent=1)
+        stream.write("\n")
+        return
+    if not results:
+        return
+    writer = csv.DictWriter(stream, fieldnames=list(results[0]), lineterminator="\n")
+    writer.writeheader()
+    writer.writerows(results)
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(description="Query the guage history archive.")
+    parser.add_argument("query", choices=QUERIES)
+    parser.add_argument("--guage", action="append", help="guage id, ex: mklk2 (repeat for several, default all)")
+    parser.add_argument("--type", choices=list(ga.TYPE_CODES), default=None, help="observed or forecast readings only")
+    parser.add_argument("--start", default=None, help="UTC start of the range (inclusive)")
+    parser.add_argument("--end", default=None, help="UTC end of the range (exclusive)")
+    parser.add_argument("--every", type=parse_every, default="day", help="rollup bucket: hour, day, month or minutes")
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("--archive", default=sp.ARCHIVE_ROOT, help="root of the guage archive")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_arguments(sys.argv[1:] if argv is None else argv)
+    results = run_query(args.query, args.guage, args.type, parse_time(args.start), parse_time(args.end), args.archive, args.every)
+    write_output(results, args.format)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Hourly, daily and monthly rollups of the guage archive (see guage_archive.py).
+Each tier is one more fixed-width file next to the raw records, ARCHIVE/<guage>.hourly,
+.daily and .monthly, sorted by (bucket, type). A rollup record holds:
+
+    bucket       int64    UTC minute the hour, day or month starts
+    type         uint8    0 observed, 1 forecast
+    count        uint32   readings with a level
+    min, max     float32  ft
+    sum          float64  ft, the mean is sum / count
+    last         float32  ft, level of the latest reading in the bucket
+    last_minute  int64    minute of that reading
+
+After a scrape is appended only the buckets its readings fall in are recomputed: hours from the
+raw records, days from the hours and months from the days. Those buckets are nearly always at the
+end of the file and are rewritten in place. series() answers a query from the coarsest tier whose
+buckets fit it, so a year of daily values reads 365 daily records per type instead of every reading.
+
+usage: python rollups.py [--archive ARCHIVE/]     (rebuild every tier from the raw archive)
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+from loguru import logger
+
+import guage_archive as ga
+import storage_paths as sp
+
+ROLLUP = np.dtype(
+    [
+        ("bucket", "<i8"),
+        ("type", "u1"),
+        ("count", "<u4"),
+        ("min", "<f4"),
+        ("max", "<f4"),
+        ("sum", "<f8"),
+        ("last", "<f4"),
+        ("last_minute", "<i8"),
+    ]
+)
+TIERS = ["hourly", "daily", "monthly"]  # finest first, each is built from the one before
+TIER_MINUTES = {"hourly": 60, "daily": 24 * 60}  # months have no fixed width
+EVERY_NAMES = {"hour": 60, "day": 24 * 60, "month": "month"}
+
+
+def bucket_start(minutes, tier):
+    """Start minute of the tier bucket each minute falls in."""
+    minutes = np.asarray(minutes, dtype=np.int64)
+    if tier == "monthly":
+        return ga.to_datetime64(minutes).astype("datetime64[M]").astype("datetime64[m]").astype(np.int64)
+    return minutes // TIER_MINUTES[tier] * TIER_MINUTES[tier]
+
+
+def bucket_end(minutes, tier):
+    """First minute after the tier bucket each minute falls in."""
+    minutes = np.asarray(minutes, dtype=np.int64)
+    if tier == "monthly":
+        months = ga.to_datetime64(minutes).astype("datetime64[M]") + 1
+        return months.astype("datetime64[m]").astype(np.int64)
+    return bucket_start(minutes, tier) + TIER_MINUTES[tier]
+
+
+def from_raw(records):
+    """Archive records as one-reading rollups (readings without a level are left out)."""
+    records = records[~np.isnan(records["level"])]
+    rollups = np.zeros(len(records), dtype=ROLLUP)
+    rollups["bucket"] = records["minute"]
+    rollups["type"] = records["type"]
+    rollups["count"] = 1
+    for field in ("min", "max", "sum", "last"):
+        rollups[field] = records["level"]
+    rollups["last_minute"] = records["minute"]
+    return rollups
+
+
+def aggregate(rollups, buckets):
+    """Combine rollups into coarser ones, buckets gives the new bucket of each input record."""
+    if len(rollups) == 0:
+        return np.empty(0, dtype=ROLLUP)
+    buckets = np.asarray(buckets, dtype=np.int64)
+    keys = buckets * 4 + rollups["type"]
+    order = np.lexsort((rollups["last_minute"], keys))
+    rollups, keys, buckets = rollups[order], keys[order], buckets[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    ends = np.r_[starts[1:], len(keys)] - 1
+    combined = np.zeros(len(starts), dtype=ROLLUP)
+    combined["bucket"] = buckets[starts]
+    combined["type"] = rollups["type"][starts]
+    combined["count"] = np.add.reduceat(rollups["count"].astype(np.int64), starts)
+    combined["min"] = np.minimum.reduceat(rollups["min"], starts)
+    combined["max"] = np.maximum.reduceat(rollups["max"], starts)
+    combined["sum"] = np.add.reduceat(rollups["sum"], starts)
+    combined["last"] = rollups["last"][ends]
+    combined["last_minute"] = rollups["last_minute"][ends]
+    return combined
+
+
+def mean(rollups):
+    return rollups["sum"] / np.maximum(rollups["count"], 1)
+
+
+class RollupStore:
+    """The rollup tiers of a GuageArchive."""
+
+    def __init__(self, archive=None):
+        self.archive = archive if archive is not None else ga.GuageArchive()
+
+    def path(self, guage, tier):
+        return self.archive.root / f"{guage.lower()}.{tier}"
+
+    def read(self, guage, tier):
+        """Memory-map one tier of a guage (read only, empty array if there is none)."""
+        path = self.path(guage, tier)
+        count = self.archive._count(path, ROLLUP)
+        if count == 0:
+            return np.empty(0, dtype=ROLLUP)
+        return np.memmap(path, dtype=ROLLUP, mode="r", shape=(count,))
+
+    def range(self, guage, tier, start=None, end=None, kind=None):
+        """Rollups of the buckets starting at start <= bucket < end, found by binary search."""
+        rollups = self.read(guage, tier)
+        buckets = rollups["bucket"]
+        low = 0 if start is None else int(np.searchsorted(buckets, start, side="left"))
+        high = len(rollups) if end is None else int(np.searchsorted(buckets, end, side="left"))
+        selected = rollups[low:high]
+        if kind is not None:
+            selected = selected[selected["type"] == ga.TYPE_CODES[kind]]
+        return selected
+
+    def _replace(self, guage, tier, start, end, rollups):
+        """Replace the buckets start <= bucket < end of a tier with rollups."""
+        path = self.path(guage, tier)
+        existing = self.read(guage, tier)
+        low = int(np.searchsorted(existing["bucket"], start, side="left"))
+        high = int(np.searchsorted(existing["bucket"], end, side="left"))
+        if high == len(existing) and len(rollups) >= high - low:
+            # the usual case, a scrape only touches the newest buckets: overwrite the tail in place,
+            # the file never shrinks so readers that have it mapped stay valid
+            del existing
+            with open(path, "r+b" if path.exists() else "wb") as tier_file:
+                tier_file.seek(low * ROLLUP.itemsize)
+                tier_file.write(rollups.tobytes())
+            return
+        merged = np.concatenate([np.array(existing[:low]), rollups, np.array(existing[high:])])
+        del existing
+        temporary = path.with_suffix(".tmp")
+        merged.tofile(temporary)
+        os.replace(temporary, path)
+
+    def update(self, guage, records):
+        """Recompute every bucket the archive records (already appended) fall in, tier by tier."""
+        if len(records) == 0:
+            return 0
+        start, end = int(records["minute"].min()), int(records["minute"].max()) + 1
+        lower = None
+        for tier in TIERS:
+            start, end = int(bucket_start(start, tier)), int(bucket_end(end - 1, tier))
+            if lower is None:
+                source = from_raw(self.archive.read_range(guage, start, end))
+            else:
+                source = np.array(self.range(guage, lower, start, end))
+            self._replace(guage, tier, start, end, aggregate(source, bucket_start(source["bucket"], tier)))
+            lower = tier
+        return len(records)
+
+    @logger.catch
+    def update_readings(self, readings):
+        """update() for sort_and_label_data output that was just appended to the archive."""
+        for guage, records in ga.from_readings(readings).items():
+            self.update(guage, records)
+        return True
+
+    def rebuild(self, guage):
+        """Recompute every tier of a guage from the raw archive."""
+        for tier in TIERS:
+            self.path(guage, tier).unlink(missing_ok=True)
+        return self.update(guage, self.archive.read_range(guage))
+
+    def choose_tier(self, start=None, end=None, every="day"):
+        """The coarsest tier whose buckets fit a query (both ends on bucket boundaries), 'raw' if none does."""
+        every = EVERY_NAMES.get(every, every)
+        for tier in reversed(TIERS):
+            width = TIER_MINUTES.get(tier)
+            if width is None:  # months, only for monthly queries that start and end on a month
+                if every == "month" and all(edge is None or int(bucket_start(edge, tier)) == edge for edge in (start, end)):
+                    return tier
+                continue
+            if every != "month" and every % width:
+                continue
+            if all(edge is None or edge % width == 0 for edge in (start, end)):
+                return tier
+        return "raw"
+
+    def series(self, guage, start=None, end=None, kind=None, every="day"):
+        """Rollups of a guage with buckets of 'every' minutes ("hour", "day", "month" or a number of
+        minutes, aligned to the epoch) over start <= minute < end, read from the coarsest tier that fits.
+        """
+        every = EVERY_NAMES.get(every, every)
+        tier = self.choose_tier(start, end, every)
+        if tier == "raw":
+            source = from_raw(self.archive.read_range(guage, start, end, kind))
+        else:
+            source = np.array(self.range(guage, tier, start, end, kind))
+        if every == "month":
+            return source if tier == "monthly" else aggregate(source, bucket_start(source["bucket"], "monthly"))
+        return aggregate(source, source["bucket"] // every * every)
+
+
+@logger.catch
+def rebuild_all(archive_root=sp.ARCHIVE_ROOT):
+    store = RollupStore(ga.GuageArchive(archive_root))
+    guages = store.archive.guages()
+    for guage in guages:
+        store.rebuild(guage)
+    logger.info(f"Rebuilt the rollups of {len(guages)} guages.")
+    return len(guages)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the hourly, daily and monthly rollups of the guage archive.")
+    parser.add_argument("--archive", default=sp.ARCHIVE_ROOT, help="root of the binary archive")
+    args = parser.parse_args()
+    logger.remove()
+    logger.add(sys.stderr, format="{time} {level} {message}", level="INFO")
+    rebuild_all(args.archive)
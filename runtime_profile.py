@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""Runtime profiles select how much memory the bot and scraper are allowed to use.
+The 'default' profile is the original behaviour. The 'pi' profile is for the Raspberry Pi with
+a SenseHat: pandas stays off the hot path, NWS map areas are parsed as a stream instead of
+building a soup, only the observations the tweet needs are kept and every buffer that would
+otherwise grow with uptime has a fixed size.
+
+Select the profile with the environment variable, ex:  RIVERBOT_RUNTIME=pi python Sunset_Village_TwitterBot.py
+
+Memory ceiling of the 'pi' profile (enforced by test_pi_profile.py replaying a week of recorded scrapes):
+    PI_MEMORY_CEILING_MB   resident set size of the whole bot process
+    PI_TRACED_CEILING_MB   peak python allocations during any one tweet cycle
+"""
+import os
+from collections import OrderedDict
+
+RUNTIME_ENV_VAR = "RIVERBOT_RUNTIME"
+DEFAULT_PROFILE = "default"
+
+PI_MEMORY_CEILING_MB = 50
+PI_TRACED_CEILING_MB = 2
+
+PROFILES = {
+    "default": {
+        "streaming_parse": False,
+        "max_observations": None,  # entries kept per processRiverData call
+        "tweet_history": None,  # 'Tweet@' entries kept in PupDB
+        "log_file_level": "DEBUG",
+        "log_per_run_files": True,
+        "log_rotation": None,
+        "log_retention": "10 days",
+        "metrics_rotation_bytes": 10_000_000,  # LOGS/<program>_metrics.jsonl, see metrics.dump_json
+        "metrics_retention": 5,  # rotated files
+    },
+    "pi": {
+        "streaming_parse": True,
+        "max_observations": 64,
+        "tweet_history": 200,
+        "log_file_level": "INFO",
+        "log_per_run_files": False,
+        "log_rotation": "1 MB",
+        "log_retention": 3,  # rotated files
+        "metrics_rotation_bytes": 1_000_000,
+        "metrics_retention": 3,
+    },
+}
+
+
+def active_profile():
+    """Name of the profile selected by the environment (unknown names fall back to the default)."""
+    name = os.environ.get(RUNTIME_ENV_VAR, DEFAULT_PROFILE).strip().lower()
+    if name not in PROFILES:
+        return DEFAULT_PROFILE
+    return name
+
+
+def setting(name, profile=None):
+    """Return one setting of the given (or active) profile."""
+    return PROFILES[profile or active_profile()][name]
+
+
+def is_pi():
+    return active_profile() == "pi"
+
+
+class BoundedDict(OrderedDict):
+    """A dict that forgets its oldest entries once it holds more than 'maxlen' (None = unbounded)."""
+
+    def __init__(self, maxlen=None, *args, **kwargs):
+        self.maxlen = maxlen
+        super().__init__(*args, **kwargs)
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        if self.maxlen is not None:
+            while len(self) > self.maxlen:
+                self.popitem(last=False)
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Replay the bot's tweet schedule against recorded river levels on a simulated clock.
+run_schedule (the loop of Main) runs with a clock that only moves when the loop sleeps, so
+UpdatePrediction, QuantifyFlooding and TWEET_FREQUENCY decide exactly as they would on the Pi,
+but a week of operation takes seconds. At every moment the bot sees the most recent recorded
+scrape (test_fixtures/hydrograph_week by default, see memory_harness.py), refreshed once per
+NWS update like RiverDataCache does live.
+
+The timeline lists every cycle (when, level, trend, seconds to the next one) and every tweet that
+would have been sent with its text. Try a scheduling change with --frequency and --concern-level.
+Nothing is posted anywhere: tweets go to a recording stand-in, the PupDB and the tweet queue are
+temporary files.
+
+usage: python schedule_simulator.py [--pages test_fixtures/hydrograph_week] [--frequency 18000,9000,...]
+                                    [--concern-level 30] [--json]
+"""
+import argparse
+import json
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from loguru import logger
+
+from memory_harness import RECORDED_WEEK, recorded_scrapes
+
+STAMP_FORMAT = "%Y%m%d_%H%M"  # scrape time in the recorded page names
+RUN_ON = timedelta(hours=6)  # simulated time after the last recorded scrape
+
+
+class SimulatedClock:
+    """A datetime clock that moves only when something sleeps on it."""
+
+    def __init__(self, start):
+        self.now = start
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += timedelta(seconds=seconds)
+
+    def timestamp(self):
+        return self.now.timestamp()
+
+
+class RecordedHistory:
+    """processRiverData results of recorded scrapes, each parsed once, served by scrape time."""
+
+    def __init__(self, pages=RECORDED_WEEK):
+        self.scrapes = [(datetime.strptime(stamp, STAMP_FORMAT), fetch) for stamp, fetch in recorded_scrapes(pages)]
+        self._parsed = {}
+
+    @property
+    def start(self):
+        return self.scrapes[0][0]
+
+    @property
+    def end(self):
+        return self.scrapes[-1][0]
+
+    def at(self, moment):
+        """The river data of the latest scrape at or before 'moment' ([] before the first one)."""
+        from NWS_River_Data_scrape_NEW import processRiverData
+
+        latest = None
+        for scraped, fetch in self.scrapes:
+            if scraped > moment:
+                break
+            latest = (scraped, fetch)
+        if latest is None:
+            return []
+        if latest[0] not in self._parsed:
+            self._parsed[latest[0]] = processRiverData(latest[1])
+        return self._parsed[latest[0]]
+
+
+class RecordingTwitter:
+    """Takes status updates like Twython and keeps them with the simulated time they were posted."""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.tweets = []
+
+    def update_status(self, status):
+        self.tweets.append((self.clock(), status))
+        return {"text": status}
+
+
+def run_now(task):
+    """RiverDataCache refresher running the refresh in the caller's thread."""
+    task()
+
+
+def simulate(pages=RECORDED_WEEK, until=None, frequency=None, concern_level=None, folder=None):
+    """Run the schedule over the recorded history. Returns the timeline, a list of event dicts."""
+    import Sunset_Village_TwitterBot as bot
+    import publishers
+    import tweet_queue as tq
+
+    history = RecordedHistory(pages)
+    clock = SimulatedClock(history.start)
+    until = until or history.end + RUN_ON
+    folder = Path(folder or tempfile.mkdtemp())
+    twitter = RecordingTwitter(clock)
+    saved = (bot.TWEET_FREQUENCY, bot.MINIMUM_CONCERN_LEVEL, bot.LEVEL_DATA_CACHE, bot.TWEET_QUEUE, bot.TWEET_SENDER,
+             bot.PUBLISHER, bot.TREND_ENGINE)
+    if frequency is not None:
+        bot.TWEET_FREQUENCY = list(frequency)
+    if concern_level is not None:
+        bot.MINIMUM_CONCERN_LEVEL = concern_level
+    # the bot's own cache settings, a refresh runs at once instead of racing the simulated clock on a thread
+    bot.LEVEL_DATA_CACHE = bot.level_data_cache(lambda: history.at(clock()), clock=clock.timestamp, refresher=run_now)
+    bot.TWEET_QUEUE = tq.TweetQueue(folder / tq.QUEUE_FILE, clock=clock.timestamp)
+    bot.TWEET_SENDER = None  # sent inside send_tweet, at the simulated time of the tweet
+    bot.TREND_ENGINE = None  # rates from the replayed readings only
+    bot.PUBLISHER = publishers.Publisher([publishers.TwitterChannel("twitter", bot.TWEET_QUEUE)])  # never the real channels
+    db = bot.ActivateDatabase(str(folder / bot.PUPDB_FILENAME), clock())
+    timeline = []
+
+    def record_cycle(when, wait, level, trend):
+        timeline.extend(
+            {"time": str(tweeted), "event": "tweet", "text": status}
+            for tweeted, status in twitter.tweets
+        )
+        twitter.tweets.clear()
+        timeline.append({"time": str(when), "event": "cycle", "level": level, "trend": trend, "wait": wait})
+
+    try:
+        bot.run_schedule(twitter, db, clock=clock, sleeper=clock.sleep, until=until, after_cycle=record_cycle)
+    finally:
+        (bot.TWEET_FREQUENCY, bot.MINIMUM_CONCERN_LEVEL, bot.LEVEL_DATA_CACHE,
+         bot.TWEET_QUEUE, bot.TWEET_SENDER, bot.PUBLISHER, bot.TREND_ENGINE) = saved
+    return timeline
+
+
+def summary(timeline):
+    tweets = [datetime.fromisoformat(event["time"]) for event in timeline if event["event"] == "tweet"]
+    gaps = [(later - earlier).total_seconds() / 3600 for earlier, later in zip(tweets, tweets[1:])]
+    return {
+        "cycles": sum(event["event"] == "cycle" for event in timeline),
+        "tweets": len(tweets),
+        "shortest_gap_hours": round(min(gaps), 2) if gaps else None,
+        "longest_gap_hours": round(max(gaps), 2) if gaps else None,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay the tweet schedule on recorded levels without waiting.")
+    parser.add_argument("--pages", default=str(RECORDED_WEEK), help="directory of recorded hydrograph pages")
+    parser.add_argument("--frequency", default=None, help="comma separated TWEET_FREQUENCY seconds to try")
+    parser.add_argument("--concern-level", type=float, default=None, help="MINIMUM_CONCERN_LEVEL to try")
+    parser.add_argument("--json", action="store_true", help="print the timeline and summary as json")
+    args = parser.parse_args()
+    logger.remove()
+    logger.add(sys.stderr, level="ERROR")
+    frequency = [int(seconds) for seconds in args.frequency.split(",")] if args.frequency else None
+    timeline = simulate(args.pages, frequency=frequency, concern_level=args.concern_level)
+    if args.json:
+        print(json.dumps({"summary": summary(timeline), "timeline": timeline}))
+    else:
+        for event in timeline:
+            if event["event"] == "tweet":
+                print(f'{event["time"]}  TWEET  {event["text"]}')
+            else:
+                print(f'{event["time"]}  level {event["level"]}  {event["trend"]}  next in {event["wait"]} s')
+        print(summary(timeline))
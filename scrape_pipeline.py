@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""A sweep of guages as a chain of generator stages: fetch -> parse -> normalize -> dedupe -> sink.
+Each stage takes an iterator of scrape items (dicts) and yields them on. pipeline() runs every
+stage in its own thread with a bounded queue in front of it, so a slow stage (the fetch) overlaps
+with the others and a fast one blocks instead of piling up work. At most QUEUE_SIZE items wait
+between two stages and the raw page is dropped as soon as it is parsed, so memory follows the
+queue sizes, not the number of guages. With queue_size=0 the stages run one after the other in
+the calling thread (used when profiling, cProfile only sees the calling thread).
+
+A scrape item holds:
+    point           url of the guage page
+    scrape_time     UTC time string of the scrape, the CSV filename with the guage id
+    raw_html        the page, until parse_stage
+    readings        sort_and_label_data rows (None when the fetch or the parse failed)
+    guage, friendly_name, scrape_date
+    changes         readings that are new or revised since the last scrape (see change_ingest.py)
+    ingest_state    last-seen state of the guage, to change_ingest.commit() once the changes are stored
+
+Every stage can be run and timed on its own with recorded pages, see bench() and:
+
+usage: python scrape_pipeline.py [directory] [rounds]     (time each stage on recorded .rawhtml pages)
+"""
+import queue
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from functools import partial
+from pathlib import Path
+
+from loguru import logger
+
+import change_ingest as ci
+import metrics
+import resilient_fetch as rf
+
+QUEUE_SIZE = 4  # items waiting between two stages
+PUT_POLL = 0.1  # seconds, how often a blocked producer checks whether the consumer went away
+
+
+class _End:
+    """Queue marker for the end of a stage, carries the exception that ended it if any."""
+
+    def __init__(self, error=None):
+        self.error = error
+
+
+def buffered(items, maxsize=QUEUE_SIZE, name="stage"):
+    """Iterate 'items' in a thread and yield them from a queue of at most maxsize entries.
+    The thread blocks while the queue is full, which throttles the upstream stages.
+    """
+    if maxsize <= 0:
+        yield from items
+        return
+    channel = queue.Queue(maxsize)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                channel.put(item, timeout=PUT_POLL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put(item):
+                    return
+        except BaseException as e:  # hand the failure to the consumer thread
+            put(_End(e))
+            return
+        put(_End())
+
+    threading.Thread(target=produce, name=f"pipeline-{name}", daemon=True).start()
+    try:
+        while True:
+            item = channel.get()
+            if isinstance(item, _End):
+                if item.error is not None:
+                    raise item.error
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+def pipeline(source, *stages, queue_size=QUEUE_SIZE):
+    """Chain the stages (callables taking and returning an iterator) with a bounded queue before each."""
+    items = iter(source)
+    for stage in stages:
+        name = getattr(stage, "func", stage).__name__
+        items = stage(buffered(items, queue_size, name))
+    return items
+
+
+def _utc_now_string():
+    import cfsiv_utils.time_strings as ts
+
+    return ts.UTC_NOW_STRING()
+
+
+def _until_deadline(points, sweep):
+    for point in points:
+        if sweep is not None and sweep.expired():
+            logger.warning(f"Sweep deadline passed, not fetching {point} or the points after it.")
+            return
+        yield point
+
+
+def _fetch_concurrently(points, get, workers):
+    """Yield (point, get(point)) in the order of points with up to 'workers' fetches in flight."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fetch") as executor:
+        in_flight = deque()
+        for point in points:
+            in_flight.append((point, executor.submit(get, point)))
+            if len(in_flight) >= workers:
+                point, future = in_flight.popleft()
+                yield (point, future.result())
+        while in_flight:
+            point, future = in_flight.popleft()
+            yield (point, future.result())
+
+
+def fetch_stage(points, fetch=None, sweep=None, cache=False, now=_utc_now_string, workers=1):
+    """Yield a scrape item with the raw page of each point, until the sweep deadline passes.
+    With workers > 1 that many pages are fetched at once (over the shared connection pool of resilient_fetch).
+    """
+    fetch = fetch or partial(rf.fetch, cache=rf.PAGE_CACHE)
+
+    def get(point):
+        logger.debug(f"Scraping point: {point}")
+        return metrics.call("fetch", fetch, point, sweep)
+
+    points = _until_deadline(points, sweep)
+    pages = ((point, get(point)) for point in points) if workers <= 1 else _fetch_concurrently(points, get, workers)
+    for point, raw_html in pages:
+        scrape_time = now()
+        if raw_html is None:
+            logger.debug(f"Error retreiving web data for: {point}")
+        elif cache:
+            import cfsiv_utils.WebScraping as ws
+
+            ws.save_html_text(raw_html)
+        yield {"point": point, "scrape_time": scrape_time, "raw_html": raw_html, "readings": None}
+
+
+def parse_stage(items, parse):
+    """Parse each raw page with parse(raw_html) -> (readings, guage_id, friendly_name, scrape_date)."""
+    for item in items:
+        raw_html = item.pop("raw_html", None)
+        parsed = None if raw_html is None else parse(raw_html)
+        if parsed is None:
+            logger.debug(f"No data collected for: {item['point']}")
+        else:
+            item["readings"], item["guage"], item["friendly_name"], item["scrape_date"] = parsed
+        yield item
+
+
+def normalize_stage(items):
+    """Keep complete readings only, every field as a stripped string."""
+    for item in items:
+        if item["readings"] is not None:
+            item["readings"] = [
+                {key: str(value).strip() for key, value in row.items()}
+                for row in item["readings"]
+                if row.get("datetime") and "level" in row and "flow" in row
+            ]
+            metrics.ROWS.inc(len(item["readings"]), guage=item["guage"])
+        yield item
+
+
+def dedupe_stage(items, ingest=ci.ingest):
+    """Attach the readings that are new or revised since the last scrape of the guage.
+    Their last-seen state is left for the sink to commit once it has stored them.
+    """
+    for item in items:
+        ingested = None if item["readings"] is None else ingest(item["readings"])
+        item["changes"], item["ingest_state"] = ingested or ([], None)  # None: nothing read or the ingest failed
+        yield item
+
+
+def sink_stage(items, sinks=(), commit=ci.commit):
+    """Hand every successful scrape to each sink(item), then yield it.
+    The last-seen state of its changes is committed only when every sink returned True (stored
+    them), otherwise the next scrape of the guage passes the same changes on again.
+    """
+    for item in items:
+        if item["readings"] is not None:
+            stored = [sink(item) for sink in sinks]
+            if sinks and all(result is True for result in stored):
+                commit(item.get("ingest_state"))
+        yield item
+
+
+def bench(pages, rounds=1, parse=None):
+    """Seconds per page spent in each stage when the stages run one at a time over recorded pages."""
+    if parse is None:
+        from OHIO_RIVER_LEVEL_SCRAPING import parse_guage_page as parse
+
+    def replay(point, _sweep=None):
+        return pages[int(point)]
+
+    counter = iter(range(sys.maxsize))
+    stages = {
+        "fetch": lambda items: fetch_stage(items, fetch=replay, now=lambda: next(counter)),
+        "parse": partial(parse_stage, parse=parse),
+        "normalize": normalize_stage,
+    }
+    timings = dict.fromkeys(list(stages) + ["dedupe"], 0.0)
+    with tempfile.TemporaryDirectory() as state_root:
+        for _round in range(rounds):
+            items = [str(i) for i in range(len(pages))]
+            for name, stage in stages.items():
+                start = time.perf_counter()
+                items = list(stage(iter(items)))
+                timings[name] += time.perf_counter() - start
+            start = time.perf_counter()
+            for item in dedupe_stage(iter(items), ingest=partial(ci.ingest, state_root=state_root)):
+                ci.commit(item["ingest_state"])
+            timings["dedupe"] += time.perf_counter() - start
+    return {name: seconds / (len(pages) * rounds) for name, seconds in timings.items()}
+
+
+if __name__ == "__main__":
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+    from bench_html_backends import recorded_pages  # it imports the scraper, which imports this module
+
+    pages = recorded_pages(sys.argv[1] if len(sys.argv) > 1 else None)
+    if not pages:
+        sys.exit("No recorded pages found.")
+    for name, seconds in bench(pages, int(sys.argv[2]) if len(sys.argv) > 2 else 1).items():
+        print(f"{name:<10} {seconds * 1000:8.2f} ms/page")
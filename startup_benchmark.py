@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Measure how long it takes to import the bot and scraper entry points.
+Each module is imported in a fresh interpreter so nothing is already cached in sys.modules.
+The budget below is enforced by test_startup.py so a heavy import at module level is caught
+before it reaches the Pi.
+
+usage: python startup_benchmark.py
+"""
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+ENTRY_POINTS = ["Sunset_Village_TwitterBot", "OHIO_RIVER_LEVEL_SCRAPING"]
+IMPORT_BUDGET_SECONDS = 0.5  # per entry point on a development machine
+# none of these may be loaded just by importing an entry point
+HEAVY_MODULES = ["pandas", "numpy", "bs4", "tqdm", "dateparser", "twython", "pupdb", "dotenv", "dateutil", "requests", "lxml"]
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+heavy = [name for name in {heavy!r} if name in sys.modules]
+print(json.dumps({{"seconds": elapsed, "heavy": heavy}}))
+"""
+
+
+def measure_import(module, heavy=HEAVY_MODULES):
+    """Import 'module' in a new interpreter and return {'seconds': float, 'heavy': [loaded heavy modules]}."""
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE.format(module=module, heavy=heavy)],
+        capture_output=True,
+        text=True,
+        cwd=Path(__file__).parent,
+        check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def best_of(module, runs=3):
+    """The fastest of several runs, the others include disk cache warm up."""
+    results = [measure_import(module) for _ in range(runs)]
+    return min(results, key=lambda r: r["seconds"])
+
+
+if __name__ == "__main__":
+    for entry in ENTRY_POINTS:
+        result = best_of(entry)
+        status = "ok" if result["seconds"] <= IMPORT_BUDGET_SECONDS and not result["heavy"] else "OVER BUDGET"
+        print(f'{entry:30} {result["seconds"] * 1000:7.1f} ms  heavy modules: {result["heavy"] or "none"}  {status}')
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+"""Locations and formats shared by everything that reads or writes the scrape history.
+Kept free of heavy imports so the scraper and the bot can use it without loading pandas.
+"""
+from pathlib import Path
+
+HISTORY_ROOT = "CSV_DATA/"  # same location OHIO_RIVER_LEVEL_SCRAPING.OUTPUT_ROOT writes to
+STATE_ROOT = "STATE/"  # derived data and caches live here, never inside HISTORY_ROOT
+ARCHIVE_ROOT = "ARCHIVE/"  # fixed-width binary copy of the history, one file per guage (see guage_archive.py)
+
+CSV_DATETIME_FORMAT = "%Y-%m-%d_%H:%M:%SUTC"  # format produced by ts.timefstring()
+SCRAPE_FILENAME_FORMAT = "%Y%m%d_%H%M%SUTC"  # UTC_NOW_STRING() with ':' and '-' removed, then _<guage>
+OBSERVED = "Observed"
+FORECAST = "Forecast"
+
+
+def state_file(name, state_root=STATE_ROOT):
+    """Return a Path inside the state directory, creating the directory if needed."""
+    root = Path(state_root)
+    root.mkdir(parents=True, exist_ok=True)
+    return Path(root, name)
@@ -6,6 +6,11 @@ river level data for both Markland and McAlpine dams. By using the mileage marke
 the level of the river at that point can be calculated.
 """
 
+import pytest
+
+import NWS_River_Data_scrape_NEW as nws
+import runtime_profile as rp
+from memory_harness import recorded_fetchers
 from NWS_River_Data_scrape_NEW import processRiverData
 
 
@@ -16,6 +21,34 @@ def test_processRiverData():
     return
 
 
+@pytest.mark.parametrize("profile", ["default", "pi"])
+def test_any_number_of_dams_are_merged(monkeypatch, profile):
+    monkeypatch.setenv(rp.RUNTIME_ENV_VAR, profile)
+    fetch = recorded_fetchers()[0]
+    cleaned = []
+    clean_item = nws.clean_item
+
+    def counting_clean(lst):
+        result = clean_item(lst)
+        cleaned.append(result)
+        return result
+
+    monkeypatch.setattr(nws, "clean_item", counting_clean)
+    two = processRiverData(fetch)
+    per_dam_cleans = len(cleaned)
+    important = [entry for entry in cleaned if entry and entry[0] in nws.IMPORTANT_OBSERVATIONS]
+    assert len(important) == len(two)  # each observation kept was cleaned once, not again after filtering
+    # the same two pages again under other names
+    for copy in ("Markland copy", "McAlpine copy", "Markland again", "McAlpine again"):
+        monkeypatch.setitem(nws.RIVER_MONITORING_POINTS, copy, nws.RIVER_MONITORING_POINTS[copy.split()[0]])
+    cleaned.clear()
+    six = processRiverData(fetch, points=list(nws.RIVER_MONITORING_POINTS), workers=3)
+    assert len(cleaned) == 3 * per_dam_cleans  # every entry cleaned once, no re-cleaning per dam added
+    assert list(six) == sorted(six)
+    assert len(six) == 3 * len(two)
+    assert {key: entry for key, entry in six.items() if key in two} == two
+
+
 from hypothesis import given
 import hypothesis.strategies as hst
 
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Backfill re-parses the archived pages once into the guage archive and resumes from its checkpoint.
+"""
+
+import shutil
+from pathlib import Path
+
+import backfill as bf
+import guage_archive as ga
+import river_query as rq
+
+FIXTURES = Path(__file__).parent / "test_fixtures"
+
+
+def test_backfill_fills_the_archive_and_resumes(tmp_path):
+    totals = bf.backfill(FIXTURES, tmp_path / "ARCHIVE", workers=1, state_root=tmp_path / "STATE")
+    assert totals["files"] == 1 and totals["failed"] == 0 and totals["rows"] > 0
+    archive = ga.GuageArchive(tmp_path / "ARCHIVE")
+    (guage,) = archive.guages()
+    assert len(archive.scrapes(guage)) == 1
+    assert archive.indexed(guage, ga.scrape_minute_from_filename("20220305_142210UTC"))
+    rows = rq.run_query("rows", archive_root=tmp_path / "ARCHIVE")
+    assert len(rows) == totals["rows"]
+    assert {row["type"] for row in rows} == {"Observed", "Forecast"}
+    start = rq.parse_time("2022-03-04")
+    in_range = rq.run_query("rows", [guage], "Observed", start, start + 24 * 60, tmp_path / "ARCHIVE")
+    assert in_range and all(row["datetime"].startswith("2022-03-04") for row in in_range)
+    assert rq.run_query("rollup", [guage], "Observed", start, start + 24 * 60, tmp_path / "ARCHIVE")[0]["count"] == len(in_range)
+    again = bf.backfill(FIXTURES, tmp_path / "ARCHIVE", workers=1, state_root=tmp_path / "STATE")
+    assert again["files"] == 0 and again["rows"] == 0
+    restarted = bf.backfill(FIXTURES, tmp_path / "ARCHIVE", workers=1, restart=True, state_root=tmp_path / "STATE")
+    assert restarted["files"] == 1
+    assert len(archive.scrapes(guage)) == 1  # the scrape is indexed once
+    assert len(rq.run_query("rows", archive_root=tmp_path / "ARCHIVE")) == totals["rows"]
+
+
+def test_failed_files_are_retried(tmp_path):
+    source = tmp_path / "raw"
+    source.mkdir()
+    shutil.copy(FIXTURES / "20220305_142210UTC_webscrape.rawhtml", source)
+    (source / "20220306_000000UTC_webscrape.rawhtml").write_text("<html>maintenance</html>")
+    first = bf.backfill(source, tmp_path / "ARCHIVE", workers=1, state_root=tmp_path / "STATE")
+    assert first["files"] == 2 and first["failed"] == 1
+    second = bf.backfill(source, tmp_path / "ARCHIVE", workers=1, state_root=tmp_path / "STATE")
+    assert second["files"] == 1 and second["failed"] == 1
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Repeated scrapes should only pass on new or revised readings.
+"""
+
+import change_ingest as ci
+
+
+def row(kind, stamp, level):
+    return {"guage": "mklk2", "type": kind, "datetime": f"2022-03-{stamp}_12:00:00UTC", "level": level, "flow": "-999kcfs"}
+
+
+def ingest_and_commit(readings, state_root):
+    changes, state = ci.ingest(readings, state_root=state_root)
+    ci.commit(state)
+    return changes
+
+
+def test_only_new_and_revised_readings_are_kept(tmp_path):
+    first = [row("Observed", "01", "20.0ft"), row("Forecast", "02", "21.0ft")]
+    assert len(ingest_and_commit(first, tmp_path)) == 2
+    # identical scrape stores nothing
+    assert ci.ingest(first, state_root=tmp_path) == ([], None)
+    # a new observation and a revised forecast
+    second = [row("Observed", "01", "20.0ft"), row("Observed", "02", "20.5ft"), row("Forecast", "02", "21.5ft")]
+    changes = ingest_and_commit(second, tmp_path)
+    assert [(c["type"], c["version"]) for c in changes] == [("Observed", 1), ("Forecast", 2)]
+
+
+def test_changes_not_committed_are_passed_on_again(tmp_path):
+    first = [row("Observed", "01", "20.0ft")]
+    changes, _state = ci.ingest(first, state_root=tmp_path)  # the store failed, nothing committed
+    assert ci.ingest(first, state_root=tmp_path)[0] == changes
+
+
+def test_prune_forgets_old_readings():
+    last_seen = {("Observed", "2022-01-01_00:00:00UTC"): ("1ft", "", 1), ("Observed", "2022-06-01_00:00:00UTC"): ("1ft", "", 1)}
+    assert list(ci.prune(last_seen)) == [("Observed", "2022-06-01_00:00:00UTC")]
+
+
+def test_corrupt_state_starts_empty(tmp_path):
+    readings = [row("Observed", "01", "20ft")]
+    changes, state = ci.ingest(readings, state_root=tmp_path)
+    ci.commit(state)
+    ci._state_path("mklk2", tmp_path).write_bytes(b"not a pickle")
+    changes, state = ci.ingest(readings, state_root=tmp_path)
+    assert [change["version"] for change in changes] == [1]
+    assert ci.commit(state) is True
+    assert ci.ingest(readings, state_root=tmp_path) == ([], None)
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Whole tweet cycles run offline against recorded NWS pages and the local Twitter stand-in.
+"""
+
+import pytest
+
+import cycle_benchmark as cb
+import Sunset_Village_TwitterBot as bot
+import tweet_queue as tq
+from fake_twitter import FakeTwitter, FakeTwitterServer
+
+
+def test_queue_recovers_from_injected_errors_through_twython(tmp_path):
+    now = [1_000_000.0]
+    fake = FakeTwitter(script=[503, 429], rate_limit=10, clock=lambda: now[0])
+    server = FakeTwitterServer(fake).start()
+    try:
+        queue = tq.TweetQueue(tmp_path / tq.QUEUE_FILE, clock=lambda: now[0])
+        queue.enqueue("River at 30ft")
+        twitter = server.client()
+        wait = queue.send_due(twitter)  # 503, retried after a backoff
+        now[0] += wait
+        queue.send_due(twitter)  # 429, held until the x-rate-limit-reset of the window
+        assert queue.blocked_until == 1_000_000 + fake.window
+        now[0] = queue.blocked_until
+        assert queue.send_due(twitter) is None
+    finally:
+        server.stop()
+    assert fake.statuses == ["River at 30ft"]
+    assert fake.requests == 3
+
+
+@pytest.mark.parametrize("values, pct, expected", [
+    ([1, 2], 50, 1),
+    (list(range(1, 101)), 99, 99),
+    (list(range(1, 11)), 50, 5),
+    (list(range(1, 11)), 100, 10),
+    ([7], 0, 7),
+])
+def test_nearest_rank_percentile(values, pct, expected):
+    assert cb.percentile(values, pct) == expected
+
+
+def test_benchmark_runs_full_cycles(tmp_path):
+    saved = (bot.TWEET_QUEUE, bot.TWEET_SENDER, bot.PUBLISHER, bot.LEVEL_DATA_CACHE, bot.TREND_ENGINE)
+    reports, fake = cb.run_cycles(cycles=3, folder=tmp_path)
+    result = cb.summary(reports, fake)
+    assert result["cycles"] == 3
+    assert result["tweets_posted"] == 3
+    assert result["p50_seconds"] <= result["p99_seconds"] <= result["max_seconds"]
+    assert {"processRiverData", "build_tweet", "send_tweet", "update_status"} <= set(result["mean_stage_seconds"])
+    assert (bot.TWEET_QUEUE, bot.TWEET_SENDER, bot.PUBLISHER, bot.LEVEL_DATA_CACHE, bot.TREND_ENGINE) == saved
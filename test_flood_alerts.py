@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" A flood stage crossing alerts once, seconds after the scrape, and a level hovering at the threshold does not.
+"""
+
+import math
+import time
+
+import flood_alerts as fa
+import latest_snapshot as ls
+import river_config as rc
+
+MCALPINE = {"First-action": 21, "Minor-flood": 23, "Moderate-flood": 30, "Major-flood": 38}
+
+
+def test_stage_changes_only_past_the_hysteresis():
+    assert fa.stage_of(21.0, MCALPINE) == "First-action"
+    assert fa.stage_of(20.6, MCALPINE, "First-action") == "First-action"
+    assert fa.stage_of(20.4, MCALPINE, "First-action") == "No Flooding"
+    assert fa.stage_of(20.8, MCALPINE, "Minor-flood") == "First-action"
+    assert fa.stage_of(31.0, MCALPINE) == "Moderate-flood"
+
+
+def test_guages_and_point_of_interest_alert_once(tmp_path):
+    detector = fa.FloodAlertDetector(path=tmp_path / fa.ALERTS_FILE)
+    point = rc.point_of_interest()
+    assert detector.observe("Markland", 46.0, "t0") == []
+    assert detector.observe("McAlpine", 20.0, "t0") == []
+    alerts = detector.observe("McAlpine", 23.5, "t1")
+    assert [(a.place, a.previous, a.stage) for a in alerts] == [
+        ("McAlpine", "No Flooding", "Minor-flood"),
+        (point["name"], "No Flooding", "First-action"),
+    ]
+    assert "FLOOD ALERT McAlpine: 23.5ft at t1" in fa.alert_text(alerts[0])
+    for level in (22.9, 23.2, 22.6, 23.4):  # hovering at the Minor-flood level
+        assert [a.place for a in detector.observe("McAlpine", level, "t2")] == []
+    restarted = fa.FloodAlertDetector(path=tmp_path / fa.ALERTS_FILE)
+    assert restarted.stages["McAlpine"] == "Minor-flood"
+    falling = restarted.observe("McAlpine", 20.0, "t3")  # Markland unknown after the restart, no projection
+    assert [(a.place, a.stage) for a in falling] == [("McAlpine", "No Flooding")]
+
+
+def test_snapshot_reading_alerts_within_seconds(tmp_path):
+    path = tmp_path / ls.SNAPSHOT_FILE
+    writer = ls.SnapshotWriter(path)
+    alerts = []
+    watcher = fa.SnapshotWatcher(fa.FloodAlertDetector(path=tmp_path / fa.ALERTS_FILE), alerts.append,
+                                 reader=ls.SnapshotReader(path), poll=0.05).start()
+    try:
+        writer.records["MLUK2"] = (1_646_200_000, 30.5, math.nan, 0, math.nan)
+        writer.publish()
+        published = time.monotonic()
+        while not alerts and time.monotonic() - published < 5:
+            time.sleep(0.01)
+    finally:
+        watcher.stop()
+    assert time.monotonic() - published < 1
+    assert [(a.place, a.stage) for a in alerts] == [("McAlpine", "Moderate-flood")]
+    assert watcher.check() == []  # the same observation is not seen twice
+
+
+def test_every_new_snapshot_reading_feeds_the_trends(tmp_path):
+    from NWS_River_Data_scrape_NEW import guage_lid
+    import trend_engine as te
+
+    path = tmp_path / ls.SNAPSHOT_FILE
+    writer = ls.SnapshotWriter(path)
+    detector = fa.FloodAlertDetector(path=tmp_path / fa.ALERTS_FILE)
+    engine = te.TrendEngine()
+    watcher = fa.SnapshotWatcher(detector, lambda alert: None, reader=ls.SnapshotReader(path), on_reading=engine.add)
+    upstream, downstream = detector.point["upstream"], detector.point["downstream"]
+    for hour, rise in enumerate([0.0, 0.5, 1.0]):
+        observed = 1_646_200_000 + hour * 3600
+        writer.records[guage_lid(upstream).upper()] = (observed, 20.0 + rise, math.nan, 0, math.nan)
+        writer.records[guage_lid(downstream).upper()] = (observed, 15.0 + rise, math.nan, 0, math.nan)
+        writer.publish()
+        watcher.check()
+    assert abs(engine.trend(upstream).rate - 0.5) < 1e-9
+    assert abs(engine.trend(detector.point["name"]).rate - 0.5) < 1e-9
+    assert engine.trend(detector.point["name"]).count == 3
+
+
+def test_alerts_and_tweets_share_one_publisher(monkeypatch):
+    import Sunset_Village_TwitterBot as bot
+
+    class Watcher:
+        def __init__(self, detector, on_alert, on_reading=None):
+            self.on_alert = on_alert
+
+        def start(self):
+            return self
+
+    published = []
+
+    class Recorder:
+        def publish(self, text, time):
+            published.append(text)
+
+    monkeypatch.setattr(bot, "PUBLISHER", Recorder())
+    monkeypatch.setattr(bot, "FLOOD_ALERTS", None)
+    monkeypatch.setattr(bot, "TREND_ENGINE", None)
+    monkeypatch.setattr(fa, "SnapshotWatcher", Watcher)
+    watcher = bot.start_flood_alerts()
+    monkeypatch.setattr(bot, "PUBLISHER", None)  # a later publisher() would build a second one
+    watcher.on_alert(fa.Alert(place="McAlpine", level=23.5, time="2022-03-05_14:00:00UTC", previous="First-action", stage="Minor-flood"))
+    assert len(published) == 1
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Verify that flood_wave recovers the travel time of a synthetic wave between guages.
+"""
+
+import csv
+import time
+
+import numpy as np
+import pandas as pd
+
+import flood_wave as fw
+
+GUAGES = ["mklk2", "mdsi3", "mluk2"]
+LAGS = [0, 5, 12]  # hours behind the upstream guage
+
+
+def wave(hours, delay):
+    """Two flood waves passing a guage 'delay' hours after the upstream guage."""
+    t = hours - delay
+    return 20 + 8 * np.exp(-(((t - 150) / 20) ** 2)) + 5 * np.exp(-(((t - 400) / 30) ** 2))
+
+
+def write_history(root, hours=600):
+    """Write one scrape per guage per 6 hours in the CSV_DATA layout."""
+    start = pd.Timestamp("2022-01-01", tz="UTC")
+    for scrape in range(0, hours, 6):
+        for n, (guage, lag) in enumerate(zip(GUAGES, LAGS)):
+            scrape_time = start + pd.Timedelta(hours=scrape, seconds=n)
+            folder = root / scrape_time.strftime("%Y/%m/%d")
+            folder.mkdir(parents=True, exist_ok=True)
+            with open(folder / scrape_time.strftime("%Y%m%d_%H%M%SUTC"), "w", newline="") as fl:
+                writer = csv.writer(fl)
+                writer.writerow(["guage", "type", "datetime", "level", "flow"])
+                for h in range(scrape - 6, scrape + 1):
+                    stamp = start + pd.Timedelta(hours=h)
+                    writer.writerow([guage, "Observed", stamp.strftime("%Y-%m-%d_%H:%M:%SUTC"), f"{wave(h, lag):.2f}ft", "-999kcfs"])
+
+
+def test_travel_times_from_history(tmp_path):
+    write_history(tmp_path / "CSV_DATA")
+    travel, observations, order = fw.update_travel_times(tmp_path / "CSV_DATA", state_root=tmp_path / "STATE")
+    assert order == GUAGES
+    assert travel["mklk2>mdsi3"]["lag_hours"] == 5
+    assert travel["mdsi3>mluk2"]["lag_hours"] == 7
+    prediction = fw.predict_crest_arrival(observations, travel, order)
+    assert prediction["guage"] == "mklk2"
+    assert 0 < prediction["travel_hours"] < 12
+
+
+def test_incremental_update_skips_unchanged_pairs(tmp_path, monkeypatch):
+    computed = []  # pairs handed to each cross-correlation
+
+    def counting(upstream, downstream, max_lag):
+        computed.append(np.atleast_2d(upstream).shape[0])
+        return correlate(upstream, downstream, max_lag)
+
+    correlate = fw.lagged_cross_correlation
+    monkeypatch.setattr(fw, "lagged_cross_correlation", counting)
+    write_history(tmp_path / "CSV_DATA")
+    first, _obs, _order = fw.update_travel_times(tmp_path / "CSV_DATA", state_root=tmp_path / "STATE")
+    assert computed == [2]
+    second, _obs, _order = fw.update_travel_times(tmp_path / "CSV_DATA", state_root=tmp_path / "STATE")
+    assert first == second
+    assert computed == [2]  # nothing new, nothing recomputed
+    scrape_time = pd.Timestamp("2022-01-26 01:00", tz="UTC")
+    folder = tmp_path / "CSV_DATA" / scrape_time.strftime("%Y/%m/%d")
+    folder.mkdir(parents=True, exist_ok=True)
+    with open(folder / scrape_time.strftime("%Y%m%d_%H%M%SUTC"), "w", newline="") as fl:
+        writer = csv.writer(fl)
+        writer.writerow(["guage", "type", "datetime", "level", "flow"])
+        writer.writerow(["mluk2", "Observed", scrape_time.strftime("%Y-%m-%d_%H:%M:%SUTC"), "20.00ft", "-999kcfs"])
+    fw.update_travel_times(tmp_path / "CSV_DATA", state_root=tmp_path / "STATE")
+    assert computed == [2, 1]  # only mdsi3>mluk2 saw a new observation
+
+
+def test_years_of_history_for_all_guages_is_fast():
+    hours = np.arange(24 * 365 * 3)
+    guages = [f"g{n}" for n in range(53)]
+    index = pd.date_range("2019-01-01", periods=len(hours), freq="h", tz="UTC")
+    frames = [pd.DataFrame({"guage": g, "datetime": index, "level": wave(hours % 2000, n)}) for n, g in enumerate(guages)]
+    observations = pd.concat(frames, ignore_index=True)
+    start = time.perf_counter()
+    travel = fw.estimate_travel_times(observations, guages)
+    assert time.perf_counter() - start < 10
+    assert travel["g0>g1"]["lag_hours"] == 1
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Verify that forecasts are joined with later observations and summarized by lead time.
+"""
+
+import csv
+
+import numpy as np
+import pandas as pd
+
+import forecast_skill as fs
+import guage_archive as ga
+
+START = pd.Timestamp("2022-03-01", tz="UTC")
+
+
+def write_scrape(root, scrape_hour, guage, rows):
+    scrape_time = START + pd.Timedelta(hours=scrape_hour)
+    folder = root / scrape_time.strftime("%Y/%m/%d")
+    folder.mkdir(parents=True, exist_ok=True)
+    with open(folder / scrape_time.strftime("%Y%m%d_%H%M%SUTC"), "w", newline="") as fl:
+        writer = csv.writer(fl)
+        writer.writerow(["guage", "type", "datetime", "level", "flow"])
+        for kind, hour, level in rows:
+            stamp = (START + pd.Timedelta(hours=hour)).strftime("%Y-%m-%d_%H:%M:%SUTC")
+            writer.writerow([guage, kind, stamp, f"{level}ft", "-999kcfs"])
+
+
+def test_forecasts_verified_incrementally(tmp_path):
+    root = tmp_path / "CSV_DATA"
+    # scrape at hour 0 forecasts +6h and +12h
+    write_scrape(root, 0, "mklk2", [("Observed", 0, 20.0), ("Forecast", 6, 21.0), ("Forecast", 12, 23.0)])
+    report = fs.update_forecast_skill(root, state_root=tmp_path / "STATE", archive_root=None)
+    assert report.empty  # nothing observed yet
+    # scrape at hour 12 observes both valid times
+    write_scrape(root, 12, "mklk2", [("Observed", 6, 20.5), ("Observed", 12, 22.0)])
+    report = fs.update_forecast_skill(root, state_root=tmp_path / "STATE", archive_root=None)
+    by_lead = report.set_index("lead_bucket")
+    assert by_lead.loc[6, "bias"] == 0.5
+    assert by_lead.loc[12, "mae"] == 1.0
+    assert report["count"].sum() == 2
+    # rerun with no new scrapes leaves the report unchanged
+    again = fs.update_forecast_skill(root, state_root=tmp_path / "STATE", archive_root=None)
+    pd.testing.assert_frame_equal(report, again)
+
+
+def test_unchanged_forecasts_count_at_every_scrape(tmp_path):
+    root = tmp_path / "CSV_DATA"
+    # the +12h forecast is issued at hour 0 and carried unchanged, so it is not in the later files
+    write_scrape(root, 0, "mklk2", [("Observed", 0, 20.0), ("Forecast", 12, 23.0)])
+    write_scrape(root, 6, "mklk2", [("Observed", 6, 21.0)])
+    write_scrape(root, 12, "mklk2", [("Observed", 12, 22.0)])
+    archive = ga.GuageArchive(tmp_path / "ARCHIVE")
+    for hour in (0, 3, 6, 12):  # the scrape at hour 3 changed nothing and left no file
+        archive.record_scrape("mklk2", int((START + pd.Timedelta(hours=hour)).timestamp()) // 60, np.empty(0, dtype=ga.RECORD))
+    report = fs.update_forecast_skill(root, state_root=tmp_path / "STATE", archive_root=tmp_path / "ARCHIVE")
+    by_lead = report.set_index("lead_bucket")
+    assert by_lead["count"].to_dict() == {6: 2, 12: 1}  # from the scrapes at 6 and 3, and at 0
+    assert (report["bias"] == 1.0).all()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" The binary guage archive answers range reads from the mapped file and absorbs revised readings.
+"""
+
+import time
+
+import numpy as np
+
+import guage_archive as ga
+
+
+def row(kind, stamp, level, guage="mklk2"):
+    return {"guage": guage, "type": kind, "datetime": f"2022-03-{stamp}:00UTC", "level": level, "flow": "-999kcfs"}
+
+
+def test_readings_round_trip_and_revisions(tmp_path):
+    archive = ga.GuageArchive(tmp_path)
+    first = [row("Observed", "01_12:00", "20.0ft"), row("Observed", "01_13:00", "20.5ft"), row("Forecast", "02_12:00", "21.0ft")]
+    assert archive.append_readings(first) == 3
+    # the next scrape adds an observation older than the stored forecast and revises that forecast:
+    # the observation is still appended in order, only the revision goes to the overflow
+    second = [row("Observed", "01_14:00", "20.7ft"), row("Forecast", "02_12:00", "21.4ft")]
+    assert archive.append("mklk2", ga.from_readings(second)["mklk2"]) == (1, 1)
+    assert not archive.overflow_path("mklk2", "Observed").exists()
+    start = ga.epoch_minute("2022-03-01_00:00:00UTC")
+    records = archive.read_range("mklk2", start, start + 3 * 24 * 60)
+    np.testing.assert_allclose(records["level"], [20.0, 20.5, 20.7, 21.4], rtol=1e-6)
+    assert np.isnan(records["flow"]).all()
+    assert archive.compact("mklk2") == 1
+    assert not archive.overflow_path("mklk2", "Forecast").exists()
+    compacted = archive.read_range("mklk2", start, start + 3 * 24 * 60)
+    assert compacted[["minute", "level", "type"]].tolist() == records[["minute", "level", "type"]].tolist()
+    observed = archive.read_range("mklk2", start, start + 3 * 24 * 60, kind="Observed")
+    assert isinstance(observed, np.memmap)  # a view of the file, nothing copied
+    np.testing.assert_allclose(observed["level"], [20.0, 20.5, 20.7], rtol=1e-6)
+    np.testing.assert_allclose(archive.read_range("mklk2", kind="Forecast")["level"], [21.4], rtol=1e-6)
+
+
+def test_hourly_scrapes_append_observations_in_order(tmp_path):
+    archive = ga.GuageArchive(tmp_path)
+    for hour in range(10, 20):
+        # each scrape brings the next observation and forecasts for the next two days
+        scrape = [row("Observed", f"01_{hour}:00", f"{hour}ft")]
+        scrape += [row("Forecast", f"0{day}_{hour}:00", f"{hour + day}ft") for day in (2, 3)]
+        archive.append_readings(scrape)
+    assert archive._count(archive.path("mklk2", "Observed")) == 10
+    assert not archive.overflow_path("mklk2", "Observed").exists()
+
+
+def test_convert_csv_tree(tmp_path):
+    folder = tmp_path / "CSV_DATA" / "2022" / "03" / "01"
+    folder.mkdir(parents=True)
+    (folder / "20220301_120000UTC").write_text(
+        "guage,type,datetime,level,flow\n"
+        "mklk2,Observed,2022-03-01_12:00:00UTC,20.0ft,-999kcfs\n"
+        "mluk2,Observed,2022-03-01_12:00:00UTC,15.0ft,-999kcfs\n"
+    )
+    (folder / "20220301_130000UTC").write_text(
+        "guage,type,datetime,level,flow\nmklk2,Observed,2022-03-01_13:00:00UTC,bad,-999kcfs\n"
+    )
+    assert ga.convert_csv_tree(tmp_path / "CSV_DATA", tmp_path / "ARCHIVE") == 3
+    archive = ga.GuageArchive(tmp_path / "ARCHIVE")
+    assert archive.guages() == ["mklk2", "mluk2"]
+    assert np.isnan(archive.read_range("mklk2")["level"][-1])
+    assert len(archive.scrapes("mklk2")) == 2 and len(archive.scrapes("mluk2")) == 1
+    ga.convert_csv_tree(tmp_path / "CSV_DATA", tmp_path / "ARCHIVE")  # a second run indexes nothing twice
+    assert len(archive.scrapes("mklk2")) == 2 and len(archive.scrapes("mluk2")) == 1
+    assert len(archive.read_range("mklk2")) == 2
+
+
+def test_year_scale_range_read_is_fast(tmp_path):
+    archive = ga.GuageArchive(tmp_path)
+    minutes = np.arange(0, 5 * 365 * 24 * 60, 15, dtype=np.int64)  # 5 years of 15 minute readings
+    records = np.zeros(len(minutes), dtype=ga.RECORD)
+    records["minute"] = minutes
+    records["level"] = np.sin(minutes / 1e4)
+    archive.append("ccno1", records)
+    start = time.perf_counter()
+    year = archive.read_range("ccno1", 365 * 24 * 60, 2 * 365 * 24 * 60)
+    highest = float(year["level"].max())
+    elapsed = time.perf_counter() - start
+    assert len(year) == 365 * 24 * 4
+    assert highest > 0.99
+    assert elapsed < 0.05
@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Every html backend must return exactly what the original BeautifulSoup scraper returned.
+"""
+
+from pathlib import Path
+
+from bs4 import BeautifulSoup
+
+import html_backend as hb
+import OHIO_RIVER_LEVEL_SCRAPING as scraper
+
+PAGES = sorted(Path(__file__).parent.joinpath("test_fixtures").glob("*.rawhtml"))
+
+
+def original_parse(raw_html):
+    raw_data, guage_id, friendly_name, scrape_date = scraper.pull_details(BeautifulSoup(raw_html, "html.parser"))
+    readings = scraper.sort_and_label_data(raw_data, guage_id, friendly_name, scrape_date)
+    return ([{k: str(v) for k, v in row.items()} for row in readings], guage_id, friendly_name, scrape_date)
+
+
+def test_backends_match_original_scraper():
+    assert PAGES
+    for page in PAGES:
+        raw_html = page.read_text()
+        expected = original_parse(raw_html)
+        for backend in hb.BACKENDS:
+            assert scraper.parse_guage_page(raw_html, backend) == expected
+
+
+def test_extract_page_structure_identical():
+    raw_html = PAGES[0].read_text()
+    lxml_page = hb.extract_page(raw_html, "lxml")
+    assert lxml_page == hb.extract_page(raw_html, "bs4")
+    guage_id, name, comments, sections = lxml_page
+    assert [title.split()[0] for title, _cells in sections] == ["Observed", "Forecast"]
+    assert all(len(cells) % 3 == 0 for _title, cells in sections)
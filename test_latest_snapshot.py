@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" The scraper publishes the latest reading of each guage, the bot reads it without scraping.
+"""
+
+import calendar
+import math
+
+import latest_snapshot as ls
+import NWS_River_Data_scrape_NEW as nws
+
+
+def readings(guage, level, forecast):
+    return [
+        {"guage": guage, "type": "Observed", "datetime": "2022-03-05_13:00:00UTC", "level": f"{level - 0.5}ft", "flow": "-999kcfs"},
+        {"guage": guage, "type": "Observed", "datetime": "2022-03-05_14:00:00UTC", "level": f"{level}ft", "flow": "-999kcfs"},
+        {"guage": guage, "type": "Forecast", "datetime": "2022-03-06_12:00:00UTC", "level": f"{forecast}ft", "flow": "-999kcfs"},
+        {"guage": guage, "type": "Forecast", "datetime": "2022-03-07_12:00:00UTC", "level": f"{forecast - 1}ft", "flow": "-999kcfs"},
+    ]
+
+
+def test_readers_see_each_new_generation(tmp_path):
+    path = tmp_path / ls.SNAPSHOT_FILE
+    writer = ls.SnapshotWriter(path)
+    reader = ls.SnapshotReader(path)
+    assert reader.refresh() is False
+    writer.update("mluk2", readings("mluk2", 20.0, 22.0))
+    writer.update("mklk2", readings("mklk2", 40.0, 44.0))
+    assert reader.refresh()
+    assert reader.generation() == 2
+    lid, obs_time, obs_level, obs_flow, fcst_time, fcst_level = reader.lookup("MKLK2")
+    assert (lid, obs_level, fcst_level) == ("MKLK2", 40.0, 44.0)
+    assert obs_time == calendar.timegm((2022, 3, 5, 14, 0, 0))
+    assert fcst_time == calendar.timegm((2022, 3, 6, 12, 0, 0))
+    assert math.isnan(obs_flow)
+    assert reader.lookup("CCNO1") is None
+    writer.update("mklk2", readings("mklk2", 41.0, 44.0))
+    assert reader.generation() == 2  # the old mapping stays valid until refreshed
+    assert reader.refresh()
+    assert reader.generation() == 3
+    assert reader.lookup("mklk2")[2] == 41.0
+    # a restarted scraper continues the generation count
+    assert ls.SnapshotWriter(path).generation == 3
+    reader.close()
+
+
+def test_bot_river_data_from_snapshot(tmp_path, monkeypatch):
+    path = tmp_path / ls.SNAPSHOT_FILE
+    writer = ls.SnapshotWriter(path)
+    writer.update("mklk2", readings("mklk2", 40.0, 44.0))
+    monkeypatch.setattr(nws, "SNAPSHOT_READER", ls.SnapshotReader(path))
+    observed = calendar.timegm((2022, 3, 5, 14, 0, 0))
+    # McAlpine is missing from the snapshot
+    assert nws.river_data_from_snapshot(now=observed + 60) is None
+    writer.update("mluk2", readings("mluk2", 20.0, 22.0))
+    assert nws.river_data_from_snapshot(now=observed + nws.SNAPSHOT_MAX_AGE + 1) is None
+    data = nws.river_data_from_snapshot(now=observed + 60)
+    assert data["2022-03-05T09:00Markland"] == [
+        "Latest  observed", "40.00", "9:00AM", "AM", "03/05", 531, "Markland", 408, "2022-03-05T09:00"
+    ]
+    assert [entry[0] for entry in data.values()].count("Highest  Forecast:") == 2
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Stage timing must be cheap and readable from the Prometheus endpoint and the JSON dump.
+"""
+
+import json
+import time
+from urllib.request import urlopen
+
+import metrics
+
+
+def test_timed_stage_counts_outcomes():
+    @metrics.timed("test_stage")
+    def stage(value):
+        if value < 0:
+            raise ValueError(value)
+        return value or None
+
+    stage(1)
+    stage(0)
+    try:
+        stage(-1)
+    except ValueError:
+        pass
+    assert metrics.STAGE_CALLS.value(stage="test_stage", outcome="ok") == 1
+    assert metrics.STAGE_CALLS.value(stage="test_stage", outcome="empty") == 1
+    assert metrics.STAGE_CALLS.value(stage="test_stage", outcome="error") == 1
+    assert metrics.STAGE_SECONDS.count(stage="test_stage") == 3
+    text = metrics.render_prometheus()
+    assert 'riverbot_stage_seconds_bucket{stage="test_stage",le="+Inf"} 3' in text
+    assert "# TYPE riverbot_stage_seconds histogram" in text
+
+
+def test_endpoint_and_json_dump(tmp_path):
+    metrics.ROWS.inc(5, guage="TEST1")
+    server = metrics.serve(port=0)
+    try:
+        with urlopen(f"http://{metrics.METRICS_HOST}:{server.server_address[1]}/metrics") as response:
+            assert 'riverbot_rows_total{guage="TEST1"} 5' in response.read().decode()
+    finally:
+        server.shutdown()
+    metrics.dump_json("test", folder=tmp_path)
+    metrics.dump_json("test", folder=tmp_path)
+    lines = (tmp_path / "test_metrics.jsonl").read_text().splitlines()
+    assert len(lines) == 2
+    assert json.loads(lines[-1])["metrics"]["riverbot_rows_total"]['{guage="TEST1"}'] == 5
+
+
+def test_json_dump_is_rotated(tmp_path):
+    for _ in range(10):
+        metrics.dump_json("test", folder=tmp_path, max_bytes=1, keep=2)
+    assert sorted(fl.name for fl in tmp_path.iterdir()) == ["test_metrics.jsonl", "test_metrics.jsonl.1", "test_metrics.jsonl.2"]
+    assert all(len(fl.read_text().splitlines()) == 1 for fl in tmp_path.iterdir())
+
+
+def test_overhead_is_small():
+    timed_noop = metrics.timed("overhead")(lambda: 1)
+    calls = 20000
+    start = time.perf_counter()
+    for _ in range(calls):
+        timed_noop()
+    assert (time.perf_counter() - start) / calls < 20e-6
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" The 'pi' runtime profile must stay under its documented memory ceiling for a week of recorded scrapes.
+"""
+
+import json
+import os
+import subprocess
+import sys
+from datetime import datetime
+from pathlib import Path
+
+from pupdb.core import PupDB
+
+import memory_harness as mh
+import runtime_profile as rp
+import NWS_River_Data_scrape_NEW as nws
+import Sunset_Village_TwitterBot as bot
+
+
+def test_recorded_week_stays_under_pi_ceiling():
+    # a fresh interpreter so RSS is not inflated by whatever the rest of the test run imported
+    env = dict(os.environ, **{rp.RUNTIME_ENV_VAR: "pi"})
+    result = subprocess.run(
+        [sys.executable, "memory_harness.py", "--json"],
+        capture_output=True, text=True, cwd=Path(__file__).parent, env=env, check=True,
+    )
+    summary = json.loads(result.stdout.strip().splitlines()[-1])["summary"]
+    assert summary["profile"] == "pi"
+    assert summary["cycles"] == summary["tweets"] == 28
+    assert summary["max_rss_mb"] <= rp.PI_MEMORY_CEILING_MB
+    assert summary["max_peak_mb"] <= rp.PI_TRACED_CEILING_MB
+    assert summary["pandas_loaded"] is False
+
+
+def test_streamed_map_areas_match_the_important_observations():
+    raw_html = (mh.RECORDED_WEEK / "mklk2_20220302_0000.html").read_bytes()
+    areas = list(nws.map_areas(raw_html))
+    assert len(areas) == 70  # 48 observed, 20 forecast, highest forecast and flood stage
+    assert areas[-1] == ("Flood Stage is 23 ft", None)
+    assert nws.area_date("Forecast: 46.0 ft at 12:00 AM EST 03/05", year=2022).isoformat() == "2022-03-05T00:00:00"
+    new_year = datetime(2023, 1, 2, 8)
+    assert nws.area_date("Observed: 20.1 ft at 11:00 PM EST 12/28", now=new_year).isoformat() == "2022-12-28T23:00:00"
+    assert nws.area_date("Forecast: 21.0 ft at 1:00 AM EST 01/05", now=new_year).isoformat() == "2023-01-05T01:00:00"
+    assert nws.area_date("Forecast: 21.0 ft at 1:00 AM EST 01/03", now=datetime(2022, 12, 30)).year == 2023
+    assert nws.area_date("Observed: 20.1 ft at 1:00 AM EST 02/29", now=datetime(2024, 3, 1)).year == 2024
+
+
+def test_tweet_history_is_pruned(tmp_path):
+    db = PupDB(str(tmp_path / "db.json_db"))
+    for hour in range(5):
+        db.set(f"{bot.PUPDB_TWEET_PREFIX}2022-03-01 0{hour}:00:00", "status")
+    db.set(bot.PUPDB_MRL_KEY, 30)
+    assert bot.prune_tweet_history(db, 2) == 3
+    assert sorted(db.keys()) == [bot.PUPDB_MRL_KEY, "Tweet@2022-03-01 03:00:00", "Tweet@2022-03-01 04:00:00"]
+
+
+def test_bounded_dict_forgets_oldest():
+    recent = rp.BoundedDict(2)
+    for key in "abc":
+        recent[key] = key
+    assert list(recent) == ["b", "c"]
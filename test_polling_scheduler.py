@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Check that the polling schedule follows the behaviour of the river.
+"""
+
+import datetime as dt
+
+import polling_scheduler as ps
+
+START = dt.datetime(2022, 3, 1)
+
+
+def readings(levels, hours_apart=1):
+    rows = []
+    for n, level in enumerate(levels):
+        stamp = START + dt.timedelta(hours=n * hours_apart)
+        rows.append({"guage": "x", "type": "Observed", "datetime": stamp.strftime(ps.CSV_DATETIME_FORMAT), "level": f"{level}ft", "flow": "-999kcfs"})
+    rows.append({"guage": "x", "type": "Forecast", "datetime": "garbage", "level": "99ft", "flow": ""})
+    return rows
+
+
+def test_quiet_guage_polled_rarely():
+    assert ps.next_poll_interval(readings([20.0] * 12), "Ohio River At Somewhere (ABCD1)") == ps.MAX_POLL_INTERVAL
+
+
+def test_rising_guage_polled_often():
+    rising = ps.next_poll_interval(readings([20 + n * 0.5 for n in range(12)]), "Ohio River At Somewhere (ABCD1)")
+    assert ps.MIN_POLL_INTERVAL <= rising < ps.MAX_POLL_INTERVAL / 5
+
+
+def test_near_action_level_polled_at_nws_cadence():
+    # McAlpine first action level is 21 ft, observations are hourly
+    near = ps.next_poll_interval(readings([19.5] * 12), "Ohio River At McAlpine Upper (MLUK2)")
+    assert near == 3600
+
+
+def test_scheduler_sleeps_until_next_due():
+    now = [0.0]
+    naps = []
+
+    def sleeper(seconds):
+        naps.append(seconds)
+        now[0] += seconds
+
+    scraped = []
+
+    def scrape(url):
+        scraped.append((now[0], url))
+        if url == "busy":
+            return (readings([20 + n * 0.5 for n in range(12)]), "(ABCD1)")
+        return (readings([20.0] * 12), "(ABCD1)")
+
+    scheduler = ps.PollingScheduler(["quiet", "busy"], clock=lambda: now[0], sleeper=sleeper)
+    scheduler.run(scrape, cycles=3)
+    assert [url for _t, url in scraped[:2]] == ["quiet", "busy"]
+    assert [url for _t, url in scraped[2:]] == ["busy", "busy"]
+    assert len(naps) == 3
+
+
+def test_due_guages_scraped_as_one_batch():
+    now = [0.0]
+    batches = []
+
+    def scrape_many(urls):
+        batches.append(list(urls))
+        return {url: (readings([20.0] * 12), "(ABCD1)") for url in urls if url != "down"}
+
+    scheduler = ps.PollingScheduler(["a", "b", "down"], clock=lambda: now[0], sleeper=lambda s: None)
+    assert scheduler.run_once(scrape_many, batch=True) == 3
+    assert batches == [["a", "b", "down"]]
+    assert scheduler.queue[0][2] == "down"  # a failed scrape is retried first
+    assert scheduler.seconds_until_next() == ps.RETRY_INTERVAL
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Profiling only runs for armed cycles and the diff tool explains the difference between two of them.
+"""
+
+import os
+import signal
+
+import pytest
+
+import profile_diff
+import profiling_hooks as ph
+
+
+def busy(n):
+    return sum(i * i for i in range(n))
+
+
+def test_only_armed_cycles_are_profiled(tmp_path):
+    work = ph.profiled("test", folder=tmp_path)(busy)
+    work(10)
+    assert list(tmp_path.iterdir()) == []
+    ph.arm(2)
+    work(1000)
+    work(200000)
+    work(10)
+    assert ph.armed() == 0
+    profiles = sorted(tmp_path.glob("*.prof"))
+    assert len(profiles) == 2
+    assert len(list(tmp_path.glob("*_allocations.txt"))) == 2
+    rows = profile_diff.diff(profile_diff.load(profiles[0]), profile_diff.load(profiles[1]))
+    assert any("busy" in row[0] for row in rows[:3])
+    assert rows[0][3] > 0  # the second cycle did far more work
+
+
+@pytest.mark.skipif(ph.PROFILE_SIGNAL is None, reason="no SIGUSR1 on this platform")
+def test_signal_arms_a_cycle(monkeypatch):
+    monkeypatch.setenv(ph.PROFILE_ENV_VAR, "2")
+    previous = signal.getsignal(ph.PROFILE_SIGNAL)
+    try:
+        assert ph.install() == 2
+        os.kill(os.getpid(), ph.PROFILE_SIGNAL)
+        assert ph.armed() == 2 + ph.PROFILE_CYCLES_ON_SIGNAL
+    finally:
+        signal.signal(ph.PROFILE_SIGNAL, previous)
+        ph.disarm()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" One status reaches every channel, a slow or failing channel holds up nobody else.
+"""
+
+import json
+import threading
+import time
+
+import publishers as pub
+
+
+class RecordingChannel(pub.Channel):
+    def __init__(self, name, failures=0, release=None, **settings):
+        super().__init__(name, **settings)
+        self.failures = failures
+        self.release = release
+        self.sent = []
+
+    def send(self, text, time):
+        if self.release is not None:
+            self.release.wait(5)
+        if self.failures:
+            self.failures -= 1
+            raise pub.PublishError("down")
+        self.sent.append((text, time))
+
+
+def test_slow_channel_does_not_delay_the_others(tmp_path):
+    release = threading.Event()
+    slow = RecordingChannel("slow", release=release)
+    fast = RecordingChannel("fast")
+    feed = pub.FileFeedChannel("feed", tmp_path / "feed.jsonl", keep=2)
+    publisher = pub.Publisher([slow, fast, feed])
+
+    started = time.monotonic()
+    for number in range(3):
+        results = publisher.publish(f"status {number}", number)
+    assert time.monotonic() - started < 1
+    assert results["fast"].result(1) is True
+    assert fast.sent == [("status 0", 0), ("status 1", 1), ("status 2", 2)]
+    assert slow.sent == []
+    lines = (tmp_path / "feed.jsonl").read_text().splitlines()
+    assert [json.loads(line)["text"] for line in lines] == ["status 1", "status 2"]
+
+    release.set()
+    assert results["slow"].result(5) is True
+    assert len(slow.sent) == 3
+    publisher.close()
+
+
+def test_retries_stop_at_attempts_and_budget():
+    delays = []
+    flaky = RecordingChannel("flaky", failures=2, attempts=3)
+    broken = RecordingChannel("broken", failures=10, attempts=10, budget=0)
+    publisher = pub.Publisher([flaky, broken], sleeper=delays.append)
+    assert publisher.deliver(flaky, "status", 1) is True
+    assert len(delays) == 2
+    assert publisher.deliver(broken, "status", 1) is False
+    assert broken.failures == 9  # the first retry would already overrun the budget
+    publisher.close()
+
+
+def test_channels_come_from_the_config(tmp_path):
+    config = pub.load()
+    assert [c.name for c in pub.channels_from_config(config, tweet_queue=[])] == ["twitter"]
+    for entry in config["channels"]:
+        entry["enabled"] = entry["type"] in ("twitter", "file_feed", "webhook")
+    channels = pub.channels_from_config(config, tweet_queue=[])
+    assert [type(c) for c in channels] == [pub.TwitterChannel, pub.WebhookChannel, pub.FileFeedChannel]
+    assert channels[1].timeout == 5
+
+
+class FakeClock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_email_digest_mails_once_per_period(tmp_path):
+    clock = FakeClock()
+    digest = pub.EmailDigestChannel("digest", "smtp.invalid", "bot@invalid", "residents@invalid", every=60,
+                                     state_root=tmp_path, clock=clock)
+    mailed = []
+    failures = [pub.PublishError("smtp down")]
+
+    def mail(statuses):
+        if failures:
+            raise failures.pop()
+        mailed.append([status["text"] for status in statuses])
+
+    digest.mail = mail
+    digest.send("status 0", 0)
+    clock.now += 30
+    digest.send("status 1", 1)
+    assert mailed == []
+    clock.now += 31
+    publisher = pub.Publisher([digest], sleeper=lambda delay: None)
+    assert publisher.deliver(digest, "status 2", 2) is True  # the first mail fails, the retry sends it
+    assert mailed == [["status 0", "status 1", "status 2"]]
+    digest.send("status 3", 3)
+    assert len(mailed) == 1
+    publisher.close()
+
+
+def test_inline_channels_are_not_retried_on_the_callers_thread(tmp_path):
+    feed = pub.FileFeedChannel("feed", tmp_path / "missing" / "\0", attempts=3)
+    assert feed.attempts == 1
+    delays = []
+    publisher = pub.Publisher([feed], sleeper=delays.append)
+    assert publisher.publish("status", 1)["feed"] is False
+    assert delays == []
+    publisher.close()
+
+
+def test_mastodon_idempotency_key_is_stable(monkeypatch):
+    sent = []
+    monkeypatch.setattr(pub, "secret", lambda name: "token")
+    monkeypatch.setattr(pub, "_post", lambda url, timeout, **kwargs: sent.append(kwargs["headers"]["Idempotency-Key"]))
+    mastodon = pub.MastodonChannel("mastodon", "https://mastodon.invalid/", "TOKEN")
+    mastodon.send("status", 1)
+    mastodon.send("status", 1)
+    mastodon.send("other status", 1)
+    assert sent[0] == sent[1] != sent[2]
+    assert len(sent[0]) == 64  # a sha256 digest, the same in every process
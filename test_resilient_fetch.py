@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" A failing host must be skipped quickly and a sweep must finish by its deadline with partial results.
+"""
+
+import random
+import threading
+
+import requests
+
+import resilient_fetch as rf
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, content=b"<html></html>", content_type="text/html"):
+        self.status_code = status_code
+        self.content = content
+        self.headers = {"Content-Type": content_type}
+
+
+class FakeSession:
+    """Fails hosts listed in 'down' like the TLS errors in 'runtime error.txt', each failure costing 'cost' seconds."""
+
+    def __init__(self, clock, down=(), cost=20.0):
+        self.clock = clock
+        self.down = down
+        self.cost = cost
+        self.requests = []
+
+    def get(self, url, timeout):
+        self.requests.append(url)
+        if any(host in url for host in self.down):
+            self.clock.sleep(min(self.cost, timeout[1]))
+            raise requests.exceptions.SSLError("TLSV1_ALERT_INTERNAL_ERROR")
+        self.clock.sleep(0.5)
+        return FakeResponse()
+
+
+def test_breaker_skips_failing_host_and_keeps_others():
+    clock = FakeClock()
+    session = FakeSession(clock, down=["water.weather.gov"])
+    urls = [f"https://water.weather.gov/ahps2/river.php?pt[]={n}" for n in range(50)] + ["https://example.com/ok"]
+    breakers = {}
+
+    def handle(url, sweep):
+        host = rf.urlparse(url).netloc
+        breaker = breakers.setdefault(host, rf.CircuitBreaker(clock=clock))
+        return rf.fetch(url, sweep, session=session, breaker=breaker, sleeper=clock.sleep, rng=random.Random(1))
+
+    results = rf.run_sweep(urls, handle, seconds=600, clock=clock)
+    assert len(results) == len(urls)
+    assert results["https://example.com/ok"] == b"<html></html>"
+    # only the first guage paid for retries, the other 49 were skipped by the open breaker
+    assert len(session.requests) == rf.FAILURE_THRESHOLD + 1
+    assert clock.now < 3 * rf.READ_TIMEOUT + 2 * rf.BACKOFF_BASE * 2 + 1
+
+
+def test_sweep_deadline_returns_partial_results():
+    clock = FakeClock()
+    session = FakeSession(clock, down=["slow.example"], cost=20.0)
+
+    def handle(url, sweep):
+        # a fresh breaker per url so only the deadline can stop the sweep
+        breaker = rf.CircuitBreaker(threshold=99, clock=clock)
+        return rf.fetch(url, sweep, session=session, breaker=breaker, sleeper=clock.sleep, rng=random.Random(1))
+
+    urls = [f"https://slow.example/{n}" for n in range(20)]
+    results = rf.run_sweep(urls, handle, seconds=100, clock=clock)
+    assert 0 < len(results) < len(urls)
+    assert clock.now <= 100 + 0.1
+
+
+def test_breaker_half_opens_after_reset():
+    clock = FakeClock()
+    breaker = rf.CircuitBreaker(threshold=2, reset_after=60, clock=clock)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    clock.sleep(60)
+    assert breaker.state == "half-open"
+    assert breaker.allow()  # the trial request
+    assert not breaker.allow()  # no other request while it is in flight
+    breaker.record_failure()  # the trial request failed
+    assert breaker.state == "open"
+    clock.sleep(60)
+    assert breaker.allow() and not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow() and breaker.allow()
+
+
+def test_one_breaker_per_host_across_threads(monkeypatch):
+    monkeypatch.setattr(rf, "BREAKERS", {})
+    barrier = threading.Barrier(8)
+    found = []
+
+    def lookup():
+        barrier.wait()
+        found.append(rf.breaker_for("https://water.weather.gov/ahps2/hydrograph.php?gage=mklk2"))
+
+    threads = [threading.Thread(target=lookup) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len({id(breaker) for breaker in found}) == 1
+
+
+def test_backoff_is_jittered_and_capped():
+    rng = random.Random(7)
+    delays = [rf.backoff_delay(attempt, rng=rng) for attempt in range(12)]
+    assert all(0 <= delay <= rf.BACKOFF_CAP for delay in delays)
+    assert len(set(delays)) == len(delays)
+
+
+def test_page_cache_serves_recent_pages_only():
+    clock = FakeClock()
+    session = FakeSession(clock)
+    cache = rf.PageCache(ttl=60, entries=2, clock=clock)
+    breaker = rf.CircuitBreaker(clock=clock)
+
+    def get(url):
+        return rf.fetch(url, session=session, breaker=breaker, sleeper=clock.sleep, cache=cache)
+
+    assert get("https://a.example/") == get("https://a.example/") == b"<html></html>"
+    assert len(session.requests) == 1
+    clock.sleep(60)
+    get("https://a.example/")
+    get("https://b.example/")
+    get("https://c.example/")  # drops a, the least recently used
+    get("https://a.example/")
+    assert len(session.requests) == 5
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Rivers and guages come from the config file, adding one needs no code.
+"""
+
+import copy
+import json
+
+import pytest
+
+import river_config as rc
+
+
+def test_default_config_describes_the_ohio_guages():
+    points = rc.monitoring_points()
+    assert list(points) == ["McAlpine", "Markland"]
+    assert points["Markland"]["Dam_URL"] == "https://water.weather.gov/ahps2/hydrograph.php?wfo=iln&gage=mklk2"
+    assert [points["McAlpine"][label] for label in rc.ACTION_LABELS] == [21, 23, 30, 38]
+    urls = rc.river_point_urls()
+    assert len(urls) == 52  # the Sabine is listed but not enabled
+    assert urls[0] == (
+        "https://water.weather.gov//ahps2/river.php?wfo=lmk&wfoid=18699&riverid=204624"
+        "&pt[]=141893&allpoints=150960&data[]=obs&data[]=xml"
+    )
+    assert rc.point_of_interest()["milemarker"] == 584
+
+
+def test_a_river_is_added_by_configuration(tmp_path, monkeypatch):
+    config = copy.deepcopy(rc.load())
+    sabine = next(river for river in config["rivers"] if river["name"] == "Sabine")
+    sabine["enabled"] = True
+    sabine["guages"] = [
+        {"name": "Logansport", "lid": "lgpl1", "wfo": "shv", "friendly_name": "Sabine River at Logansport",
+         "milemarker": 0, "guage_elevation": 150, "action_levels": dict(zip(rc.ACTION_LABELS, [24, 26, 31, 36]))}
+    ]
+    path = tmp_path / "rivers.json"
+    path.write_text(json.dumps(config))
+    monkeypatch.setenv(rc.CONFIG_ENV_VAR, str(path))
+    assert len(rc.river_point_urls()) == 52 + 11
+    assert "riverid=203413&pt[]=143204&allpoints=143204,147710" in rc.river_point_urls()[52]
+    assert rc.monitoring_points()["Logansport"]["river"] == "Sabine"
+    del sabine["guages"][0]["lid"]
+    with pytest.raises(ValueError, match="lid"):
+        rc.validate(config)
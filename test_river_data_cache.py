@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Callers of the river data share one scrape per NWS update.
+"""
+
+import threading
+import time
+
+from river_data_cache import RiverDataCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class CountingLoader:
+    def __init__(self, delay=0.0, results=None):
+        self.calls = 0
+        self.delay = delay
+        self.results = results
+
+    def __call__(self):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.results is not None:
+            return self.results.pop(0)
+        return {"scrape": self.calls}
+
+
+def test_fresh_data_is_reused_and_age_reported():
+    clock = FakeClock()
+    loader = CountingLoader()
+    cache = RiverDataCache(loader, ttl=3600, clock=clock)
+    assert cache.age() is None
+    assert cache.get() == {"scrape": 1}
+    clock.now = 1800
+    assert cache.get() == {"scrape": 1}
+    assert cache.age() == 1800
+    assert loader.calls == 1
+
+
+def test_concurrent_callers_share_one_scrape():
+    loader = CountingLoader(delay=0.2)
+    cache = RiverDataCache(loader)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get())) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert loader.calls == 1
+    assert results == [{"scrape": 1}] * 10
+
+
+def test_stale_data_served_while_refreshing():
+    clock = FakeClock()
+    loader = CountingLoader(delay=0.2)
+    cache = RiverDataCache(loader, ttl=3600, stale_for=3600, clock=clock)
+    cache.get()
+    clock.now = 4000
+    start = time.perf_counter()
+    assert cache.get() == {"scrape": 1}  # returned at once, the refresh runs in the background
+    assert time.perf_counter() - start < 0.1
+    assert cache.wait_for_refresh(timeout=5)
+    assert cache.get() == {"scrape": 2}
+    assert cache.wait_for_refresh(timeout=0)  # nothing in flight
+
+
+def test_failed_scrape_keeps_good_data():
+    clock = FakeClock()
+    cache = RiverDataCache(CountingLoader(results=[{"good": 1}, [], {"good": 2}]), ttl=10, stale_for=100, clock=clock)
+    assert cache.get() == {"good": 1}
+    clock.now = 20
+    cache.refresher = lambda task: task()
+    assert cache.get() == {"good": 1}  # stale, its refresh failed
+    assert cache.age() == 20
+    assert cache.get() == {"good": 1}  # still stale, this refresh works
+    assert cache.get() == {"good": 2}
+
+
+def test_failed_refresh_past_the_stale_window_returns_nothing():
+    clock = FakeClock()
+    cache = RiverDataCache(CountingLoader(results=[{"good": 1}, []]), ttl=3600, stale_for=0, clock=clock)
+    assert cache.get() == {"good": 1}
+    clock.now = 10 * 3600
+    assert cache.get() == []  # not the levels of 10 hours ago
+    assert cache.age() == 10 * 3600  # kept, a failed scrape does not replace it
+
+
+def test_bot_cache_waits_for_new_data_past_the_ttl():
+    import Sunset_Village_TwitterBot as bot
+
+    clock = FakeClock()
+    cache = bot.level_data_cache(CountingLoader(), clock=clock)
+    assert cache.get() == {"scrape": 1}
+    clock.now = bot.TWEET_FREQUENCY[0]  # the next tweet of a quiet river
+    assert cache.get() == {"scrape": 2}
+
+
+def test_refresher_runs_the_refresh_of_stale_data():
+    clock = FakeClock()
+    loader = CountingLoader()
+    tasks = []
+    cache = RiverDataCache(loader, ttl=3600, stale_for=3600, clock=clock, refresher=tasks.append)
+    cache.get()
+    clock.now = 4000
+    assert cache.get() == {"scrape": 1}
+    assert loader.calls == 1 and len(tasks) == 1
+    tasks.pop()()
+    assert cache.get() == {"scrape": 2}
+    clock.now = 8000
+    cache.refresher = lambda task: task()  # synchronous: the stale copy is returned, the new one is cached
+    assert cache.get() == {"scrape": 2}
+    assert cache.age() == 0 and cache.get() == {"scrape": 3}
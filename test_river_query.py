@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" river_query answers history questions from the guage archive indexes.
+"""
+
+import io
+import json
+
+import guage_archive as ga
+import river_query as rq
+import rollups
+
+
+def row(kind, stamp, level, guage="mklk2"):
+    return {"guage": guage, "type": kind, "datetime": f"2022-03-{stamp}:00UTC", "level": level, "flow": "-999kcfs"}
+
+
+def build_archive(root):
+    archive = ga.GuageArchive(root)
+    first = [row("Observed", "01_12:00", "20.0ft"), row("Observed", "01_18:00", "21.5ft"), row("Forecast", "03_12:00", "23.0ft")]
+    second = [row("Observed", "02_06:00", "22.0ft"), row("Forecast", "03_12:00", "24.0ft"), row("Forecast", "04_12:00", "23.5ft")]
+    other = [row("Observed", "02_06:00", "11.0ft", guage="mluk2")]
+    for scrape, readings in (("2022-03-01_19:00:00UTC", first), ("2022-03-02_07:00:00UTC", second + other)):
+        archive.record_scrape_readings(readings, ga.epoch_minute(scrape))
+        archive.append_readings(readings)
+        rollups.RollupStore(archive).update_readings(readings)
+    return archive
+
+
+def test_queries(tmp_path):
+    build_archive(tmp_path)
+    start = rq.parse_time("2022-03-02")
+    assert [(r["datetime"], r["level"]) for r in rq.run_query("rows", ["MKLK2"], "Observed", start, None, tmp_path)] == [
+        ("2022-03-02_06:00:00UTC", 22.0)
+    ]
+    daily = rq.run_query("daily-max", ["mklk2"], "Observed", archive_root=tmp_path)
+    assert [(r["date"], r["max_level"]) for r in daily] == [("2022-03-01", 21.5), ("2022-03-02", 22.0)]
+    latest = rq.run_query("latest", archive_root=tmp_path)
+    assert [(r["guage"], r["level"]) for r in latest] == [("mklk2", 22.0), ("mluk2", 11.0)]
+    assert rq.run_query("latest", ["mklk2"], end=start, archive_root=tmp_path)[0]["level"] == 21.5
+    forecasts = rq.run_query("highest-forecast", ["mklk2"], archive_root=tmp_path)
+    assert [(r["scrape_time"], r["forecast_datetime"], r["max_forecast_level"]) for r in forecasts] == [
+        ("2022-03-01_19:00:00UTC", "2022-03-03_12:00:00UTC", 23.0),
+        ("2022-03-02_07:00:00UTC", "2022-03-03_12:00:00UTC", 24.0),
+    ]
+
+
+def test_output_formats(tmp_path):
+    build_archive(tmp_path)
+    results = rq.run_query("latest", ["mluk2"], archive_root=tmp_path)
+    stream = io.StringIO()
+    rq.write_output(results, "csv", stream)
+    assert stream.getvalue().splitlines() == ["guage,type,datetime,level,flow", "mluk2,Observed,2022-03-02_06:00:00UTC,11.0,"]
+    stream = io.StringIO()
+    rq.write_output(results, "json", stream)
+    assert json.loads(stream.getvalue())[0]["flow"] is None
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Rollup tiers follow each appended scrape and answer queries from the coarsest tier that fits.
+"""
+
+import numpy as np
+
+import guage_archive as ga
+import rollups
+
+HOUR = 60
+DAY = 24 * HOUR
+
+
+def scrape(archive, store, rows):
+    records = np.array(rows, dtype=ga.RECORD)
+    archive.append("mklk2", records)
+    store.update("mklk2", records)
+
+
+def test_incremental_updates_match_a_rebuild(tmp_path):
+    archive = ga.GuageArchive(tmp_path)
+    store = rollups.RollupStore(archive)
+    start = ga.epoch_minute("2022-01-31_22:00:00UTC")
+    rng = np.random.default_rng(7)
+    for hour in range(60):  # hourly scrapes across a month boundary, each with a forecast revision
+        minute = start + hour * HOUR
+        scrape(archive, store, [(minute, 20 + rng.random(), np.nan, 0), (minute + 2 * DAY, 25 + rng.random(), np.nan, 1)])
+    scrape(archive, store, [(start + 30, np.nan, np.nan, 0)])  # late and without a level
+    incremental = {tier: np.array(store.read("mklk2", tier)) for tier in rollups.TIERS}
+    store.rebuild("mklk2")
+    for tier in rollups.TIERS:
+        rebuilt = store.read("mklk2", tier)
+        assert rebuilt.tolist() == incremental[tier].tolist()
+    monthly = store.range("mklk2", "monthly", kind="Observed")
+    assert monthly["count"].sum() == 60
+    assert [int(bucket) for bucket in monthly["bucket"]] == [
+        ga.epoch_minute("2022-01-01_00:00:00UTC"), ga.epoch_minute("2022-02-01_00:00:00UTC")
+    ]
+    raw = archive.read_range("mklk2", kind="Observed")
+    levels = raw["level"][~np.isnan(raw["level"])]
+    assert np.isclose(monthly["sum"].sum(), levels.sum())
+    assert np.isclose(monthly["max"].max(), levels.max())
+    assert monthly["last"][-1] == levels[-1]
+
+
+def test_series_picks_the_coarsest_tier(tmp_path):
+    store = rollups.RollupStore(ga.GuageArchive(tmp_path))
+    day = ga.epoch_minute("2022-03-01_00:00:00UTC")
+    assert store.choose_tier(day, day + 7 * DAY, "day") == "daily"
+    assert store.choose_tier(day, day + 7 * DAY, 7 * DAY) == "daily"
+    assert store.choose_tier(day + HOUR, day + 7 * DAY, "day") == "hourly"
+    assert store.choose_tier(day + 30, None, 6 * HOUR) == "raw"
+    assert store.choose_tier(every="month") == "monthly"
+    assert store.choose_tier(ga.epoch_minute("2022-01-01_00:00:00UTC"), day, "month") == "monthly"
+    assert store.choose_tier(ga.epoch_minute("2022-01-05_00:00:00UTC"), day, "month") == "daily"
+    archive = store.archive
+    scrape(archive, store, [(day + 30, 20.0, np.nan, 0), (day + 90, 22.0, np.nan, 0), (day + DAY + 30, 21.0, np.nan, 0)])
+    daily = store.series("mklk2", day, day + 2 * DAY, "Observed", "day")
+    assert daily[["count", "min", "max", "last"]].tolist() == [(2, 20.0, 22.0, 22.0), (1, 21.0, 21.0, 21.0)]
+    np.testing.assert_allclose(rollups.mean(daily), [21.0, 21.0])
+    # not aligned to an hour: answered from the raw readings
+    partial = store.series("mklk2", day + 60, None, "Observed", "day")
+    assert partial["count"].tolist() == [1, 1]
+
+
+def test_monthly_series_keeps_to_a_range_within_months(tmp_path):
+    store = rollups.RollupStore(ga.GuageArchive(tmp_path))
+    january, february = ga.epoch_minute("2022-01-10_12:00:00UTC"), ga.epoch_minute("2022-02-10_12:00:00UTC")
+    scrape(store.archive, store, [(january, 20.0, np.nan, 0), (february, 25.0, np.nan, 0)])
+    start, end = ga.epoch_minute("2022-01-05_00:00:00UTC"), ga.epoch_minute("2022-02-05_00:00:00UTC")
+    months = store.series("mklk2", start, end, "Observed", "month")
+    assert months[["bucket", "count", "max"]].tolist() == [(ga.epoch_minute("2022-01-01_00:00:00UTC"), 1, 20.0)]
+    # on month boundaries the monthly tier answers
+    whole = store.series("mklk2", ga.epoch_minute("2022-01-01_00:00:00UTC"), ga.epoch_minute("2022-03-01_00:00:00UTC"),
+                         "Observed", "month")
+    assert whole["max"].tolist() == [20.0, 25.0]
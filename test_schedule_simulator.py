@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" The tweet schedule replays on a simulated clock, a day of recorded levels in seconds.
+"""
+
+import shutil
+import time
+from datetime import datetime
+
+import schedule_simulator as ss
+from memory_harness import RECORDED_WEEK
+
+
+def recorded_day(tmp_path):
+    pages = tmp_path / "pages"
+    pages.mkdir()
+    for page in RECORDED_WEEK.glob("*_20220301_*.html"):
+        shutil.copy(page, pages)
+    return pages
+
+
+def test_replay_tweets_on_schedule_without_sleeping(tmp_path):
+    started = time.monotonic()
+    timeline = ss.simulate(recorded_day(tmp_path), folder=tmp_path)
+    assert time.monotonic() - started < 60
+    tweets = [event for event in timeline if event["event"] == "tweet"]
+    # the 06:00 start counts as the last tweet, levels below concern tweet every 18000 s (5 hours)
+    assert [event["time"] for event in tweets] == ["2022-03-01 11:00:40", "2022-03-01 16:01:20", "2022-03-01 21:02:00"]
+    assert "Calculated Level at Bushmans" in tweets[0]["text"]
+    assert ss.summary(timeline)["tweets"] == 3
+
+
+def test_scheduling_change_is_evaluated(tmp_path):
+    timeline = ss.simulate(recorded_day(tmp_path), until=datetime(2022, 3, 1, 18), frequency=[3600], folder=tmp_path)
+    assert ss.summary(timeline)["tweets"] == 11
+    assert ss.summary(timeline)["longest_gap_hours"] < 1.1
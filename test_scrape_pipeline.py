@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" The scrape stages run on recorded pages and the queues between them stay bounded.
+"""
+
+import threading
+import time
+from functools import partial
+from pathlib import Path
+
+import pytest
+
+import change_ingest as ci
+import OHIO_RIVER_LEVEL_SCRAPING as scraper
+import scrape_pipeline as pl
+
+PAGES = sorted(Path(__file__).parent.joinpath("test_fixtures").glob("*.rawhtml"))
+
+
+def test_bounded_queues_throttle_the_producer():
+    produced = []
+    in_flight = []
+
+    def source():
+        for i in range(50):
+            produced.append(i)
+            yield i
+
+    def slow(items):
+        for item in items:
+            time.sleep(0.002)
+            yield item
+
+    for consumed, item in enumerate(pl.pipeline(source(), slow, slow, queue_size=2), start=1):
+        in_flight.append(len(produced) - consumed)
+    assert consumed == 50
+    # two queues of two plus one item held by each stage thread
+    assert max(in_flight) <= 2 * 2 + 3
+
+
+def test_stage_errors_reach_the_consumer_and_stop_the_threads():
+    def broken(items):
+        for item in items:
+            if item == 3:
+                raise ValueError("bad page")
+            yield item
+
+    with pytest.raises(ValueError):
+        list(pl.pipeline(range(10), broken, queue_size=2))
+    list(pl.pipeline(range(100), lambda items: items, queue_size=1))
+    time.sleep(3 * pl.PUT_POLL)
+    assert not [thread for thread in threading.enumerate() if thread.name.startswith("pipeline-")]
+
+
+def test_recorded_pages_through_every_stage(tmp_path):
+    assert PAGES
+    pages = {str(page): page.read_text() for page in PAGES}
+    stamps = iter(range(1000))
+    results = {}
+    for queue_size in (0, pl.QUEUE_SIZE):
+        stored = []
+        stages = [
+            partial(pl.fetch_stage, fetch=lambda point, sweep: pages.get(point), now=lambda: f"scrape{next(stamps)}"),
+            partial(pl.parse_stage, parse=scraper.parse_guage_page),
+            pl.normalize_stage,
+            partial(pl.dedupe_stage, ingest=partial(ci.ingest, state_root=tmp_path / str(queue_size))),
+            partial(pl.sink_stage, sinks=[stored.append]),
+        ]
+        items = list(pl.pipeline(list(pages) + ["missing"], *stages, queue_size=queue_size))
+        assert [item["point"] for item in items] == list(pages) + ["missing"]
+        assert items[-1]["readings"] is None and items[-1]["changes"] == []
+        assert all("raw_html" not in item for item in items)
+        assert len(stored) == len(pages)
+        results[queue_size] = [(item["guage"], item["readings"], len(item["changes"])) for item in stored]
+        assert all(changes == len(readings) for _guage, readings, changes in results[queue_size])
+    assert results[0] == results[pl.QUEUE_SIZE]
+    assert pl.bench([pages[str(PAGES[0])]])["parse"] > 0
+
+
+def test_concurrent_fetches_keep_the_order_of_the_points():
+    in_flight = []
+    active = [0]
+    lock = threading.Lock()
+
+    def fetch(point, sweep):
+        with lock:
+            active[0] += 1
+            in_flight.append(active[0])
+        time.sleep(0.01 * (point % 3))
+        with lock:
+            active[0] -= 1
+        return f"page {point}"
+
+    stamps = iter(range(1000))
+    items = list(pl.fetch_stage(range(20), fetch=fetch, now=lambda: next(stamps), workers=4))
+    assert [item["raw_html"] for item in items] == [f"page {point}" for point in range(20)]
+    assert 1 < max(in_flight) <= 4
+
+
+def test_state_is_committed_only_when_every_sink_stored_the_changes():
+    committed = []
+    items = [{"point": "a", "readings": [], "ingest_state": "a"}, {"point": "b", "readings": [], "ingest_state": "b"}]
+    sinks = [lambda item: True, lambda item: item["point"] == "a"]
+    list(pl.sink_stage(iter(items), sinks=sinks, commit=committed.append))
+    assert committed == ["a"]
+
+
+def test_guages_scraped_in_the_same_second_get_their_own_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(scraper, "OUTPUT_ROOT", f"{tmp_path}/")
+    monkeypatch.setattr(scraper, "archive_readings", lambda *args: None)
+    monkeypatch.setattr(scraper, "publish_latest", lambda *args: None)
+    items = list(pl.fetch_stage(["a", "b"], fetch=lambda point, sweep: point, now=lambda: "2022-03-05_14:22:10UTC"))
+    for item, guage in zip(items, ["mklk2", "mluk2"]):
+        row = {"guage": guage, "type": "Observed", "datetime": "2022-03-05_14:00:00UTC", "level": "20ft", "flow": "-999kcfs"}
+        item.update(guage=guage, readings=[row], changes=[row])
+        assert scraper.store_scrape(item) is True
+    names = sorted(fl.name for fl in tmp_path.rglob("*") if fl.is_file())
+    assert names == ["20220305_142210UTC_mklk2", "20220305_142210UTC_mluk2"]
+
+
+def test_changes_are_archived_only_once_stored(tmp_path, monkeypatch):
+    archived = []
+    monkeypatch.setattr(scraper, "OUTPUT_ROOT", f"{tmp_path}/")
+    monkeypatch.setattr(scraper, "archive_readings", lambda changes, *args: archived.append(changes))
+    monkeypatch.setattr(scraper, "publish_latest", lambda *args: None)
+    row = {"guage": "mklk2", "type": "Observed", "datetime": "2022-03-05_14:00:00UTC", "level": "20ft", "flow": "-999kcfs"}
+    item = {"guage": "mklk2", "scrape_time": "2022-03-05_14:22:10UTC", "readings": [row], "changes": [row]}
+    monkeypatch.setattr(scraper, "write_changes", lambda *args: False)
+    assert scraper.store_scrape(item) is False
+    assert archived == []
+    monkeypatch.setattr(scraper, "write_changes", lambda *args: True)
+    assert scraper.store_scrape(item) is True
+    assert archived == [[row]]
@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Entry points must import quickly and without loading heavy dependencies or reading .env
+"""
+
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+import startup_benchmark as sb
+
+
+@pytest.mark.parametrize("module", sb.ENTRY_POINTS)
+def test_entry_point_imports_within_budget(module):
+    result = sb.best_of(module)
+    assert result["heavy"] == []
+    assert result["seconds"] < sb.IMPORT_BUDGET_SECONDS
+
+
+def test_bot_import_does_not_need_credentials(tmp_path):
+    # a fresh interpreter in a directory without a .env file
+    assert not (tmp_path / ".env").exists()
+    check = "import sys, Sunset_Village_TwitterBot; print('dotenv' in sys.modules)"
+    env = dict(os.environ, PYTHONPATH=str(Path(__file__).parent))
+    result = subprocess.run([sys.executable, "-c", check], cwd=tmp_path, env=env, capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "False"
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" The rolling fit must agree with a full least squares fit of its window while costing O(1) per reading.
+"""
+
+import random
+import time
+
+import numpy as np
+
+import trend_engine as te
+
+
+def test_rolling_fit_matches_least_squares_of_the_window():
+    fit = te.RollingFit(window=12)
+    rng = random.Random(1)
+    start = te.hours("2022-03-01T00:00")
+    for i in range(1000):  # long enough to rebase the running sums several times
+        hour = start + i * 0.75
+        fit.add(hour, 20 + 0.2 * i * 0.75 - 0.004 * (i % 40) ** 2 + rng.uniform(-0.05, 0.05))
+    hours, levels = np.array(fit.readings).T
+    assert hours[-1] - hours[0] <= 12
+    assert abs(fit.rate() - np.polyfit(hours - hours[0], levels, 1)[0]) < 1e-9
+    assert abs(fit.acceleration() - 2 * np.polyfit(hours - hours[0], levels, 2)[0]) < 1e-7
+
+
+def test_trend_of_a_place_and_its_forecast_fallback():
+    engine = te.TrendEngine()
+    assert engine.trend("Bushman's Lake") is None
+    assert engine.describe("Bushman's Lake") == "Flat"
+    engine.add("Bushman's Lake", "2022-03-01T06:00", 23.0)
+    engine.add("Bushman's Lake", "2022-03-01T18:00", 29.0, te.FORECAST)
+    assert engine.trend("Bushman's Lake").rate == 0.5  # latest observation to latest forecast
+    assert not engine.add("Bushman's Lake", "2022-03-01T06:00", 23.0)  # the same reading again
+    engine.add("Bushman's Lake", "2022-03-01T07:00", 22.9)
+    engine.add("Bushman's Lake", "2022-03-01T08:00", 22.6)
+    trend = engine.trend("Bushman's Lake")
+    assert (trend.count, trend.level) == (3, 22.6)
+    assert abs(trend.rate + 0.2) < 1e-9
+    assert abs(trend.acceleration + 0.2) < 1e-9
+    assert engine.describe("Bushman's Lake") == "Falling 0.20ft/hr"
+
+
+def test_local_readings_and_epoch_readings_share_one_clock(monkeypatch):
+    monkeypatch.setenv("TZ", "UTC")  # the host's timezone is not the river's
+    time.tzset()
+    try:
+        noon_utc = 1_646_136_000  # 2022-03-01 12:00 UTC, 07:00 EST
+        assert te.hours("2022-03-01T07:00") == te.hours(noon_utc) == 457260.0
+        engine = te.TrendEngine()
+        engine.add("McAlpine", "2022-03-01T07:00", 20.0)  # from a tweet cycle
+        assert engine.add("McAlpine", noon_utc + 3600, 20.5)  # from the snapshot an hour later, not rejected as older
+        assert engine.trend("McAlpine").rate == 0.5
+    finally:
+        monkeypatch.undo()
+        time.tzset()
+
+
+def test_fast_rise_raises_the_tweet_priority():
+    import Sunset_Village_TwitterBot as bot
+
+    assert bot.QuantifyFlooding(29.0, 30) == 0
+    assert bot.QuantifyFlooding(29.0, 30, rate=-1.0) == 0
+    assert bot.QuantifyFlooding(29.0, 30, rate=0.5) == 2  # 32 ft within RISE_LOOKAHEAD_HOURS
+    assert bot.QuantifyFlooding(35.0, 30, 0.5) == len(bot.TWEET_FREQUENCY) - 1  # 38 ft, past the last priority
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Queued tweets must survive a restart, wait out rate limits and never be posted twice.
+"""
+
+import queue as stdlib_queue
+import random
+import threading
+import time
+
+from twython import TwythonError, TwythonRateLimitError
+
+import Sunset_Village_TwitterBot as bot
+import tweet_queue as tq
+
+
+class FakeClock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class FakeTwitter:
+    """Posts statuses, failing with the queued errors first. 'headers' answers get_lastfunction_header."""
+
+    def __init__(self, errors=(), headers=None):
+        self.errors = list(errors)
+        self.headers = headers or {}
+        self.posted = []
+
+    def update_status(self, status):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.posted.append(status)
+        return {"text": status}
+
+    def get_lastfunction_header(self, header):
+        return self.headers.get(header)
+
+
+def new_queue(tmp_path, clock):
+    return tq.TweetQueue(tmp_path / tq.QUEUE_FILE, clock=clock, rng=random.Random(1))
+
+
+def test_queue_survives_restart_and_dedupes(tmp_path):
+    clock = FakeClock()
+    queue = new_queue(tmp_path, clock)
+    assert queue.enqueue("River at 30ft", "t1")
+    assert not queue.enqueue("River at 30ft", "t2")
+    assert queue.enqueue("River at 31ft", "t3")
+
+    restarted = new_queue(tmp_path, clock)
+    sent = []
+    twitter = FakeTwitter()
+    assert restarted.drain(twitter, sent.append) is None
+    assert twitter.posted == ["River at 30ft", "River at 31ft"]
+    assert [entry["time"] for entry in sent] == ["t1", "t3"]
+    assert len(new_queue(tmp_path, clock)) == 0
+
+
+def test_rate_limit_holds_queue_until_reset(tmp_path):
+    clock = FakeClock()
+    queue = new_queue(tmp_path, clock)
+    queue.enqueue("one")
+    reset = str(int(clock.now) + 900)
+    twitter = FakeTwitter(errors=[TwythonRateLimitError("Too Many Requests", 429, retry_after=reset)])
+    assert queue.send_due(twitter) == 900
+    assert twitter.posted == []
+    clock.now += 900
+    assert queue.send_due(twitter) is None
+    assert twitter.posted == ["one"]
+
+
+def test_exhausted_rate_limit_header_delays_next_tweet(tmp_path):
+    clock = FakeClock()
+    queue = new_queue(tmp_path, clock)
+    queue.enqueue("one")
+    queue.enqueue("two")
+    twitter = FakeTwitter(headers={"x-rate-limit-remaining": "0", "x-rate-limit-reset": str(int(clock.now) + 60)})
+    assert queue.drain(twitter) == 60
+    assert twitter.posted == ["one"]
+
+
+def test_errors_are_retried_with_backoff_then_refusals_dropped(tmp_path):
+    clock = FakeClock()
+    queue = new_queue(tmp_path, clock)
+    queue.enqueue("one")
+    twitter = FakeTwitter(errors=[TwythonError("Service Unavailable", 503)])
+    wait = queue.send_due(twitter)
+    assert 0 < wait <= tq.RETRY_CAP
+    clock.now += wait
+    assert queue.send_due(twitter) is None
+    assert twitter.posted == ["one"]
+
+    queue.enqueue("duplicate status")
+    twitter.errors = [TwythonError("Status is a duplicate.", 403)]
+    assert queue.send_due(twitter) is None
+    assert [entry["status"] for entry in new_queue(tmp_path, clock).failed] == ["duplicate status"]
+
+
+def test_failed_list_keeps_the_latest(tmp_path, monkeypatch):
+    monkeypatch.setattr(tq, "MAX_FAILED", 2)
+    queue = new_queue(tmp_path, FakeClock())
+    for number in range(4):
+        queue.enqueue(f"refused {number}")
+    twitter = FakeTwitter(errors=[TwythonError("Forbidden", 403) for _ in range(4)])
+    assert queue.drain(twitter) is None
+    assert [entry["status"] for entry in new_queue(tmp_path, FakeClock()).failed] == ["refused 2", "refused 3"]
+
+
+class ThreadRecordingDB:
+    """Stands in for PupDB and notes the thread of every write."""
+
+    def __init__(self):
+        self.writers = []
+
+    def set(self, key, value):
+        self.writers.append(threading.get_ident())
+
+    def keys(self):
+        return []
+
+
+def test_sent_tweets_are_recorded_by_the_main_loop(tmp_path, monkeypatch):
+    monkeypatch.setattr(bot, "SENT_TWEETS", stdlib_queue.Queue())
+    queue = tq.TweetQueue(tmp_path / tq.QUEUE_FILE)
+    queue.enqueue("River at 30ft", "t1")
+    sender = tq.TweetSender(queue, FakeTwitter(), bot.SENT_TWEETS.put).start()
+    deadline = time.monotonic() + 5
+    while bot.SENT_TWEETS.empty() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    sender.stop()
+    db = ThreadRecordingDB()
+    assert bot.record_sent_tweets(db) == 1
+    assert db.writers == [threading.get_ident()]
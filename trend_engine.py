@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""Rate of rise (ft/hr) and acceleration (ft/hr/hr) of every guage and of the point of interest.
+Each series keeps the readings of the last WINDOW_HOURS and fits a least squares line (the rate)
+and parabola (twice its t^2 term is the acceleration) through them. The fits come from running
+sums of t^k and t^k * level that are added to as a reading enters the window and subtracted from
+as one leaves, so a new reading costs O(1) whatever the window holds. The sums are rebuilt from the
+window once every REBASE_WINDOWS windows around a new time origin, which keeps t^4 small and drops
+the rounding the subtractions accumulate.
+
+Observations and forecasts are kept as separate series. Until a place has two observations its
+rate is the one from its latest observation to its latest forecast (what DetermineTrend compared).
+The bot adds readings from its main loop and from the flood alert thread, TrendEngine takes a lock.
+"""
+import threading
+from collections import deque, namedtuple
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+from NWS_River_Data_scrape_NEW import LOCAL_TIMEZONE
+
+WINDOW_HOURS = 12
+REBASE_WINDOWS = 4
+FLAT_RATE = 0.02  # ft/hr, slower changes are reported as flat
+OBSERVED = "observed"
+FORECAST = "forecast"
+
+Trend = namedtuple("Trend", "rate acceleration level count")
+
+
+def hours(when):
+    """Hours since the epoch of a datetime, an ISO date string or epoch seconds.
+    Naive datetimes are NWS local time (the bot's readings), not the host's: the snapshot readings
+    of the flood alerts arrive as epoch seconds and both must land on the same hour.
+    """
+    if isinstance(when, str):
+        when = datetime.fromisoformat(when)
+    if isinstance(when, datetime):
+        if when.tzinfo is None:
+            when = when.replace(tzinfo=ZoneInfo(LOCAL_TIMEZONE))
+        return when.timestamp() / 3600
+    return when / 3600
+
+
+class RollingFit:
+    """Least squares line and parabola through the readings of the last 'window' hours."""
+
+    def __init__(self, window=WINDOW_HOURS):
+        self.window = window
+        self.readings = deque()  # (hour, level), oldest first
+        self.origin = None
+        self.sums = [0.0] * 8  # n, t, t^2, t^3, t^4, y, t*y, t^2*y with t in hours after origin
+
+    def _apply(self, hour, level, sign):
+        t = hour - self.origin
+        t2 = t * t
+        for i, term in enumerate((1.0, t, t2, t2 * t, t2 * t2, level, t * level, t2 * level)):
+            self.sums[i] += sign * term
+
+    def _rebase(self, origin):
+        self.origin = origin
+        self.sums = [0.0] * 8
+        for hour, level in self.readings:
+            self._apply(hour, level, 1)
+
+    def add(self, hour, level):
+        """Add a reading. Returns False (and ignores it) when it is not newer than the latest one."""
+        if self.readings and hour <= self.readings[-1][0]:
+            return False
+        while self.readings and self.readings[0][0] < hour - self.window:
+            self._apply(*self.readings.popleft(), -1)
+        if self.origin is None or hour - self.origin > REBASE_WINDOWS * self.window:
+            self._rebase(self.readings[0][0] if self.readings else hour)
+        self.readings.append((hour, level))
+        self._apply(hour, level, 1)
+        return True
+
+    def rate(self):
+        """Slope of the least squares line in ft/hr, None with fewer than two readings."""
+        n, st, st2, _st3, _st4, sy, sty, _st2y = self.sums
+        spread = n * st2 - st * st
+        if len(self.readings) < 2 or spread <= 1e-9:
+            return None
+        return (n * sty - st * sy) / spread
+
+    def acceleration(self):
+        """Second derivative of the least squares parabola in ft/hr/hr, None with fewer than three readings."""
+        n, st, st2, st3, st4, sy, sty, st2y = self.sums
+        if len(self.readings) < 3:
+            return None
+        # Cramer's rule on the normal equations of level = a + b*t + c*t^2, solved for c
+        det = n * (st2 * st4 - st3 * st3) - st * (st * st4 - st3 * st2) + st2 * (st * st3 - st2 * st2)
+        if abs(det) <= 1e-9:
+            return None
+        det_c = n * (st2 * st2y - sty * st3) - st * (st * st2y - sty * st2) + sy * (st * st3 - st2 * st2)
+        return 2 * det_c / det
+
+    def latest(self):
+        return self.readings[-1] if self.readings else None
+
+
+class TrendEngine:
+    """One RollingFit per (place, observed or forecast)."""
+
+    def __init__(self, window=WINDOW_HOURS):
+        self.window = window
+        self.fits = {}
+        self._lock = threading.Lock()
+
+    def add(self, place, when, level, kind=OBSERVED):
+        with self._lock:
+            fit = self.fits.get((place, kind))
+            if fit is None:
+                fit = self.fits[(place, kind)] = RollingFit(self.window)
+            return fit.add(hours(when), float(level))
+
+    def trend(self, place):
+        """Trend of a place's observations, None before its first observation."""
+        with self._lock:
+            return self._trend(place)
+
+    def _trend(self, place):
+        observed = self.fits.get((place, OBSERVED))
+        if observed is None or not observed.readings:
+            return None
+        hour, level = observed.latest()
+        rate = observed.rate()
+        forecast = self.fits.get((place, FORECAST))
+        if rate is None and forecast is not None and forecast.readings:
+            forecast_hour, forecast_level = forecast.latest()
+            if forecast_hour > hour:
+                rate = (forecast_level - level) / (forecast_hour - hour)
+        return Trend(rate, observed.acceleration(), level, len(observed.readings))
+
+    def describe(self, place, flat=FLAT_RATE):
+        """'Rising 0.12ft/hr', 'Falling 0.05ft/hr' or 'Flat' ('Flat' too while nothing is known)."""
+        trend = self.trend(place)
+        if trend is None or trend.rate is None or abs(trend.rate) < flat:
+            return "Flat"
+        return f"{'Rising' if trend.rate > 0 else 'Falling'} {abs(trend.rate):.2f}ft/hr"
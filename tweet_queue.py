@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""Outbound tweets go through a persistent queue and a background sender.
+The main loop only enqueues a status and carries on. The sender thread posts the oldest one when
+Twitter allows it:
+
+- a status already waiting in the queue is not queued twice,
+- the queue is a small JSON file in STATE/ written with os.replace, tweets survive a restart,
+- a rate limited request (HTTP 420/429) holds the whole queue until the reset time Twitter sends
+  (x-rate-limit-reset), and so does an x-rate-limit-remaining of 0 after a successful post,
+- network and server errors are retried with jittered exponential backoff (see resilient_fetch.py),
+  statuses Twitter refuses outright (other 4xx) or that keep failing are moved to the 'failed' list
+  (the last MAX_FAILED of them),
+- only a status that actually went out is reported to on_sent (the bot records it in PupDB there).
+"""
+import json
+import os
+import random
+import threading
+import time
+
+from loguru import logger
+
+import metrics
+import resilient_fetch as rf
+import storage_paths as sp
+
+QUEUE_FILE = "tweet_queue.json"
+MAX_ATTEMPTS = 8  # failed posts of one status before it is given up
+MAX_FAILED = 100  # given up statuses kept in the file, the oldest are dropped
+RETRY_CAP = 60 * 60  # seconds, longest backoff between two attempts
+RATE_LIMIT_CODES = (420, 429)
+DEFAULT_RATE_LIMIT_WAIT = 15 * 60  # seconds, the Twitter rate limit window when no reset time is sent
+IDLE_WAIT = 60 * 60  # seconds the sender sleeps when the queue is empty (enqueue wakes it)
+
+TWEETS = metrics.counter("tweets_total", "Outbound tweets by outcome (queued, duplicate, sent, retry, rate_limited, failed).")
+
+
+def queue_path(state_root=sp.STATE_ROOT):
+    return sp.state_file(QUEUE_FILE, state_root)
+
+
+def _reset_time(value, now):
+    """Epoch seconds of a rate limit reset header (Twython passes x-rate-limit-reset through as text)."""
+    try:
+        reset = float(value)
+    except (TypeError, ValueError):
+        return now + DEFAULT_RATE_LIMIT_WAIT
+    return reset if reset > now else now + reset  # an epoch time, or a number of seconds
+
+
+class TweetQueue:
+    """The pending and failed statuses, persisted after every change."""
+
+    def __init__(self, path=None, clock=time.time, rng=random):
+        self.path = path or queue_path()
+        self.clock = clock
+        self.rng = rng
+        self._lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.pending = []
+        self.failed = []
+        self.blocked_until = 0.0
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as queue_file:
+                saved = json.load(queue_file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.error(f"Unreadable tweet queue {self.path}, starting empty: {e}")
+            return
+        self.pending = saved.get("pending", [])
+        self.failed = saved.get("failed", [])
+        self.blocked_until = saved.get("blocked_until", 0.0)
+        if self.pending:
+            logger.info(f"{len(self.pending)} tweets waiting from before the restart.")
+
+    def _save(self):
+        temporary = f"{self.path}.{os.getpid()}.tmp"
+        with open(temporary, "w") as queue_file:
+            json.dump({"pending": self.pending, "failed": self.failed, "blocked_until": self.blocked_until}, queue_file)
+        os.replace(temporary, self.path)
+
+    def __len__(self):
+        return len(self.pending)
+
+    def enqueue(self, status, tweet_time=None):
+        """Queue a status unless the same text is already waiting. Returns True if it was queued."""
+        with self._lock:
+            if any(entry["status"] == status for entry in self.pending):
+                TWEETS.inc(outcome="duplicate")
+                logger.info("The same tweet is already waiting to be sent.")
+                return False
+            now = self.clock()
+            self.pending.append({
+                "status": status,
+                "time": str(tweet_time if tweet_time is not None else now),
+                "queued": now,
+                "attempts": 0,
+                "not_before": now,
+            })
+            self._save()
+        TWEETS.inc(outcome="queued")
+        self.wakeup.set()
+        return True
+
+    def seconds_until_due(self):
+        """Seconds until the next status may be posted, None when the queue is empty."""
+        with self._lock:
+            if not self.pending:
+                return None
+            return max(self.blocked_until, self.pending[0]["not_before"]) - self.clock()
+
+    def _rate_limit_from_headers(self, twitter, now):
+        header = getattr(twitter, "get_lastfunction_header", None)
+        if header is None:
+            return
+        remaining = header("x-rate-limit-remaining")
+        if remaining is not None and str(remaining).strip() == "0":
+            self.blocked_until = _reset_time(header("x-rate-limit-reset"), now)
+            logger.warning(f"Tweet rate limit used up, holding the queue for {self.blocked_until - now:.0f} seconds.")
+
+    def send_due(self, twitter, on_sent=None):
+        """Post the oldest status if it is due. Returns the seconds until the next one is due (None if empty)."""
+        from twython import TwythonError, TwythonRateLimitError
+
+        wait = self.seconds_until_due()
+        if wait is None or wait > 0:
+            return wait
+        entry = self.pending[0]
+        try:
+            metrics.call("update_status", twitter.update_status, status=entry["status"])
+        except TwythonError as e:
+            now = self.clock()
+            with self._lock:
+                if isinstance(e, TwythonRateLimitError) or e.error_code in RATE_LIMIT_CODES:
+                    self.blocked_until = _reset_time(getattr(e, "retry_after", None), now)
+                    TWEETS.inc(outcome="rate_limited")
+                    logger.warning(f"Rate limited, holding the queue for {self.blocked_until - now:.0f} seconds.")
+                else:
+                    entry["attempts"] += 1
+                    refused = e.error_code is not None and 400 <= e.error_code < 500
+                    if refused or entry["attempts"] >= MAX_ATTEMPTS:
+                        self.pending.remove(entry)
+                        self.failed.append(dict(entry, error=str(e)))
+                        del self.failed[:-MAX_FAILED]
+                        TWEETS.inc(outcome="failed")
+                        logger.error(f"Tweet not sent, giving up after {entry['attempts']} attempts: {e}")
+                    else:
+                        delay = min(rf.backoff_delay(entry["attempts"], base=30, cap=RETRY_CAP, rng=self.rng), RETRY_CAP)
+                        entry["not_before"] = now + delay
+                        TWEETS.inc(outcome="retry")
+                        logger.error(f"Tweet not sent, retrying in {delay:.0f} seconds: {e}")
+                self._save()
+        else:
+            now = self.clock()
+            with self._lock:
+                self.pending.remove(entry)
+                self._rate_limit_from_headers(twitter, now)
+                self._save()
+            TWEETS.inc(outcome="sent")
+            logger.info("Tweet sent.")
+            if on_sent is not None:
+                on_sent(entry)
+        return self.seconds_until_due()
+
+    def drain(self, twitter, on_sent=None):
+        """Post every status that is due now. Returns the seconds until the next one is due (None if empty)."""
+        while True:
+            count = len(self.pending)
+            wait = self.send_due(twitter, on_sent)
+            if wait is None or wait > 0 or len(self.pending) == count:
+                return wait
+
+
+class TweetSender:
+    """Background thread posting the queue as Twitter allows."""
+
+    def __init__(self, tweet_queue, twitter, on_sent=None):
+        self.queue = tweet_queue
+        self.twitter = twitter
+        self.on_sent = on_sent
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="tweet-sender", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self.queue.wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.queue.wakeup.clear()
+            try:
+                wait = self.queue.drain(self.twitter, self.on_sent)
+            except Exception as e:  # keep the sender alive whatever one post does
+                logger.error(f"Tweet sender error: {e}")
+                wait = 60
+            self.queue.wakeup.wait(IDLE_WAIT if wait is None else max(wait, 0.1))